@@ -0,0 +1,206 @@
+"""Acquisition throughput benchmark of the picam 2D viewer plugin, using the simulated camera backend.
+
+Runs the plugin the way PyMoDAQ does in continuous grab (grab_data is called again as soon as data has been
+emitted) and measures, for each scenario, the sustained emitted frame rate, the number of acquired frames that were
+never delivered to the viewer, and the grab_data -> data_grabed_signal latency.
+
+Usage::
+
+    python benchmarks/bench_acquisition.py
+    python benchmarks/bench_acquisition.py --scenario 1024x1024@200 --duration 5 --min-fps 150 --json out.json
+    python benchmarks/bench_acquisition.py --gui-load 30 --process
+
+With --min-fps or --max-drop-fraction, the exit code is non-zero when a scenario falls below the threshold, so that
+throughput regressions can be caught in CI (set QT_QPA_PLATFORM=offscreen on a headless machine). --gui-load keeps
+the event loop busy for a while every 50 ms, as plotting would, and --process runs the camera in a separate process.
+"""
+import argparse
+import json
+import sys
+import time
+
+import numpy as np
+from qtpy import QtWidgets, QtCore
+
+from pymodaq_plugins_princeton_instruments.daq_viewer_plugins.plugins_2D.daq_2Dviewer_picam import \
+    DAQ_2DViewer_picam
+
+DEFAULT_SCENARIOS = ['256x256@100', '256x256@1000', '1024x1024@100', '2048x2048@30']
+
+
+def parse_scenario(scenario):
+    """Parse a 'WIDTHxHEIGHT@FPS' string."""
+    size, fps = scenario.split('@')
+    width, height = size.split('x')
+    return int(width), int(height), float(fps)
+
+
+class StatusReceiver(QtCore.QObject):
+    """Stand-in for the DAQ_Viewer parent of the plugin, collecting the status messages."""
+    status_sig = QtCore.Signal(object)
+
+    def __init__(self, verbose=False):
+        super().__init__()
+        self.verbose = verbose
+        self.status_sig.connect(self.show_status)
+
+    def show_status(self, status):
+        if self.verbose and status.command == 'Update_Status':
+            print(*status.attributes)
+
+
+class AcquisitionBenchmark(QtCore.QObject):
+    """Drive the plugin in continuous grab and collect timings."""
+    def __init__(self, plugin, duration, naverage=1, gui_load=0.):
+        super().__init__()
+        self.plugin = plugin
+        self.duration = duration
+        self.naverage = naverage
+        self.gui_load = gui_load
+        self.latencies = []
+        self.n_emitted = 0
+        self.running = False
+        self._t_grab = None
+        # Set while the frames of a grab are emitted, so that the view preparations are not counted
+        self._grabbing = False
+        self.plugin.data_grabed_signal.connect(self.data_received)
+        self.plugin.data_grabed_signal_temp.connect(self.count_frames)
+
+    def grab(self):
+        if self.running:
+            self._t_grab = time.perf_counter()
+            self.plugin.grab_data(Naverage=self.naverage)
+            self._grabbing = True
+
+    def count_frames(self, data):
+        """Count the frames in emitted data, stacked bursts holding several of them and averages naverage. The
+        temporary data emitted outside of a grab is a view preparation, not frames."""
+        if self._grabbing:
+            self.n_emitted += len(data[0]['data'][0]) if data[0]['dim'] == 'DataND' else self.naverage
+
+    def load_gui(self):
+        """Keep the event loop busy for gui_load (in s)."""
+        t0 = time.perf_counter()
+        while time.perf_counter() - t0 < self.gui_load:
+            pass
+
+    def data_received(self, data):
+        self.latencies.append(time.perf_counter() - self._t_grab)
+        self.count_frames(data)
+        self._grabbing = False
+        QtCore.QTimer.singleShot(0, self.grab)
+
+    def run(self):
+        loop = QtCore.QEventLoop()
+        self.running = True
+        t0 = time.perf_counter()
+        QtCore.QTimer.singleShot(0, self.grab)
+        QtCore.QTimer.singleShot(int(self.duration * 1000), loop.quit)
+        load_timer = QtCore.QTimer()
+        if self.gui_load:
+            load_timer.timeout.connect(self.load_gui)
+            load_timer.start(50)
+        loop.exec_()
+        load_timer.stop()
+        self.running = False
+        elapsed = time.perf_counter() - t0
+        acquired = self.plugin.controller.get_frames_status().acquired
+        self.plugin.stop()
+        return elapsed, acquired
+
+
+def run_scenario(scenario, duration, readout_mode='Newest frame', burst_emission='Stacked block', naverage=1,
+                 max_display_rate=None, verbose=False, gui_load=0., process=False):
+    width, height, fps = parse_scenario(scenario)
+    plugin = DAQ_2DViewer_picam(StatusReceiver(verbose), None)
+    plugin.settings.child('backend').setValue('Simulated')
+    plugin.settings.child('separate_process').setValue(process)
+    plugin.settings.child('serial_number').setValue('SIM-0001')
+    plugin.settings.child('simulation', 'frame_rate').setValue(fps)
+    plugin.settings.child('simulation', 'sensor_width').setValue(width)
+    plugin.settings.child('simulation', 'sensor_height').setValue(height)
+    status = plugin.ini_detector()
+    if not status.initialized:
+        raise RuntimeError(status.info)
+    settings = [('readout_mode', readout_mode), ('burst_emission', burst_emission)]
+    if max_display_rate is not None:
+        settings += [('max_display_rate', max_display_rate), ('display_throttling', True)]
+    for name, value in settings:
+        plugin.settings.child('acquisition', name).setValue(value)
+        plugin.commit_settings(plugin.settings.child('acquisition', name))
+    try:
+        bench = AcquisitionBenchmark(plugin, duration, naverage, gui_load)
+        elapsed, acquired = bench.run()
+        overruns = plugin.settings.child('acquisition', 'overruns').value()
+        stages = plugin.profiler.summary()
+    finally:
+        plugin.close()
+    latencies = np.array(bench.latencies) * 1E3 if bench.latencies else np.zeros(1)
+    return {'scenario': scenario,
+            'target_fps': fps,
+            'emitted_fps': bench.n_emitted / elapsed,
+            'acquired': acquired,
+            'emitted': bench.n_emitted,
+            'dropped': max(acquired - bench.n_emitted, 0),
+            'drop_fraction': max(acquired - bench.n_emitted, 0) / acquired if acquired else 0.,
+            'overruns': overruns,
+            'latency_ms_median': float(np.median(latencies)),
+            'latency_ms_p95': float(np.percentile(latencies, 95)),
+            'latency_ms_max': float(np.max(latencies)),
+            'stages': stages,
+            }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--scenario', action='append', help="WIDTHxHEIGHT@FPS, can be repeated")
+    parser.add_argument('--duration', type=float, default=3., help="duration of each scenario in s")
+    parser.add_argument('--min-fps', type=float, default=None, help="fail if the emitted fps is below this value")
+    parser.add_argument('--max-drop-fraction', type=float, default=None,
+                        help="fail if the fraction of frames not delivered to the viewer is above this value")
+    parser.add_argument('--json', default=None, help="write the results to this file")
+    parser.add_argument('--readout-mode', default='Newest frame', choices=['Newest frame', 'Lossless burst'])
+    parser.add_argument('--burst-emission', default='Stacked block', choices=['Stacked block', 'Sequence'])
+    parser.add_argument('--naverage', type=int, default=1, help="number of frames averaged per emission (block mode)")
+    parser.add_argument('--max-display-rate', type=float, default=None,
+                        help="enable display throttling at this rate (Hz): frames are drained at full speed but only "
+                             "the latest one is emitted, overruns then count the frames lost in the camera buffer")
+    parser.add_argument('--stages', action='store_true',
+                        help="print the per-stage timings of the plugin pipeline (see picam_diagnostics)")
+    parser.add_argument('--gui-load', type=float, default=0.,
+                        help="time (in ms) the event loop is kept busy every 50 ms, simulating a loaded GUI")
+    parser.add_argument('--process', action='store_true', help="run the camera in a separate process")
+    parser.add_argument('--verbose', action='store_true', help="print the plugin status messages")
+    args = parser.parse_args(argv)
+
+    app = QtWidgets.QApplication.instance() or QtWidgets.QApplication(sys.argv)
+    results = [run_scenario(scenario, args.duration, args.readout_mode, args.burst_emission, args.naverage,
+                            args.max_display_rate, args.verbose, args.gui_load * 1E-3, args.process)
+               for scenario in (args.scenario or DEFAULT_SCENARIOS)]
+
+    print(f"{'scenario':>18} {'fps':>9} {'acquired':>9} {'emitted':>8} {'dropped':>8} "
+          f"{'overruns':>8} {'lat. med':>9} {'lat. p95':>9} {'lat. max':>9}")
+    for res in results:
+        print(f"{res['scenario']:>18} {res['emitted_fps']:9.1f} {res['acquired']:9d} {res['emitted']:8d} "
+              f"{res['dropped']:8d} {res['overruns']:8d} {res['latency_ms_median']:7.2f}ms {res['latency_ms_p95']:7.2f}ms "
+              f"{res['latency_ms_max']:7.2f}ms")
+    if args.stages:
+        for res in results:
+            print(f"\n{res['scenario']}: {'stage':>10} {'count':>7} {'p50':>9} {'p90':>9} {'p99':>9} {'max':>9}")
+            for stage, stats in res['stages'].items():
+                print(f"{'':>{len(res['scenario']) + 1}} {stage:>10} {stats['count']:7d} {stats['p50_ms']:7.3f}ms "
+                      f"{stats['p90_ms']:7.3f}ms {stats['p99_ms']:7.3f}ms {stats['max_ms']:7.3f}ms")
+    if args.json is not None:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    failed = [res['scenario'] for res in results
+              if any([args.min_fps is not None and res['emitted_fps'] < args.min_fps,
+                      args.max_drop_fraction is not None and res['drop_fraction'] > args.max_drop_fraction])]
+    if failed:
+        print(f"Throughput regression in: {', '.join(failed)}")
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,32 @@
+from pymodaq.daq_viewer.utility_classes import main
+
+from ..plugins_2D.daq_2Dviewer_picam import DAQ_2DViewer_picam
+from ...hardware.picam_processing import FRAME_STATISTICS
+
+# Statistics selected by default, for alignment and monitoring
+DEFAULT_STATISTICS = ['Sum', 'Max', 'Saturated pixels', 'Centroid']
+
+
+class DAQ_0DViewer_picam(DAQ_2DViewer_picam):
+    """
+        Monitoring version of the picam viewer, emitting only statistics of the frames (or of each ROI) as 0D data.
+
+        The statistics are computed in the acquisition thread and the frames themselves are never sent to the
+        viewer, e.g. for alignment or to monitor the signal and saturation during long scans.
+
+        See Also
+        --------
+        DAQ_2DViewer_picam, picam_processing.FrameStatistics
+    """
+    def __init__(self, parent=None, params_state=None):
+        super().__init__(parent, params_state)
+        statistics = self.settings.child('statistics')
+        if not statistics.child('selected').value()['selected']:
+            statistics.child('selected').setValue(dict(all_items=FRAME_STATISTICS, selected=DEFAULT_STATISTICS))
+        statistics.child('emit_frames').setValue(False)
+        statistics.child('emit_frames').hide()
+        statistics.setOpts(expanded=True)
+
+
+if __name__ == '__main__':
+    main(__file__)
@@ -0,0 +1,143 @@
+from easydict import EasyDict as edict
+from pymodaq.daq_utils.daq_utils import ThreadCommand, getLineInfo
+from pymodaq.daq_viewer.utility_classes import main
+
+from ..plugins_2D.daq_2Dviewer_picam import DAQ_2DViewer_picam
+from ...hardware.picam_processing import sum_tracks
+from ...hardware.picam_utils import remove_settings_from_list
+
+BINNING_MODES = ['Full vertical binning', 'Multi-track']
+
+
+class DAQ_1DViewer_picam(DAQ_2DViewer_picam):
+    """
+        Spectroscopy version of the picam viewer, emitting only spectra.
+
+        The sensor rows are binned into one spectrum (full vertical binning) or into several equally spaced tracks
+        (multi-track). Contiguous tracks are binned on chip through the ROIs attribute, so that a single row per
+        track is read out. When the tracks are not contiguous, or when the camera does not accept the requested
+        binning, the rows of each track are read and summed in software.
+
+        See Also
+        --------
+        DAQ_2DViewer_picam
+    """
+    # The ROIs are set by the tracks
+    picam_params = remove_settings_from_list(DAQ_2DViewer_picam.picam_params, ['Multiple ROIs']) + [
+        {'title': 'Spectroscopy', 'name': 'spectroscopy', 'type': 'group', 'children': [
+            {'title': 'Binning mode:', 'name': 'binning_mode', 'type': 'list', 'value': 'Full vertical binning',
+             'limits': BINNING_MODES},
+            {'title': 'Number of tracks:', 'name': 'track_count', 'type': 'int', 'value': 1, 'min': 1},
+            {'title': 'First track row:', 'name': 'track_start', 'type': 'int', 'value': 0, 'min': 0},
+            {'title': 'Track height:', 'name': 'track_height', 'type': 'int', 'value': 10, 'min': 1},
+            {'title': 'Track spacing (rows):', 'name': 'track_spacing', 'type': 'int', 'value': 10, 'min': 1},
+            {'title': 'Binning:', 'name': 'binning', 'type': 'str', 'value': '', 'readonly': True},
+        ]},
+    ]
+    group_commits = dict(DAQ_2DViewer_picam.group_commits, spectroscopy='_commit_rois')
+
+    def __init__(self, parent=None, params_state=None):
+        super().__init__(parent, params_state)
+        # (count, height, spacing) of the tracks summed in software, None when binned on chip
+        self._software_tracks = None
+        self._binning_configured = False
+        # Whether the ROI of changed tracks is held with the pending camera changes
+        self._binning_pending = False
+
+    def _get_tracks(self):
+        """Number, first row, height and spacing of the tracks, fitted in the sensor."""
+        sensor_height = self.controller.get_detector_size()[1]
+        if self.settings.child('spectroscopy', 'binning_mode').value() == 'Full vertical binning':
+            return 1, 0, sensor_height, sensor_height
+        start = min(self.settings.child('spectroscopy', 'track_start').value(), sensor_height - 1)
+        height = min(self.settings.child('spectroscopy', 'track_height').value(), sensor_height - start)
+        spacing = max(self.settings.child('spectroscopy', 'track_spacing').value(), height)
+        count = min(self.settings.child('spectroscopy', 'track_count').value(),
+                    (sensor_height - start - height) // spacing + 1)
+        if count != self.settings.child('spectroscopy', 'track_count').value():
+            self.emit_status(ThreadCommand('Update_Status', [f'Only {count} track(s) fit in the sensor', 'log']))
+        return count, start, height, spacing
+
+    def _configure_binning(self, hold=None):
+        """Set the ROI for the tracks, binning them on chip when possible. The horizontal part of the ROI is
+        taken from the ROI parameters. If `hold` (by default, if camera changes are held), the ROI is only kept
+        pending, the binning being set up once the pending changes are applied."""
+        count, start, height, spacing = self._get_tracks()
+        horizontal = tuple(self.settings.child('settable_camera_parameters', 'rois', name).value()
+                           for name in ['x', 'width', 'x_binning'])
+        if hold is None:
+            hold = self.settings.child('batch', 'hold').value()
+        if hold:
+            vertical = (start, count * height, height) if spacing == height else \
+                (start, (count - 1) * spacing + height, 1)
+            self._hold_change('ROIs', [horizontal + vertical])
+            self._binning_pending = True
+            return
+        self._binning_pending = False
+        self._binning_configured = True
+        hardware = False
+        if spacing == height:
+            # Contiguous tracks: each track is read out as a single binned row
+            self._software_tracks = None
+            try:
+                self._set_roi(horizontal + (start, count * height, height))
+                hardware = tuple(self.snapshot.values['ROIs'][0])[3:] == (start, count * height, height)
+            except Exception as e:
+                self.emit_status(ThreadCommand('Update_Status', [f'Hardware binning rejected: {e}', 'log']))
+        if not hardware:
+            # Read all the rows of the tracks, and sum them in software
+            self._software_tracks = (count, height, spacing)
+            self._set_roi(horizontal + (start, (count - 1) * spacing + height, 1))
+        self.settings.child('spectroscopy', 'binning').setValue('Hardware' if hardware else 'Software')
+        self.emit_status(ThreadCommand('Update_Status',
+                                       [f'{count} track(s) binned in {"hardware" if hardware else "software"}']))
+        self._prepare_view()
+
+    def _apply_pending_changes(self):
+        """Apply the pending changes, then set up the binning of the tracks changed meanwhile, checking whether the
+        camera accepted it."""
+        binning_pending = self._binning_pending
+        super()._apply_pending_changes()
+        if binning_pending:
+            self._configure_binning(hold=False)
+
+    def _discard_pending_changes(self):
+        self._binning_pending = False
+        super()._discard_pending_changes()
+
+    def _prepare_view(self):
+        """The viewer only displays spectra once the binning is set up."""
+        if self._binning_configured:
+            super()._prepare_view()
+
+    def _frames_to_channels(self, frames):
+        """One spectrum channel per track."""
+        if self._software_tracks is not None:
+            frames = sum_tracks(frames, *self._software_tracks)
+        return [frames[:, ind] for ind in range(frames.shape[1])]
+
+    def _channel_labels(self):
+        ntracks = self._software_tracks[0] if self._software_tracks is not None else \
+            self._get_frame_shape()[0]
+        if ntracks == 1:
+            return ['Picam_Spectrum']
+        return [f'Picam_Track{ind}' for ind in range(ntracks)]
+
+    def _commit_rois(self, param):
+        # The vertical part of the ROI is set by the tracks, held with the other camera changes if they are
+        self._configure_binning()
+
+    def ini_detector(self, controller=None):
+        """Detector communication initialization, then setting up the binning (see DAQ_2DViewer_picam)."""
+        self.status = super().ini_detector(controller)
+        if self.status.initialized:
+            try:
+                self._configure_binning()
+            except Exception as e:
+                self.emit_status(ThreadCommand('Update_Status', [getLineInfo() + str(e), 'log']))
+                self.status.update(edict(initialized=False, info=getLineInfo() + str(e)))
+        return self.status
+
+
+if __name__ == '__main__':
+    main(__file__)
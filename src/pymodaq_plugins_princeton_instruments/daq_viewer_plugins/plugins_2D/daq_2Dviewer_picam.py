@@ -1,13 +1,35 @@
+import collections
+import json
+import threading
+import time
+
 import numpy as np
 from easydict import EasyDict as edict
 from pymodaq.daq_utils.daq_utils import ThreadCommand, getLineInfo, DataFromPlugins, Axis
+from pymodaq.daq_utils.config import get_set_local_dir
 from pymodaq.daq_viewer.utility_classes import DAQ_Viewer_base, comon_parameters, main
 
 from qtpy import QtWidgets, QtCore
 
-from ...hardware.picam_utils import define_pymodaq_pyqt_parameter, sort_by_priority_list, remove_settings_from_list
+from ...hardware.picam_utils import normalise_name, AttributeSnapshot, VOLATILE_ATTRIBUTES, get_roi_shape, parse_rois, format_rois
+from ...hardware.picam_schema import SchemaCache, build_camera_schema, fill_schema_values
+from ...hardware.picam_backends import BACKENDS, LazyCameraParams, camera_enumeration
+from ...hardware.picam_manager import camera_manager
+from ...hardware.picam_processing import AVERAGING_MODES, AUTO_EXPOSURE_MODES, COSMIC_RAY_METHODS, FRAME_STATISTICS, \
+    FrameAccumulator, FrameTracker, CosmicRayFilter, FrameStatistics, AutoExposure, split_rois
+from ...hardware.picam_buffers import SLOT_REUSE_POLICIES, FrameRingBuffer
+from ...hardware.picam_recorder import RECORDING_FORMATS, BACKPRESSURE_POLICIES, StreamRecorder
+from ...hardware.picam_diagnostics import PIPELINE_STAGES, PipelineProfiler
+from ...hardware.picam_corrections import CalibrationCache, FrameCorrector, make_correction_key
+
+# What to do with the status polls due while acquiring
+STATUS_POLLING_POLICIES = ['After next frame', 'Skip']
+
+# Trigger Response values of the armed scan trigger options
+SCAN_TRIGGERS = {'Internal': 'No Response',
+                 'External, readout per trigger': 'Readout Per Trigger',
+                 'External, exposure during pulse': 'Expose During Trigger Pulse'}
 
-import pylablib.devices.PrincetonInstruments as PI
 
 class DAQ_2DViewer_picam(DAQ_Viewer_base):
     """
@@ -22,18 +44,186 @@ class DAQ_2DViewer_picam(DAQ_Viewer_base):
         --------
         utility_classes.DAQ_Viewer_base
     """
-    _dvcs = PI.list_cameras()
-    serialnumbers = [dvc.serial_number for dvc in _dvcs]
-
-    params = comon_parameters + [
+    # Cameras are enumerated when the parameters are requested, not at import (see LazyCameraParams)
+    picam_params = comon_parameters + [
         {'title': 'Controller ID:', 'name': 'controller_id', 'type': 'str', 'value': '', 'readonly': True},
-        {'title': 'Serial number:', 'name': 'serial_number', 'type': 'list', 'limits': serialnumbers},
-        {'title': 'Simple Settings', 'name': 'simple_settings', 'type': 'bool', 'value': True}
+        {'title': 'Backend:', 'name': 'backend', 'type': 'list', 'value': 'Picam', 'limits': BACKENDS},
+        {'title': 'Serial number:', 'name': 'serial_number', 'type': 'list', 'limits': []},
+        {'title': 'Refresh cameras:', 'name': 'refresh_cameras', 'type': 'bool_push', 'label': 'Refresh',
+         'value': False},
+        {'title': 'Simple Settings', 'name': 'simple_settings', 'type': 'bool', 'value': True},
+        {'title': 'Reuse parameter layout:', 'name': 'cache_layout', 'type': 'bool', 'value': True,
+         'tip': 'Build the camera parameters from the layout saved at the previous initialization'},
+        {'title': 'Separate process:', 'name': 'separate_process', 'type': 'bool', 'value': False,
+         'tip': 'Run the camera in its own process, frames being passed through shared memory (applied at the '
+                'next initialization)'},
+        {'title': 'Simulation', 'name': 'simulation', 'type': 'group', 'expanded': False, 'children': [
+            {'title': 'Frame rate (Hz, 0: from exposure):', 'name': 'frame_rate', 'type': 'float', 'value': 0.,
+             'min': 0.},
+            {'title': 'Sensor width:', 'name': 'sensor_width', 'type': 'int', 'value': 512, 'min': 1},
+            {'title': 'Sensor height:', 'name': 'sensor_height', 'type': 'int', 'value': 512, 'min': 1},
+        ]},
+        {'title': 'Batch changes', 'name': 'batch', 'type': 'group', 'expanded': False, 'children': [
+            {'title': 'Hold camera changes:', 'name': 'hold', 'type': 'bool', 'value': False,
+             'tip': 'Camera parameter and ROI edits are kept pending until applied together'},
+            {'title': 'Pending:', 'name': 'pending', 'type': 'str', 'value': '', 'readonly': True},
+            {'title': 'Apply pending:', 'name': 'apply', 'type': 'bool_push', 'label': 'Apply', 'value': False},
+            {'title': 'Discard pending:', 'name': 'discard', 'type': 'bool_push', 'label': 'Discard', 'value': False},
+            {'title': 'Preset:', 'name': 'preset', 'type': 'list', 'value': '', 'limits': []},
+            {'title': 'Load preset:', 'name': 'load_preset', 'type': 'bool_push', 'label': 'Load', 'value': False},
+            {'title': 'New preset name:', 'name': 'preset_name', 'type': 'str', 'value': ''},
+            {'title': 'Save preset:', 'name': 'save_preset', 'type': 'bool_push', 'label': 'Save', 'value': False},
+        ]},
+        {'title': 'Multiple ROIs', 'name': 'multi_roi', 'type': 'group', 'expanded': False, 'children': [
+            {'title': 'Enabled:', 'name': 'enabled', 'type': 'bool', 'value': False},
+            {'title': 'ROIs (x, width, x_binning, y, height, y_binning per line):', 'name': 'roi_list',
+             'type': 'text', 'value': ''},
+            {'title': 'Apply:', 'name': 'apply', 'type': 'bool_push', 'label': 'Apply', 'value': False},
+        ]},
+        {'title': 'Acquisition', 'name': 'acquisition', 'type': 'group', 'children': [
+            {'title': 'Readout mode:', 'name': 'readout_mode', 'type': 'list', 'value': 'Newest frame',
+             'limits': ['Newest frame', 'Lossless burst']},
+            {'title': 'Burst emission:', 'name': 'burst_emission', 'type': 'list', 'value': 'Stacked block',
+             'limits': ['Stacked block', 'Sequence'],
+             'tip': 'Sequence: the frames are displayed one by one, but only the last one of each grab is saved'},
+            {'title': 'Buffer size (frames):', 'name': 'buffer_frames', 'type': 'int', 'value': 100, 'min': 1},
+            {'title': 'Averaging mode:', 'name': 'averaging_mode', 'type': 'list', 'value': 'Block',
+             'limits': AVERAGING_MODES},
+            {'title': 'Display throttling:', 'name': 'display_throttling', 'type': 'bool', 'value': False},
+            {'title': 'Max display rate (Hz):', 'name': 'max_display_rate', 'type': 'float', 'value': 25., 'min': 0.1},
+            {'title': 'Reset averaging:', 'name': 'reset_averaging', 'type': 'bool_push', 'label': 'Reset',
+             'value': False},
+            {'title': 'Max wait slice (s):', 'name': 'wait_slice', 'type': 'float', 'value': 0.2, 'min': 0.01,
+             'tip': 'Frames are waited for in slices of at most this duration, bounding the time taken to stop'},
+            {'title': 'Overruns:', 'name': 'overruns', 'type': 'int', 'value': 0, 'readonly': True},
+            {'title': 'Frame slots:', 'name': 'ring_slots', 'type': 'int', 'value': 16, 'min': 1},
+            {'title': 'Slot reuse policy:', 'name': 'slot_policy', 'type': 'list', 'value': 'Drop',
+             'limits': SLOT_REUSE_POLICIES},
+            {'title': 'Frame slots memory (MB):', 'name': 'ring_memory', 'type': 'float', 'value': 0.,
+             'readonly': True},
+        ]},
+        {'title': 'Armed scan', 'name': 'scan', 'type': 'group', 'expanded': False, 'children': [
+            {'title': 'Enabled:', 'name': 'enabled', 'type': 'bool', 'value': False,
+             'tip': 'Arm the camera once for a fixed number of frames, each grab consuming the next one(s)'},
+            {'title': 'Armed frames:', 'name': 'frames', 'type': 'int', 'value': 1000, 'min': 1,
+             'tip': 'Number of scan steps times the number of averaged frames'},
+            {'title': 'Trigger:', 'name': 'trigger', 'type': 'list', 'value': 'Internal',
+             'limits': list(SCAN_TRIGGERS)},
+            {'title': 'Frames consumed:', 'name': 'consumed', 'type': 'int', 'value': 0, 'readonly': True},
+            {'title': 'Re-arm:', 'name': 're_arm', 'type': 'bool_push', 'label': 'Re-arm', 'value': False},
+        ]},
+        {'title': 'Frame tracking', 'name': 'frame_tracking', 'type': 'group', 'expanded': False, 'children': [
+            {'title': 'Enabled:', 'name': 'enabled', 'type': 'bool', 'value': False},
+            {'title': 'Emit as 0D channels:', 'name': 'emit_channels', 'type': 'bool', 'value': False},
+            {'title': 'Frame gaps:', 'name': 'frame_gaps', 'type': 'int', 'value': 0, 'readonly': True},
+            {'title': 'Latency (ms):', 'name': 'latency', 'type': 'float', 'value': 0., 'readonly': True},
+            {'title': 'Frame interval (ms):', 'name': 'frame_interval', 'type': 'float', 'value': 0.,
+             'readonly': True},
+        ]},
+        {'title': 'Corrections', 'name': 'corrections', 'type': 'group', 'expanded': False, 'children': [
+            {'title': 'Subtract dark:', 'name': 'dark_enabled', 'type': 'bool', 'value': False},
+            {'title': 'Flat field:', 'name': 'flat_enabled', 'type': 'bool', 'value': False},
+            {'title': 'Frames per master:', 'name': 'calibration_frames', 'type': 'int', 'value': 20, 'min': 1},
+            {'title': 'Acquire dark:', 'name': 'acquire_dark', 'type': 'bool_push', 'label': 'Acquire',
+             'value': False},
+            {'title': 'Acquire flat:', 'name': 'acquire_flat', 'type': 'bool_push', 'label': 'Acquire',
+             'value': False},
+            {'title': 'Cached settings (memory):', 'name': 'cache_entries', 'type': 'int', 'value': 8, 'min': 1},
+            {'title': 'Clear cache:', 'name': 'clear_cache', 'type': 'bool_push', 'label': 'Clear', 'value': False},
+            {'title': 'Masters:', 'name': 'status', 'type': 'str', 'value': '', 'readonly': True},
+        ]},
+        {'title': 'Cosmic rays', 'name': 'cosmic_rays', 'type': 'group', 'expanded': False, 'children': [
+            {'title': 'Method:', 'name': 'method', 'type': 'list', 'value': 'Off', 'limits': COSMIC_RAY_METHODS},
+            {'title': 'Median history (frames):', 'name': 'history', 'type': 'int', 'value': 5, 'min': 3},
+            {'title': 'Threshold (noise sigma):', 'name': 'threshold', 'type': 'float', 'value': 8., 'min': 1.},
+            {'title': 'Emit hits as 0D channel:', 'name': 'emit_channel', 'type': 'bool', 'value': True},
+            {'title': 'Hits (last frame):', 'name': 'hits', 'type': 'int', 'value': 0, 'readonly': True},
+            {'title': 'Hits (total):', 'name': 'total_hits', 'type': 'int', 'value': 0, 'readonly': True},
+        ]},
+        {'title': 'Frame statistics', 'name': 'statistics', 'type': 'group', 'expanded': False, 'children': [
+            {'title': 'Statistics:', 'name': 'selected', 'type': 'itemselect',
+             'value': dict(all_items=FRAME_STATISTICS, selected=[])},
+            {'title': 'Emit frames:', 'name': 'emit_frames', 'type': 'bool', 'value': True,
+             'tip': 'Uncheck to only emit the statistics, as 0D data'},
+            {'title': 'Saturation level:', 'name': 'saturation', 'type': 'int', 'value': 65535, 'readonly': True},
+        ]},
+        {'title': 'Auto exposure', 'name': 'auto_exposure', 'type': 'group', 'expanded': False, 'children': [
+            {'title': 'Mode:', 'name': 'mode', 'type': 'list', 'value': 'Off', 'limits': AUTO_EXPOSURE_MODES,
+             'tip': 'Once: adjust the exposure time until the target is reached, Continuous: follow the signal'},
+            {'title': 'Target fill (%):', 'name': 'target', 'type': 'float', 'value': 70., 'min': 1., 'max': 99.,
+             'tip': 'Level of the bright pixels, in percent of the ADC full scale'},
+            {'title': 'Bright pixels percentile:', 'name': 'percentile', 'type': 'float', 'value': 99.5,
+             'min': 50., 'max': 100.},
+            {'title': 'Tolerance (%):', 'name': 'tolerance', 'type': 'float', 'value': 5., 'min': 0.5, 'max': 50.},
+            {'title': 'Subsampling:', 'name': 'subsampling', 'type': 'int', 'value': 4, 'min': 1,
+             'tip': 'The level is measured on one pixel out of n along each axis'},
+            {'title': 'Settling frames:', 'name': 'settling', 'type': 'int', 'value': 2, 'min': 0,
+             'tip': 'Frames ignored after each change, possibly exposed with the previous exposure time'},
+            {'title': 'Max iterations:', 'name': 'max_iterations', 'type': 'int', 'value': 10, 'min': 1},
+            {'title': 'Fill (%):', 'name': 'fill', 'type': 'float', 'value': 0., 'readonly': True},
+            {'title': 'Iterations:', 'name': 'iterations', 'type': 'int', 'value': 0, 'readonly': True},
+            {'title': 'State:', 'name': 'state', 'type': 'str', 'value': '', 'readonly': True},
+        ]},
+        {'title': 'Recording', 'name': 'recording', 'type': 'group', 'expanded': False, 'children': [
+            {'title': 'Record:', 'name': 'record', 'type': 'bool', 'value': False},
+            {'title': 'File:', 'name': 'path', 'type': 'browsepath', 'value': '', 'filetype': 'save'},
+            {'title': 'Format:', 'name': 'format', 'type': 'list', 'value': 'HDF5', 'limits': RECORDING_FORMATS},
+            {'title': 'Max frames (npy):', 'name': 'capacity', 'type': 'int', 'value': 10000, 'min': 1},
+            {'title': 'Queue size (batches):', 'name': 'queue_size', 'type': 'int', 'value': 64, 'min': 1},
+            {'title': 'When the queue is full:', 'name': 'backpressure', 'type': 'list', 'value': 'Block',
+             'limits': BACKPRESSURE_POLICIES},
+            {'title': 'Recorded frames:', 'name': 'recorded_frames', 'type': 'int', 'value': 0, 'readonly': True},
+            {'title': 'Dropped frames:', 'name': 'dropped_frames', 'type': 'int', 'value': 0, 'readonly': True},
+        ]},
+        {'title': 'Status polling', 'name': 'polling', 'type': 'group', 'expanded': False, 'children': [
+            {'title': 'Enabled:', 'name': 'enabled', 'type': 'bool', 'value': True,
+             'tip': 'Periodically read the sensor temperature and the calculated readout time and frame rate'},
+            {'title': 'Period (s):', 'name': 'period', 'type': 'float', 'value': 2., 'min': 0.2},
+            {'title': 'During acquisition:', 'name': 'during_acquisition', 'type': 'list',
+             'value': 'After next frame', 'limits': STATUS_POLLING_POLICIES,
+             'tip': 'Polls due while acquiring are merged into one, done right after a frame is emitted, or skipped'},
+            {'title': 'Cooling:', 'name': 'cooling', 'type': 'str', 'value': '', 'readonly': True},
+        ]},
+        {'title': 'Diagnostics', 'name': 'diagnostics', 'type': 'group', 'expanded': False, 'children': [
+            {'title': 'Initialization time:', 'name': 'init_time', 'type': 'str', 'value': '', 'readonly': True},
+            {'title': 'Stop latency (ms):', 'name': 'stop_latency', 'type': 'float', 'value': 0., 'readonly': True,
+             'tip': 'Time taken by the last stop until the acquisition thread was idle'},
+            {'title': 'Device calls (last commit):', 'name': 'commit_device_calls', 'type': 'int', 'value': 0,
+             'readonly': True},
+            {'title': 'Frames not stored, slots in use:', 'name': 'slot_drops', 'type': 'int', 'value': 0,
+             'readonly': True},
+            {'title': 'Resynchronize all:', 'name': 'resync', 'type': 'bool_push', 'label': 'Resync',
+             'value': False, 'tip': 'Read all the parameters from the camera again, and rebuild the parameter layout '
+                                    'at the next initialization'},
+            {'title': 'Stage timings (p50/p90/p99 ms)', 'name': 'timings', 'type': 'group', 'children': [
+                {'title': 'Enabled:', 'name': 'profiling', 'type': 'bool', 'value': True},
+                {'title': 'Window (samples):', 'name': 'window', 'type': 'int', 'value': 1000, 'min': 10},
+                {'title': 'Refresh period (s):', 'name': 'refresh_period', 'type': 'float', 'value': 1.,
+                 'min': 0.1},
+            ] + [{'title': f'{stage}:', 'name': stage, 'type': 'str', 'value': '', 'readonly': True,
+                  'tip': description} for stage, description in PIPELINE_STAGES.items()] + [
+                {'title': 'Export file:', 'name': 'export_path', 'type': 'browsepath', 'value': '',
+                 'filetype': 'save'},
+                {'title': 'Export:', 'name': 'export', 'type': 'bool_push', 'label': 'Export', 'value': False},
+                {'title': 'Reset:', 'name': 'reset', 'type': 'bool_push', 'label': 'Reset', 'value': False},
+            ]},
+        ]},
     ]
+    params = LazyCameraParams('picam_params')
 
     callback_signal = QtCore.Signal()
 
-    hardware_averaging = False
+    # Naverage is dealt with in the callback thread, see FrameAccumulator
+    hardware_averaging = True
+
+    # Method committing the changes of the parameters of each group, see commit_settings
+    group_commits = {'simulation': '_commit_simulation', 'rois': '_commit_rois', 'diagnostics': '_commit_diagnostics',
+                     'timings': '_commit_timings', 'scan': '_commit_scan', 'polling': '_commit_polling',
+                     'batch': '_commit_batch', 'multi_roi': '_commit_multi_roi', 'corrections': '_commit_corrections',
+                     'statistics': '_commit_statistics', 'auto_exposure': '_commit_auto_exposure',
+                     'cosmic_rays': '_commit_cosmic_rays', 'recording': '_commit_recording',
+                     'frame_tracking': '_commit_frame_tracking', 'acquisition': '_commit_acquisition',
+                     'settable_camera_parameters': '_commit_camera_parameter'}
 
     def __init__(self, parent=None, params_state=None):
         super().__init__(parent, params_state)
@@ -43,20 +233,384 @@ class DAQ_2DViewer_picam(DAQ_Viewer_base):
         self.y_axis = None
 
         self.data_shape = 'Data2D'
+        self._view_shape = 'Data2D'
+        self._view = (self.data_shape, self._view_shape, ())
         self.callback_thread = None
+        # Set to interrupt the frame waits of the callback thread
+        self._cancel_wait = threading.Event()
+        self._wait_slice_max = 0.2
+
+        # Cached acquisition settings, read from the callback thread
+        self.lossless = False
+        self.stacked = True
+        self._skipped_frames = 0
+        self._lost = 0
+        self.accumulator = FrameAccumulator()
+        # Frames handed off to the viewer are views of these preallocated slots, reused once no longer referenced
+        self.ring_buffer = FrameRingBuffer()
+        self._frame_dtype = np.uint16
+
+        # Display throttling: the callback thread drains frames continuously and only hands the latest one over
+        # when a grab is pending and the display period has elapsed
+        self.display_throttled = False
+        self.display_period = 1 / 25.
+        self._grab_pending = threading.Event()
+        self._free_running = threading.Event()
+        self._last_display = 0.
+        self._latest_frame = None
+        self._latest_average = None
+
+        # Writes every acquired frame to disk when recording
+        self.recorder = None
+
+        # Decodes the frame stamps and time stamps of the read frames
+        self.tracker = FrameTracker()
+        self.tracking = False
+
+        # Durations of the pipeline stages, shown in the diagnostics group
+        self.profiler = PipelineProfiler()
+        self._last_timings_update = 0.
+
+        # Dark and flat corrections, applied in the callback thread with masters matching the current settings
+        self.corrector = FrameCorrector()
+        self.calibrations = None
+        self._correction_key = None
+
+        # Replaces the cosmic ray hits in the emitted frames, in the callback thread
+        self.cosmic_filter = CosmicRayFilter()
+        self._cosmic_hits = None
+
+        # Reductions of the emitted frames, computed in the callback thread and queued for emit_data as
+        # (statistics, exposure levels, cosmic ray hits) tuples
+        self.statistics = FrameStatistics()
+        self.emit_frames = True
+        self._statistics_queue = collections.deque()
+
+        # Exposure time adjusted from the levels of the emitted frames, requested by the callback thread and set
+        # at the next grab, see _step_auto_exposure
+        self.auto_exposure = AutoExposure()
+        self._exposure_request = None
+
+        # Camera changes held until applied together (see apply_changes)
+        self._pending_changes = {}
+
+        # Armed scan: frames of a single acquisition consumed in order by the grabs, see _arm_scan
+        self.scan_mode = False
+        self._scan_armed = False
+        self._scan_index = 0
+        self._scan_step = 1
+        self._scan_free_running = False
+        self._trigger_restore = None
+
+        # Periodic reading of the volatile read only attributes (see _poll_status)
+        self.status_timer = None
+        self._status_poll_pending = False
+
+        # Cached camera attributes, and the parameters displaying them
+        self.snapshot = None
+        self._attribute_params = {}
+
+    def _get_simulation_options(self):
+        """Options of the simulated backend, ignored by the real one."""
+        if self.settings.child('backend').value() != 'Simulated':
+            return {}
+        return dict(frame_rate=self.settings.child('simulation', 'frame_rate').value(),
+                    sensor_shape=(self.settings.child('simulation', 'sensor_height').value(),
+                                  self.settings.child('simulation', 'sensor_width').value()))
+
+    @staticmethod
+    def _schema_cache():
+        return SchemaCache(str(get_set_local_dir().joinpath('picam_schemas')))
+
+    def _get_camera_schema(self):
+        """Parameters of the camera attributes (settable and read only), their values by title, and where the layout
+        comes from. The layout saved for the camera is used if still valid, so that only the displayed values are
+        read. Otherwise it is built from all the attributes, and saved."""
+        simple = self.settings.child('simple_settings').value()
+        info = self.controller.get_device_info()
+        cache = self._schema_cache()
+        schema = cache.load(self.controller, info.model, info.serial_number, simple) \
+            if self.settings.child('cache_layout').value() else None
+        if schema is not None:
+            values = fill_schema_values(self.controller, schema)
+            return schema[0], schema[1], values, 'saved layout'
+        schema = build_camera_schema(self.controller, simple)
+        values = {param['title']: param['value'] for params in schema for param in params if 'value' in param}
+        if any(param['title'] == 'ROIs' for param in schema[0]):
+            values['ROIs'] = self.controller.get_attribute_value('ROIs')
+        try:
+            cache.save(self.controller, info.model, info.serial_number, schema, simple)
+        except Exception as e:
+            self.emit_status(ThreadCommand('Update_Status', [f'Could not save the parameter layout: {e}', 'log']))
+        return schema[0], schema[1], values, 'built'
+
+    def _apply_attribute_changes(self, values, limits, log=True):
+        """Update the parameters in the interface from changed attribute values and limits.
+        Log any detected changes while updating values in the UI, if `log`."""
+        for title, new_limits in limits.items():
+            self._attribute_params[title].setLimits(new_limits)
+        for title, newval in values.items():
+            param = self._attribute_params[title]
+            if title == 'ROIs':
+                # The ROI group holds one parameter per ROI field
+                for child, field_value in zip(param.children(), newval[0]):
+                    child.setValue(field_value)
+            else:
+                param.setValue(newval)
+            if log:
+                self.emit_status(ThreadCommand('Update_Status', [f'updated {title}: {newval}']))
+
+    def _configure_status_polling(self):
+        """Start, stop or change the period of the status polls."""
+        if self.status_timer is None:
+            return
+        self.status_timer.setInterval(int(self.settings.child('polling', 'period').value() * 1000))
+        if self.settings.child('polling', 'enabled').value():
+            self.status_timer.start()
+        else:
+            self.status_timer.stop()
+            self._status_poll_pending = False
+
+    def _poll_status(self):
+        """Status timer slot. While acquiring, the poll is left to emit_data (at most one pending poll, however many
+        periods elapsed) or skipped, so that the device is never queried from the acquisition thread."""
+        if self.controller is None:
+            return
+        if self.controller.acquisition_in_progress():
+            if self.settings.child('polling', 'during_acquisition').value() == 'After next frame':
+                self._status_poll_pending = True
+        else:
+            self._read_status()
+
+    def _read_status(self):
+        """Read the volatile attributes and update their parameters, without logging."""
+        self._status_poll_pending = False
+        try:
+            names = [name for name in VOLATILE_ATTRIBUTES if name in self.snapshot.values]
+            self._apply_attribute_changes(*self.snapshot.refresh(names), log=False)
+            temperature = self.snapshot.values.get('Sensor Temperature')
+            if temperature is None:
+                temperature = self.controller.get_attribute_value('Sensor Temperature', error_on_missing=False)
+            status = self.snapshot.values.get('Sensor Temperature Status')
+            if status is None:
+                # Hidden in simple settings
+                status = self.controller.get_attribute_value('Sensor Temperature Status', error_on_missing=False)
+            if temperature is not None:
+                self.settings.child('polling', 'cooling').setValue(
+                    f'{temperature:.1f} °C' + ('' if status is None else f', {status}'))
+        except Exception as e:
+            self.emit_status(ThreadCommand('Update_Status', [f'Status polling failed: {e}', 'log']))
 
     def _update_all_settings(self):
-        """Update all parameters in the interface from the values set in the device.
-        Log any detected changes while updating values in the UI."""
-        for grandparam in ['settable_camera_parameters', 'read_only_camera_parameters']:
-            for param in self.settings.child(grandparam).children():
-                # update limits in the parameter
-                self.controller.get_attribute(param.title()).update_limits()
-                # retrieve a value change in other parameters
-                newval = self.controller.get_attribute_value(param.title())
-                if newval != param.value():
-                    self.settings.child(grandparam, param.name()).setValue(newval)
-                    self.emit_status(ThreadCommand('Update_Status', [f'updated {param.title()}: {param.value()}']))
+        """Update all parameters in the interface from the values set in the device."""
+        self.snapshot.device_calls = 0
+        self._apply_attribute_changes(*self.snapshot.refresh())
+        self.settings.child('diagnostics', 'commit_device_calls').setValue(self.snapshot.device_calls)
+        self._update_corrections()
+
+    def _resync(self):
+        """Update all the parameters from the device, and remove the saved parameter layout of the camera so that it
+        is built again at the next initialization (e.g. if the camera attributes changed without the layout
+        noticing it)."""
+        self._update_all_settings()
+        info = self.controller.get_device_info()
+        try:
+            self._schema_cache().clear(info.model, info.serial_number)
+        except OSError as e:
+            self.emit_status(ThreadCommand('Update_Status', [f'Could not remove the parameter layout: {e}', 'log']))
+            return
+        self.emit_status(ThreadCommand('Update_Status', ['Parameter layout rebuilt at the next initialization']))
+
+    def _sync_settings(self, titles):
+        """Update the parameters in the interface after the attributes `titles` were modified. Only the attributes
+        which may depend on them are queried, once (see AttributeSnapshot), and the cost in device calls is
+        reported."""
+        self._apply_attribute_changes(*self.snapshot.refresh_after_changes(titles))
+        self.settings.child('diagnostics', 'commit_device_calls').setValue(self.snapshot.device_calls)
+        self._update_corrections()
+
+    def apply_changes(self, changes):
+        """Commit several camera attribute changes in a single pass.
+
+        Parameters
+        ----------
+        changes: (dict) new values by attribute title, 'ROIs' being a list of (x, width, x_binning, y, height,
+            y_binning) tuples
+
+        Unchanged values are skipped. The ROIs are checked by the camera with a single acquisition setup, and the
+        attributes depending on the changed ones are queried once for all of them.
+        """
+        acquiring = self.controller.acquisition_in_progress()
+        rois = changes.get('ROIs')
+        if rois is not None:
+            rois = [tuple(int(field) for field in roi) for roi in rois]
+            if rois == self._get_rois():
+                rois = None
+        self.snapshot.device_calls = 0
+        changed = []
+        for title, value in changes.items():
+            if title == 'ROIs' or self.snapshot.values.get(title) == value:
+                continue
+            attribute = self.controller.get_attribute(title, error_on_missing=False)
+            if attribute is None or not attribute.writable:
+                self.emit_status(ThreadCommand('Update_Status', [f'{title} cannot be set', 'log']))
+            elif acquiring and not attribute.can_set_online:
+                self.emit_status(ThreadCommand('Update_Status', [f'{title} cannot be set during acquisition', 'log']))
+            else:
+                self.controller.set_attribute_value(title, value, truncate=True, error_on_missing=True)
+                # The value may have been truncated, compare with what is displayed
+                self.snapshot.values[title] = value
+                self.snapshot.device_calls += 1
+                changed.append(title)
+        if rois is not None:
+            if len(rois) == 1:
+                new_x, new_width, new_xbinning, new_y, new_height, new_ybinning = rois[0]
+                self.controller.set_roi(new_x, new_x + new_width, new_y, new_y + new_height, hbin=new_xbinning,
+                                        vbin=new_ybinning)
+            else:
+                self.controller.set_rois(rois)
+            self.snapshot.device_calls += 1
+            changed.append('ROIs')
+            self.controller.clear_acquisition()
+            self.controller._commit_parameters()  # Needed so that the new ROIs are checked by the camera
+            self.controller.setup_acquisition()
+            # The camera may have adjusted the requested ROI, compare with what is displayed
+            for param, value in zip(self._attribute_params['ROIs'].children(), rois[0]):
+                param.setValue(value)
+            self.snapshot.values['ROIs'] = rois
+        if not changed:
+            return
+        self.emit_status(ThreadCommand('Update_Status', ['Changed ' + ', '.join(
+            f'{title}: {rois if title == "ROIs" else changes[title]}' for title in changed)]))
+        self.accumulator.reset()
+        self._sync_settings(changed)
+        if any(title.startswith('ADC') for title in changed):
+            self._configure_statistics()
+            self._configure_auto_exposure()
+        if rois is not None:
+            # Finally, prepare view for displaying the new data
+            self._prepare_view()
+
+    def _hold_change(self, title, value):
+        """Keep a camera change pending until the batch is applied."""
+        self._pending_changes[title] = value
+        self.settings.child('batch', 'pending').setValue(', '.join(self._pending_changes))
+
+    def _apply_pending_changes(self):
+        changes, self._pending_changes = self._pending_changes, {}
+        self.settings.child('batch', 'pending').setValue('')
+        self.apply_changes(changes)
+
+    def _discard_pending_changes(self):
+        """Forget the pending changes, displaying the values set in the camera again."""
+        self._pending_changes = {}
+        self.settings.child('batch', 'pending').setValue('')
+        self._apply_attribute_changes({title: value for title, value in self.snapshot.values.items()
+                                       if title in self._attribute_params}, {})
+        self._show_rois(self._get_rois())
+
+    def _preset_dir(self):
+        return get_set_local_dir().joinpath('picam_presets')
+
+    def _list_presets(self):
+        """Update the list of the saved presets."""
+        directory = self._preset_dir()
+        presets = sorted(path.stem for path in directory.glob('*.json')) if directory.is_dir() else []
+        self.settings.child('batch', 'preset').setLimits(presets)
+        return presets
+
+    def _save_preset(self):
+        """Save the values of the settable camera attributes and the ROIs, as set in the camera."""
+        name = self.settings.child('batch', 'preset_name').value().strip()
+        if not name:
+            self.emit_status(ThreadCommand('Update_Status', ['No preset name defined', 'log']))
+            return
+        titles = [param.title() for param in self.settings.child('settable_camera_parameters').children()]
+        preset = {'model': self.settings.child('controller_id').value(),
+                  'attributes': {title: self.snapshot.values[title] for title in titles
+                                 if title in self.snapshot.values and title != 'ROIs'},
+                  'rois': [list(roi) for roi in self._get_rois()]}
+        self._preset_dir().mkdir(exist_ok=True)
+        with open(self._preset_dir().joinpath(f'{name}.json'), 'w') as f:
+            json.dump(preset, f, indent=2)
+        self._list_presets()
+        self.settings.child('batch', 'preset').setValue(name)
+        self.emit_status(ThreadCommand('Update_Status', [f'Saved preset {name}']))
+
+    def _load_preset(self):
+        """Apply a saved preset in a single commit."""
+        name = self.settings.child('batch', 'preset').value()
+        try:
+            with open(self._preset_dir().joinpath(f'{name}.json')) as f:
+                preset = json.load(f)
+        except Exception as e:
+            self.emit_status(ThreadCommand('Update_Status', [f'Could not load preset {name}: {e}', 'log']))
+            return
+        if preset.get('model') != self.settings.child('controller_id').value():
+            self.emit_status(ThreadCommand('Update_Status',
+                                           [f'Preset {name} was saved for a {preset.get("model")}', 'log']))
+        rois = [tuple(roi) for roi in preset.get('rois', [])]
+        self._show_rois(rois, enable=len(rois) > 1)
+        changes = {title: value for title, value in preset.get('attributes', {}).items()
+                   if title in self.snapshot.values}
+        if rois:
+            changes['ROIs'] = rois
+        self._pending_changes = {}
+        self.settings.child('batch', 'pending').setValue('')
+        self.apply_changes(changes)
+        self.emit_status(ThreadCommand('Update_Status', [f'Loaded preset {name}']))
+
+    def _update_corrections(self, force=False):
+        """Select the master frames matching the current settings (see make_correction_key), when the settings
+        changed or if `force`. The frame slots switch to float32 while a correction is applied."""
+        if self.calibrations is None:
+            return
+        key = make_correction_key(self.settings.child('serial_number').value(), self.snapshot.values)
+        if key == self._correction_key and not force:
+            return
+        self._correction_key = key
+        masters = self.calibrations.get(key)
+        dark = masters.get('dark') if self.settings.child('corrections', 'dark_enabled').value() else None
+        flat = masters.get('flat') if self.settings.child('corrections', 'flat_enabled').value() else None
+        self.corrector.set_masters(dark, flat)
+        self.settings.child('corrections', 'status').setValue(
+            ', '.join(kind for kind in ['dark', 'flat'] if kind in masters) or 'none for these settings')
+        self._configure_ring_buffer()
+
+    def _acquire_master(self, kind):
+        """Acquire and average frames into a master dark or flat for the current settings. Darks are taken with
+        the shutter closed, if the camera has one. The acquisition must be stopped."""
+        if self.controller.acquisition_in_progress():
+            self.emit_status(ThreadCommand('Update_Status', [f'Stop the acquisition to acquire a {kind}', 'log']))
+            return
+        nframes = self.settings.child('corrections', 'calibration_frames').value()
+        shutter = self.snapshot.values.get('Shutter Timing Mode',
+                                           self.controller.get_attribute_value('Shutter Timing Mode',
+                                                                               error_on_missing=False))
+        close_shutter = kind == 'dark' and shutter is not None and shutter != 'Always Closed'
+        self.emit_status(ThreadCommand('Update_Status', [f'Acquiring a {kind} from {nframes} frames']))
+        try:
+            if close_shutter:
+                self.controller.set_attribute_value('Shutter Timing Mode', 'Always Closed')
+            self.controller.clear_acquisition()
+            self.controller.setup_acquisition(mode='snap', nframes=nframes)
+            self.controller.start_acquisition()
+            frame_rate = self.controller.get_attribute_value('Frame Rate Calculation', error_on_missing=False)
+            self.controller.wait_for_frame(since='start', nframes=nframes,
+                                           timeout=10. + (2 * nframes / frame_rate if frame_rate else 0.))
+            frames = self.controller.read_multiple_images()
+            master = np.mean(frames, axis=0, dtype=np.float64)
+        except Exception as e:
+            self.emit_status(ThreadCommand('Update_Status', [f'{kind.capitalize()} acquisition failed: {e}', 'log']))
+            return
+        finally:
+            self.controller.stop_acquisition()
+            self.controller.clear_acquisition()
+            if close_shutter:
+                self.controller.set_attribute_value('Shutter Timing Mode', shutter)
+        self.calibrations.put(self._correction_key, kind, master)
+        self._update_corrections(force=True)
+        self.emit_status(ThreadCommand('Update_Status', [f'{kind.capitalize()} acquired for {self._correction_key}']))
 
     def _update_rois(self, ):
         """Special method to commit new ROI settings."""
@@ -68,56 +622,736 @@ class DAQ_2DViewer_picam(DAQ_Viewer_base):
         new_height = self.settings.child('settable_camera_parameters', 'rois', 'height').value()
         new_ybinning = self.settings.child('settable_camera_parameters', 'rois', 'y_binning').value()
 
-        # In pylablib, ROIs compare as tuples
-        new_roi = (new_x, new_width, new_xbinning, new_y, new_height, new_ybinning)
-        if new_roi != tuple(self.controller.get_attribute_value('ROIs')[0]):
-            # self.controller.set_attribute_value("ROIs",[new_roi])
-            self.controller.set_roi(new_x, new_x + new_width, new_y, new_y + new_height, hbin=new_xbinning,
-                                    vbin=new_ybinning)
-            self.emit_status(ThreadCommand('Update_Status', [f'Changed ROI: {new_roi}']))
-            self._update_all_settings()
-            self.controller.clear_acquisition()
-            self.controller._commit_parameters()  # Needed so that the new ROIs are checked by the camera
-            self.controller.setup_acquisition()
-            # Finally, prepare view for displaying the new data
-            self._prepare_view()
+        rois = [(new_x, new_width, new_xbinning, new_y, new_height, new_ybinning)]
+        if self._multi_roi_enabled():
+            # The ROI parameters show the first of the multiple ROIs
+            rois += self._pending_changes.get('ROIs', self._get_rois())[1:]
+            self._show_rois(rois)
+        if self.settings.child('batch', 'hold').value():
+            self._hold_change('ROIs', rois)
+        else:
+            self._set_rois(rois)
+
+    def _get_rois(self):
+        """ROIs currently set, as (x, width, x_binning, y, height, y_binning) tuples."""
+        return [tuple(roi) for roi in self.snapshot.values['ROIs']]
+
+    def _set_roi(self, new_roi):
+        """Set the ROI (x, width, x_binning, y, height, y_binning) in the camera if it changed, and update the
+        parameters and the viewer accordingly."""
+        self._set_rois([new_roi])
+
+    def _set_rois(self, rois):
+        """Set one or several ROIs read out in each frame, if they changed, and update the parameters and the viewer
+        accordingly. With several ROIs, each one is emitted as its own data."""
+        self.apply_changes({'ROIs': rois})
+
+    def _multi_roi_enabled(self):
+        """Whether several ROIs are set from the Multiple ROIs group, which some viewers are built without."""
+        return 'multi_roi' in self.settings.names and self.settings.child('multi_roi', 'enabled').value()
+
+    def _show_rois(self, rois, enable=None):
+        """Display the ROIs in the Multiple ROIs group, enabling it or not if `enable` is given. Nothing is
+        displayed by the viewers built without the group."""
+        if 'multi_roi' not in self.settings.names:
+            return
+        if enable is not None:
+            self.settings.child('multi_roi', 'enabled').setValue(enable)
+        self.settings.child('multi_roi', 'roi_list').setValue(format_rois(rois))
+
+    def _apply_multi_roi(self):
+        """Set the ROIs from the Multiple ROIs group, or the single ROI of the ROI parameters if disabled."""
+        if not self._multi_roi_enabled():
+            self._set_roi(tuple(child.value() for child in self._attribute_params['ROIs'].children()))
+            return
+        try:
+            rois = parse_rois(self.settings.child('multi_roi', 'roi_list').value())
+            if not rois:
+                raise ValueError('No ROI defined')
+            self._set_rois(rois)
+        except Exception as e:
+            self.emit_status(ThreadCommand('Update_Status', [f'Could not set the ROIs: {e}', 'log']))
+
+    def _refresh_cameras(self, refresh=True):
+        """Enumerate the cameras of the selected backend (again if `refresh`) and update the serial number list,
+        selecting the first camera if the selected one is not in it."""
+        backend = self.settings.child('backend').value()
+        serial_numbers = camera_enumeration.serial_numbers(backend, refresh=refresh)
+        self.settings.child('serial_number').setLimits(serial_numbers)
+        if self.settings.child('serial_number').value() not in serial_numbers:
+            self.settings.child('serial_number').setValue(serial_numbers[0] if serial_numbers else '')
+        if backend in camera_enumeration.errors:
+            self.emit_status(ThreadCommand('Update_Status', [
+                f'{backend} enumeration failed: {camera_enumeration.errors[backend]}', 'log']))
+        self.emit_status(ThreadCommand('Update_Status', [f'Found {len(serial_numbers)} {backend} camera(s)']))
 
     def commit_settings(self, param):
-        """Commit setting changes to the device."""
-        # We have to treat rois specially
-        if param.parent().name() == "rois":
-            self._update_rois()
-        # Otherwise, the other parameters can be dealt with at once
-        elif self.controller.get_attribute(param.title()).writable:
-            if self.controller.get_attribute_value(param.title()) != param.value():
-                # Update the controller
-                self.controller.set_attribute_value(param.title(), param.value(), truncate=True, error_on_missing=True)
-                # Log that a parameter change was called
-                self.emit_status(ThreadCommand('Update_Status', [f'Changed {param.title()}: {param.value()}']))
-                self._update_all_settings()
-
-    def emit_data(self):
+        """Commit setting changes to the device, the parameters of a group being dealt with by the method given
+        in group_commits."""
+        if param.name() == 'refresh_cameras':
+            if param.value():
+                self._refresh_cameras()
+        elif param.name() == 'backend':
+            # The camera of the new backend is opened at the next initialization
+            self._refresh_cameras(refresh=False)
+        elif param.parent().name() in self.group_commits:
+            getattr(self, self.group_commits[param.parent().name()])(param)
+
+    def _commit_simulation(self, param):
+        # The simulated frame rate is applied at the next acquisition start
+        if param.name() == 'frame_rate' and self.settings.child('backend').value() == 'Simulated':
+            self.controller.frame_rate = param.value()
+
+    def _commit_rois(self, param):
+        self._update_rois()
+
+    def _commit_diagnostics(self, param):
+        if param.name() == 'resync' and param.value():
+            self._resync()
+
+    def _commit_timings(self, param):
+        if param.name() == 'profiling':
+            self.profiler.enabled = param.value()
+        elif param.name() == 'window':
+            self.profiler.reset(param.value())
+        elif param.name() == 'reset' and param.value():
+            self.profiler.reset()
+            self._update_timings(force=True)
+        elif param.name() == 'export' and param.value():
+            self._export_timings()
+
+    def _commit_scan(self, param):
+        if param.name() != 're_arm' or param.value():
+            # Armed again at the next grab
+            self._disarm_scan(restore_trigger=param.name() == 'enabled' and not param.value())
+            self.scan_mode = self.settings.child('scan', 'enabled').value()
+            self._prepare_view()
+
+    def _commit_polling(self, param):
+        self._configure_status_polling()
+
+    def _commit_batch(self, param):
+        if param.name() == 'apply' and param.value():
+            self._apply_pending_changes()
+        elif param.name() == 'discard' and param.value():
+            self._discard_pending_changes()
+        elif param.name() == 'load_preset' and param.value():
+            self._load_preset()
+        elif param.name() == 'save_preset' and param.value():
+            self._save_preset()
+        elif param.name() == 'hold' and not param.value() and self._pending_changes:
+            self._apply_pending_changes()
+
+    def _commit_multi_roi(self, param):
+        if param.name() != 'roi_list' and (param.name() != 'apply' or param.value()):
+            self._apply_multi_roi()
+
+    def _commit_corrections(self, param):
+        if param.name() in ['acquire_dark', 'acquire_flat']:
+            if param.value():
+                self._acquire_master(param.name().split('_')[1])
+        elif param.name() == 'cache_entries':
+            self.calibrations.max_entries = param.value()
+        elif param.name() == 'clear_cache':
+            if param.value():
+                self.calibrations.clear(disk=True)
+                self._update_corrections(force=True)
+        elif param.name() in ['dark_enabled', 'flat_enabled']:
+            self._update_corrections(force=True)
+
+    def _commit_statistics(self, param):
+        self._configure_statistics()
+
+    def _commit_auto_exposure(self, param):
+        self._configure_auto_exposure()
+
+    def _commit_cosmic_rays(self, param):
+        self.cosmic_filter.configure(self.settings.child('cosmic_rays', 'method').value(),
+                                     self.settings.child('cosmic_rays', 'history').value(),
+                                     self.settings.child('cosmic_rays', 'threshold').value())
+        self._configure_ring_buffer()
+
+    def _commit_recording(self, param):
+        if param.name() == 'record':
+            # Recording starts with the acquisition, or right away if it is running
+            if self.controller.acquisition_in_progress():
+                if param.value():
+                    self._start_recording()
+                else:
+                    self._stop_recording()
+        else:
+            self.emit_status(ThreadCommand('Update_Status', [f'{param.title()} applied at the next recording start']))
+
+    def _commit_frame_tracking(self, param):
+        # Metadata can only be changed with the acquisition cleared
+        if param.name() == 'enabled' and not self.controller.acquisition_in_progress():
+            self._apply_frame_tracking()
+
+    def _commit_acquisition(self, param):
+        if param.name() == 'reset_averaging':
+            if param.value():
+                self.accumulator.reset()
+            return
+        self.accumulator.configure(self.settings.child('acquisition', 'averaging_mode').value(),
+                                   self.accumulator.naverage)
+        self.lossless = self.settings.child('acquisition', 'readout_mode').value() == 'Lossless burst'
+        self.stacked = self.settings.child('acquisition', 'burst_emission').value() == 'Stacked block'
+        self.ring_buffer.policy = self.settings.child('acquisition', 'slot_policy').value()
+        self.display_throttled = self.settings.child('acquisition', 'display_throttling').value()
+        self.display_period = 1 / self.settings.child('acquisition', 'max_display_rate').value()
+        self._wait_slice_max = self.settings.child('acquisition', 'wait_slice').value()
+        if param.name() == 'buffer_frames':
+            self.emit_status(ThreadCommand('Update_Status', ['Buffer size applied at the next acquisition start']))
+        self._prepare_view()
+
+    def _commit_camera_parameter(self, param):
+        # The camera parameters are dealt with at once
+        if self.settings.child('batch', 'hold').value():
+            self._hold_change(param.title(), param.value())
+        else:
+            # Compared with the cached value rather than querying the device
+            self.apply_changes({param.title(): param.value()})
+
+    @property
+    def averaging(self):
+        """Whether frames go through the accumulator before being emitted."""
+        return self.accumulator.mode != 'Block' or self.accumulator.naverage > 1
+
+    @property
+    def processing(self):
+        """Whether the emitted frames are dark/flat corrected or cleaned of cosmic rays, as float32 frames."""
+        return self.corrector.active or self.cosmic_filter.method != 'Off'
+
+    @property
+    def stacked_view(self):
+        """Whether the frames read at each grab are emitted as a single DataND block."""
+        return self.lossless and self.stacked and not self.averaging and not self.display_throttled and \
+            not self.scan_mode
+
+    def _is_free_running(self):
+        """Whether the callback thread keeps acquiring after an emission. Called from the callback thread."""
+        if not self.display_throttled:
+            self._free_running.clear()
+        return self._free_running.is_set()
+
+    def _frame_period(self):
+        """Expected time between frames in s, from the cached attribute values (no device call)."""
+        values = self.snapshot.values
+        if values.get('Frame Rate Calculation'):
+            return 1. / values['Frame Rate Calculation']
+        return (values.get('Exposure Time', 0.) + values.get('Readout Time Calculation', 0.)) * 1E-3
+
+    def _wait_cancellable(self, since='lastread', nframes=1, timeout=None):
+        """Wait for frames in slices of about one frame period (at most the max wait slice), checking for a cancel
+        request between slices. Return False if cancelled or if the acquisition stopped. `timeout` (in s) defaults to
+        twice the expected duration plus 10 s, TimeoutError being raised past it. Called from the callback thread."""
+        period = self._frame_period()
+        if timeout is None:
+            timeout = 10. + 2 * nframes * period
+        wait_slice = min(max(period, 0.01), self._wait_slice_max)
+        deadline = time.perf_counter() + timeout
+        while not self._cancel_wait.is_set():
+            try:
+                return self.controller.wait_for_frame(since=since, nframes=nframes,
+                                                      timeout=min(wait_slice, max(deadline - time.perf_counter(), 0)))
+            except self.controller.TimeoutError:
+                if time.perf_counter() >= deadline:
+                    raise
+        return False
+
+    def _wait_for_frames(self):
+        """Wait for the frames needed by the next emission. Called from the callback thread."""
+        if self._scan_armed:
+            return self._wait_scan_frames()
+        if self.display_throttled:
+            if not self._free_running.is_set() or self._cancel_wait.is_set():
+                return False  # Stopped
+            # Wake up at least once per display period, so that a pending grab gets the latest frame in time
+            try:
+                return self.controller.wait_for_frame(since='lastread', nframes=1,
+                                                      timeout=min(self.display_period, self._wait_slice_max))
+            except self.controller.TimeoutError:
+                return True
+        nframes = self.accumulator.remaining if self.averaging else 1
+        return self._wait_cancellable(nframes=nframes)
+
+    def _get_recording_metadata(self):
+        """Acquisition settings stored along the recorded frames."""
+        metadata = {'backend': self.settings.child('backend').value(),
+                    'model': self.settings.child('controller_id').value(),
+                    'serial_number': self.settings.child('serial_number').value()}
+        for title in ['Exposure Time', 'ADC Speed', 'ADC Analog Gain', 'ADC Quality', 'Sensor Temperature Set Point']:
+            if title in self.snapshot.values:
+                metadata[normalise_name(title)] = self.snapshot.values[title]
+        if 'ROIs' in self.snapshot.values:
+            rois = self._get_rois()
+            metadata['roi'] = [int(value) for value in rois[0]]
+            metadata['roi_fields'] = ['x', 'width', 'x_binning', 'y', 'height', 'y_binning']
+            if len(rois) > 1:
+                # Frames are then single rows holding the data of each ROI one after the other
+                metadata['rois'] = [[int(value) for value in roi] for roi in rois]
+        return metadata
+
+    def _start_recording(self):
+        """Create the recorder, so that every frame read from now on is written to disk."""
+        path = self.settings.child('recording', 'path').value()
+        if not path:
+            self.settings.child('recording', 'record').setValue(False)
+            self.emit_status(ThreadCommand('Update_Status', ['No recording file defined', 'log']))
+            return
+        recorder = StreamRecorder(path,
+                                  fmt=self.settings.child('recording', 'format').value(),
+                                  frame_shape=self._get_frame_shape(),
+                                  dtype=self._frame_dtype,
+                                  metadata=self._get_recording_metadata(),
+                                  queue_size=self.settings.child('recording', 'queue_size').value(),
+                                  policy=self.settings.child('recording', 'backpressure').value(),
+                                  capacity=self.settings.child('recording', 'capacity').value())
+        try:
+            recorder.start()
+        except Exception as e:
+            self.settings.child('recording', 'record').setValue(False)
+            self.emit_status(ThreadCommand('Update_Status', [f'Recording failed: {e}', 'log']))
+            return
+        self.settings.child('recording', 'recorded_frames').setValue(0)
+        self.settings.child('recording', 'dropped_frames').setValue(0)
+        self.recorder = recorder
+        self.emit_status(ThreadCommand('Update_Status', [f'Recording to {recorder.path}']))
+
+    def _stop_recording(self):
+        """Write the queued frames and close the recording file."""
+        recorder, self.recorder = self.recorder, None
+        if recorder is None:
+            return
+        recorder.close()
+        self._update_recording_counters(recorder)
+        message = f'Recorded {recorder.written_frames} frames ({recorder.dropped_frames} dropped)'
+        if recorder.error is not None:
+            message += f', write error: {recorder.error}'
+        self.emit_status(ThreadCommand('Update_Status', [message]))
+
+    def _update_recording_counters(self, recorder):
+        for name, value in [('recorded_frames', recorder.written_frames), ('dropped_frames', recorder.dropped_frames)]:
+            if self.settings.child('recording', name).value() != value:
+                self.settings.child('recording', name).setValue(value)
+
+    def _apply_frame_tracking(self):
+        """Enable or disable the frame and time stamps metadata as set in the parameters. Clears the acquisition."""
+        enabled = self.settings.child('frame_tracking', 'enabled').value()
+        self.controller.enable_metadata(enabled)
+        self.tracker.configure(
+            self.controller.get_attribute_value('Time Stamp Resolution', error_on_missing=False, default=1E6),
+            self.controller.get_attribute_value('Frame Tracking Bit Depth', error_on_missing=False, default=64),
+            self.controller.get_frame_info_fields())
+        self.tracking = enabled
+        names = [name for name in ['Time Stamps', 'Track Frames'] if name in self.snapshot.values]
+        self._apply_attribute_changes(*self.snapshot.refresh(names))
+
+    def _read_batch(self, rng=None, return_rng=False):
+        """Read frames in a single call, all the new ones or those of `rng` not read yet, decoding their metadata if
+        frame tracking is enabled and handing them to the recorder if recording. Returns an empty list if there is
+        no such frame: pylablib cannot read an empty range in 'array' frame format. If `return_rng`, returns the
+        frames and the range actually read (None if empty). Called from the callback thread."""
+        new = self.controller.get_new_images_range()
+        if new is not None and rng is not None:
+            new = (max(rng[0], new[0]), min(rng[1], new[1]))
+        if new is None or new[1] <= new[0]:
+            return ([], None) if return_rng else []
+        if self.tracking:
+            frames, infos, rng = self.controller.read_multiple_images(rng=new, return_info=True, return_rng=True)
+        else:
+            frames, rng = self.controller.read_multiple_images(rng=new, return_rng=True)
+        if frames is None or len(frames) == 0:
+            return ([], None) if return_rng else []
+        timestamps = self.tracker.update(infos) if self.tracking else None
+        recorder = self.recorder
+        if recorder is not None:
+            recorder.put(self._keep_frames(frames), first_index=rng[0], timestamp=timestamps)
+        return (frames, rng) if return_rng else frames
+
+    def _keep_frames(self, frames):
+        """Frames which stay valid after the next reads, i.e. copied if they are views of the shared memory of a
+        camera running in a separate process (see picam_process.ProcessCamera)."""
+        return np.array(frames) if getattr(self.controller, 'transient_frames', False) else frames
+
+    def _read_newest(self):
+        """Read the newest frame only, decoding its metadata if frame tracking is enabled, None if there is no new
+        frame. The older unread frames are counted as skipped by the camera. pylablib's read_newest_image is not
+        used as it does not support the 'array' frame format. Called from the callback thread."""
+        rng = self.controller.get_new_images_range()
+        if rng is None:
+            return None
+        frames = self._read_batch(rng=(rng[1] - 1, rng[1]))
+        return frames[0] if len(frames) else None
+
+    def _drain_frames(self):
+        """Read all the frames acquired since the last read, keeping only the latest frame (or average) for
+        display. Called from the callback thread in display throttling mode.
+
+        Returns None if nothing is to be displayed, i.e. no grab is pending, the display period has not elapsed or
+        no frame is available yet, otherwise the frame to display and the number of frames lost in the buffer."""
+        # Empty when the wait timed out without new frames (see _read_batch), the latest frame may still be due
+        # for display
+        frames = self._read_batch()
+        status = self.controller.get_frames_status()
+        self._lost += status.skipped - self._skipped_frames
+        self._skipped_frames = status.skipped
+
+        if self.averaging and self.accumulator.mode == 'Block':
+            # Split the frames in blocks, keeping the last complete average
+            while len(frames):
+                nframes = self.accumulator.remaining
+                self.accumulator.add(frames[:nframes])
+                frames = frames[nframes:]
+                if self.accumulator.ready:
+                    if self._latest_average is None or self._latest_average.shape != self.accumulator.shape:
+                        self._latest_average = np.empty(self.accumulator.shape, dtype=np.float64)
+                    self._latest_frame = self.accumulator.mean(out=self._latest_average)
+                    self.accumulator.reset()
+        elif self.averaging:
+            self.accumulator.add(frames)
+        elif len(frames):
+            # Kept until displayed, possibly longer than the shared memory slots of a ProcessCamera stay valid
+            self._latest_frame = self._keep_frames(frames[-1:])[0]
+
+        if not self._grab_pending.is_set() or time.perf_counter() - self._last_display < self.display_period:
+            return None
+        if self.averaging and self.accumulator.mode != 'Block':
+            frame = self._process_in_place(self.accumulator.mean()) if self.accumulator.ready else None
+        elif self._latest_frame is not None and not self.averaging:
+            stored = self._store_frames(self._latest_frame[np.newaxis])
+            frame = None if stored is None else stored[0]
+        elif self._latest_frame is not None:
+            frame = self._process_in_place(self._latest_frame)
+        else:
+            frame = None
+        if frame is None:
+            return None
+        self._latest_frame = None
+        self._grab_pending.clear()
+        # Displays are scheduled on a fixed period, so that the rate is not lowered by the frame arrival jitter,
+        # unless late by more than a period: the schedule then restarts from now, never catching up with
+        # back-to-back displays
+        now = time.perf_counter()
+        scheduled = self._last_display + self.display_period
+        self._last_display = scheduled if now - scheduled <= self.display_period else now
+        lost, self._lost = self._lost, 0
+        return frame[np.newaxis], lost
+
+    def _store_frames(self, frames):
+        """Copy frames into the frame slots, dark and flat corrected and cleaned of cosmic rays if enabled. Return
+        None if the frames are dropped, the slots being still used (see FrameRingBuffer). Called from the callback
+        thread."""
+        if self.processing:
+            slots = self.ring_buffer.reserve(len(frames), frames.shape[1:], np.float32)
+            if slots is None:
+                return None
+            if not self.corrector.active or self.corrector.apply(frames, out=slots) is None:
+                # The masters may not match the frames yet (ROI being changed)
+                np.copyto(slots, frames)
+            self._clean_cosmic_rays(slots)
+            return self.ring_buffer.hand_off(slots)
+        return self.ring_buffer.store(frames)
+
+    def _copy_frames(self, frames):
+        """Frames emitted outside of the frame slots: a corrected and cleaned float32 copy if enabled, otherwise the
+        frames as read (see _keep_frames). Called from the callback thread."""
+        if self.processing:
+            return self._process_in_place(np.array(frames, dtype=np.float32))
+        return self._keep_frames(frames)
+
+    def _process_in_place(self, frames):
+        """Correct frames, or an average, in place and clean their cosmic rays. The corrections being linear, the
+        corrected average is the average of the corrected frames."""
+        self.corrector.apply(frames, out=frames)
+        self._clean_cosmic_rays(frames[np.newaxis] if frames.ndim == 2 else frames)
+        return frames
+
+    def _clean_cosmic_rays(self, frames):
+        """Replace the cosmic ray hits of a stack of float frames in place, if the filter is on, keeping the number
+        of hits of each frame for emit_data. Called from the callback thread, before the statistics are computed."""
+        if self.cosmic_filter.method == 'Off':
+            return
+        _, self._cosmic_hits = self.cosmic_filter.apply(frames, [get_roi_shape(roi) for roi in self._get_rois()],
+                                                        out=frames)
+
+    def _read_frames(self):
+        """Read the frames acquired since the last read. Called from the callback thread.
+
+        In lossless mode, when averaging or when recording, all the frames in the buffer are read in a single
+        batched call, otherwise only the newest one. Averaged frames are accumulated and only their average is returned.
+        Returns None if there is nothing to emit yet, otherwise the frames (3D array) and the number of frames
+        lost since the previous emission, i.e. overwritten in the buffer before being read or, in newest frame
+        mode, superseded by a newer one."""
+        if self._scan_armed:
+            return self._read_scan_frames()
+        if self.display_throttled:
+            return self._drain_frames()
+        unread = 0
+        if self.averaging and self.accumulator.mode == 'Block':
+            # Only read the frames completing the current block, the next ones are kept for the next block
+            rng = self.controller.get_new_images_range()
+            frames = [] if rng is None else \
+                self._read_batch(rng=(rng[0], min(rng[1], rng[0] + self.accumulator.remaining)))
+        elif self.averaging or self.lossless or self.recorder is not None:
+            frames = self._read_batch()
+            if not (self.averaging or self.lossless):
+                # Recording in newest frame mode: all the frames are recorded but only the newest one is emitted
+                unread = len(frames)
+                frames = frames[-1:]
+        else:
+            frame = self._read_newest()
+            frames = None if frame is None else frame[np.newaxis]
+        if frames is None:
+            frames = []
+        status = self.controller.get_frames_status()
+        self._lost += status.skipped - self._skipped_frames + max(unread - 1, 0)
+        self._skipped_frames = status.skipped
+
+        if self.averaging:
+            self.accumulator.add(frames)
+            if not self.accumulator.ready:
+                return None
+            frames = self._process_in_place(self.accumulator.mean())[np.newaxis]
+            if self.accumulator.mode == 'Block':
+                self.accumulator.reset()
+        elif len(frames) == 0:
+            return None
+        else:
+            stored = self._store_frames(frames)
+            if stored is not None:
+                frames = stored
+            elif not self.lossless:
+                self._lost += len(frames)  # The frame slots are still used by the viewer
+                return None
+            else:
+                # Lossless, the frames are emitted outside of the frame slots
+                frames = self._copy_frames(frames)
+        lost, self._lost = self._lost, 0
+        return frames, lost
+
+    def emit_data(self, frames, lost):
         """
             Fonction used to emit data obtained by callback.
             See Also
             --------
             daq_utils.ThreadCommand
         """
+        self.profiler.record_since('dispatch')
+        t_wrap = self.profiler.clock()
         try:
-            # Get  data from buffer
-            frame = self.controller.read_newest_image()
-            # Emit the frame.
-            self.data_grabed_signal.emit([DataFromPlugins(name='Picam',
-                                                          data=[np.squeeze(frame)],
-                                                          dim=self.data_shape,
-                                                          labels=[f'Picam_{self.data_shape}'],
-                                                          )])
-            #To make sure that timed events are executed in continuous grab mode
-            QtWidgets.QApplication.processEvents()
+            if lost:
+                overruns = self.settings.child('acquisition', 'overruns').value() + lost
+                self.settings.child('acquisition', 'overruns').setValue(overruns)
+                if self.lossless or self.averaging or self.scan_mode:
+                    # Frames are expected to be skipped when only the newest or latest one is emitted, they are
+                    # then only counted
+                    self.emit_status(ThreadCommand('Update_Status', [f'{lost} frame(s) lost, {overruns} in total']))
+            if self.recorder is not None:
+                self._update_recording_counters(self.recorder)
+            if self.ring_buffer.dropped != self.settings.child('diagnostics', 'slot_drops').value():
+                self.settings.child('diagnostics', 'slot_drops').setValue(self.ring_buffer.dropped)
+            self._update_timings()
+            tracking_data = self._update_frame_tracking()
+            statistics, exposure_step, hits = self._statistics_queue.popleft() if self._statistics_queue else \
+                (None, None, None)
+            if hits is not None:
+                self._update_cosmic_rays(hits)
+            channels = self._frames_to_channels(frames)
+            if self._view_shape == 'DataND':
+                # Emit the whole burst as a single block, frames being the navigation axis
+                data = (self._wrap_channels(channels) if self.emit_frames else []) + \
+                    self._statistics_data(statistics) + tracking_data + \
+                    self._cosmic_ray_data(hits, np.sum(hits) if hits is not None else None)
+                self.profiler.record('wrap', t_wrap)
+                self.profiler.mark('gui_return')
+                self.data_grabed_signal.emit(data)
+            else:
+                # Emit the frames one by one, only the last one signaling the end of the grab
+                for ind in range(len(frames)):
+                    data = (self._wrap_channels(channels, ind) if self.emit_frames else []) + \
+                        self._statistics_data(statistics, ind) + \
+                        tracking_data + self._cosmic_ray_data(hits, hits[ind] if hits is not None else None)
+                    if ind < len(frames) - 1:
+                        self.data_grabed_signal_temp.emit(data)
+                    else:
+                        self.profiler.record('wrap', t_wrap)
+                        self.profiler.mark('gui_return')
+                        self.data_grabed_signal.emit(data)
+            if exposure_step is not None:
+                self._update_auto_exposure(*exposure_step)
+            if self._status_poll_pending:
+                # The frame has been handed to the viewer, poll the status while the next one is acquired
+                self._read_status()
 
         except Exception as e:
             self.emit_status(ThreadCommand('Update_Status', [str(e), 'log']))
 
+    def _update_timings(self, force=False):
+        """Show the percentiles of the stage durations, at most once per refresh period."""
+        now = time.perf_counter()
+        if not force and now - self._last_timings_update < \
+                self.settings.child('diagnostics', 'timings', 'refresh_period').value():
+            return
+        self._last_timings_update = now
+        for stage, stats in self.profiler.summary().items():
+            text = '' if stats['window'] == 0 else \
+                f"{stats['p50_ms']:.3f} / {stats['p90_ms']:.3f} / {stats['p99_ms']:.3f} (n={stats['count']})"
+            self.settings.child('diagnostics', 'timings', stage).setValue(text)
+
+    def _export_timings(self):
+        """Write the stage durations to the export file (JSON)."""
+        path = self.settings.child('diagnostics', 'timings', 'export_path').value()
+        if not path:
+            self.emit_status(ThreadCommand('Update_Status', ['No export file defined', 'log']))
+            return
+        metadata = {'model': self.settings.child('controller_id').value(),
+                    'readout_mode': self.settings.child('acquisition', 'readout_mode').value(),
+                    'display_throttling': self.display_throttled,
+                    'frame_shape': list(self._get_frame_shape()) if self.snapshot is not None else None}
+        try:
+            self.profiler.export(path, metadata)
+        except Exception as e:
+            self.emit_status(ThreadCommand('Update_Status', [f'Timings export failed: {e}', 'log']))
+            return
+        self.emit_status(ThreadCommand('Update_Status', [f'Stage timings exported to {path}']))
+
+    def _read_and_reduce(self):
+        """Read the frames to emit (see _read_frames), compute their statistics and the auto exposure step of the
+        newest one, queued for emit_data with the cosmic ray hits. The frames being cleaned of cosmic rays as they
+        are read, the statistics are those of the cleaned frames. Called from the callback thread."""
+        self._cosmic_hits = None
+        data = self._read_frames()
+        if data is not None:
+            exposure_step = self._step_auto_exposure(data[0][-1]) \
+                if self.auto_exposure.active and not self.scan_mode else None
+            self._statistics_queue.append((self._reduce(self._frames_to_channels(data[0])), exposure_step,
+                                           self._cosmic_hits))
+        return data
+
+    def _reduce(self, channels):
+        """Statistics of each channel, as (labels, values) pairs, None if no statistics are selected."""
+        statistics = self.statistics
+        if not statistics.active:
+            return None
+        return [(statistics.labels(channel.shape[1:]), statistics.compute(channel)) for channel in channels]
+
+    def _statistics_data(self, statistics, ind=None):
+        """Statistics of the channels as 0D data for frame `ind`, or as 1D data (one value per frame) for a whole
+        burst if `ind` is None."""
+        if statistics is None:
+            return []
+        data = []
+        for label, (labels, values) in zip(self._channel_labels(), statistics):
+            name = 'Picam_statistics' if len(statistics) == 1 else f"Picam_statistics_{label.replace('Picam_', '')}"
+            if ind is None:
+                data.append(DataFromPlugins(name=name, data=list(values), dim='Data1D', labels=labels))
+            else:
+                data.append(DataFromPlugins(name=name, data=[np.array([value[ind]]) for value in values],
+                                            dim='Data0D', labels=labels))
+        return data
+
+    def _configure_statistics(self):
+        """Select the frame statistics and whether the frames are emitted (always if there are no statistics), the
+        saturation level being the full scale of the ADC."""
+        bit_depth = self.controller.get_attribute_value('ADC Bit Depth', error_on_missing=False, default=16)
+        self.statistics.configure(self.settings.child('statistics', 'selected').value()['selected'],
+                                  2 ** int(bit_depth) - 1)
+        self.settings.child('statistics', 'saturation').setValue(self.statistics.saturation)
+        self.emit_frames = self.settings.child('statistics', 'emit_frames').value() or not self.statistics.active
+        self._prepare_view()
+
+    def _configure_auto_exposure(self):
+        """Apply the auto exposure settings, starting a new run. The full scale is the saturation level."""
+        settings = self.settings.child('auto_exposure')
+        self.auto_exposure.configure(settings.child('mode').value(), settings.child('target').value() / 100,
+                                     settings.child('percentile').value(), settings.child('tolerance').value() / 100,
+                                     settings.child('subsampling').value(), settings.child('settling').value(),
+                                     settings.child('max_iterations').value(), self.statistics.saturation)
+        self._exposure_request = None
+        if self.auto_exposure.active:
+            # Otherwise the outcome of the last run stays displayed
+            settings.child('iterations').setValue(0)
+            settings.child('state').setValue(self.auto_exposure.state)
+
+    def _step_auto_exposure(self, frame):
+        """Step of the auto exposure from the levels of the newest frame to emit. A new exposure time is requested,
+        to be set at the next grab (see _apply_exposure_request), no step being taken until then. The exposure time
+        is kept while recording if it cannot be changed during the acquisition. Return the state before the step,
+        the exposure time and the level, iterations and state after it, for emit_data. Called from the callback
+        thread."""
+        auto_exposure = self.auto_exposure
+        if self._exposure_request is not None:
+            return None
+        attribute = self.controller.get_attribute('Exposure Time')
+        if self.recorder is not None and not attribute.can_set_online:
+            return None
+        exposure = self.snapshot.values.get('Exposure Time')
+        if exposure is None:
+            exposure = self.controller.get_attribute_value('Exposure Time')
+        state = auto_exposure.state
+        self._exposure_request = auto_exposure.update(*auto_exposure.measure(frame), exposure,
+                                                      attribute.truncate_value)
+        return state, exposure, auto_exposure.level, auto_exposure.iterations, auto_exposure.state
+
+    def _apply_exposure_request(self):
+        """Set the exposure time requested by the auto exposure. If it cannot be set during the acquisition, the
+        acquisition is stopped, the grab then starting it again with the new exposure time."""
+        exposure = self._exposure_request
+        try:
+            if self.controller.acquisition_in_progress() and \
+                    not self.controller.get_attribute('Exposure Time').can_set_online:
+                self.stop()
+            self.apply_changes({'Exposure Time': exposure})
+            self._apply_attribute_changes({'Exposure Time': exposure}, {}, log=False)
+        finally:
+            self._exposure_request = None
+
+    def _update_auto_exposure(self, previous_state, exposure, level, iterations, state):
+        """Show an auto exposure step of the callback thread (see _step_auto_exposure), and the outcome of the run
+        once it ends."""
+        auto_exposure = self.auto_exposure
+        settings = self.settings.child('auto_exposure')
+        if level is not None:
+            settings.child('fill').setValue(level / auto_exposure.full_scale * 100)
+        settings.child('iterations').setValue(iterations)
+        settings.child('state').setValue(state)
+        if state != previous_state and state != 'Converging':
+            self.emit_status(ThreadCommand('Update_Status', [
+                f'Auto exposure: {state.lower()} after {iterations} iteration(s), exposure time {exposure:g} ms, '
+                f'fill {level / auto_exposure.full_scale * 100:.1f} %']))
+            if settings.child('mode').value() == 'Once':
+                settings.child('mode').setValue('Off')
+
+    def _update_cosmic_rays(self, hits):
+        self.settings.child('cosmic_rays', 'hits').setValue(int(hits[-1]))
+        self.settings.child('cosmic_rays', 'total_hits').setValue(self.cosmic_filter.total_hits)
+
+    def _cosmic_ray_data(self, hits, count):
+        """Number of cosmic ray hits as 0D data, if the filter is on and they are to be emitted."""
+        if hits is None or not self.settings.child('cosmic_rays', 'emit_channel').value():
+            return []
+        return [DataFromPlugins(name='Picam_cosmic_rays', data=[np.array([count])], dim='Data0D',
+                                labels=['Cosmic ray hits'])]
+
+    def _update_frame_tracking(self):
+        """Show the frame tracking values of the last read frames, and return them as 0D data if they are to be
+        emitted. The latency is measured from the end of the exposure of the last frame (camera clock, referenced
+        to the acquisition start) to now."""
+        if not self.tracking:
+            return []
+        latency = (time.perf_counter() - self.tracker.t_start_perf - self.tracker.last_exposure_end) * 1E3
+        interval = self.tracker.interval * 1E3
+        for name, value in [('frame_gaps', self.tracker.gaps), ('latency', latency), ('frame_interval', interval)]:
+            if np.isfinite(value):
+                self.settings.child('frame_tracking', name).setValue(value)
+        if not self.settings.child('frame_tracking', 'emit_channels').value():
+            return []
+        return [DataFromPlugins(name='Picam_tracking',
+                                data=[np.array([self.tracker.gaps]), np.array([latency]), np.array([interval])],
+                                dim='Data0D',
+                                labels=['Frame gaps', 'Latency (ms)', 'Frame interval (ms)'])]
+
     def ini_detector(self, controller=None):
         """Detector communication initialization
 
@@ -136,22 +1370,30 @@ class DAQ_2DViewer_picam(DAQ_Viewer_base):
 
         try:
             self.status.update(edict(initialized=False, info="", x_axis=None, y_axis=None, controller=None))
+            start = time.perf_counter()
             if self.settings.child('controller_status').value() == "Slave":
                 if controller is None:
                     raise Exception('no controller has been defined externally while this detector is a slave one')
                 else:
                     self.controller = controller
             else:
-                # Pylablib's PI camera module object
-                camera = PI.PicamCamera(self.settings.child('serial_number').value())
+                # Pylablib's PI camera module object, or its simulated counterpart, shared with the other plugins
+                # using the same camera
+                camera = camera_manager.open(self.settings.child('backend').value(),
+                                             self.settings.child('serial_number').value(),
+                                             process=self.settings.child('separate_process').value(),
+                                             **self._get_simulation_options())
                 # Set camera name
                 self.settings.child('controller_id').setValue(camera.get_device_info().model)
                 # init controller
                 self.controller = camera
+                # Bursts are read as a single 3D array
+                self.controller.set_frame_format('array')
+                self._frame_dtype = np.uint16 if self.controller.get_attribute_value('Pixel Bit Depth') <= 16 \
+                    else np.uint32
 
-                #Way to define a wait function with arguments
-                wait_func = lambda: self.controller.wait_for_frame(since='lastread', nframes=1, timeout=20.0)
-                callback = PicamCallback(wait_func)
+                callback = PicamCallback(self._wait_for_frames, self._read_and_reduce, self._is_free_running,
+                                         self.profiler)
 
                 self.callback_thread = QtCore.QThread()  # creation of a Qt5 thread
                 callback.moveToThread(self.callback_thread)  # callback object will live within this thread
@@ -161,100 +1403,8 @@ class DAQ_2DViewer_picam(DAQ_Viewer_base):
                 self.callback_thread.callback = callback
                 self.callback_thread.start()
 
-
-            # Get all parameters and sort them in read_only or settable groups
-            atd = self.controller.get_all_attributes(copy=True)
-            camera_params = []
-            for k, v in atd.items():
-                tmp = define_pymodaq_pyqt_parameter(v)
-                if tmp is not None:
-                    camera_params.append(tmp)
-            #####################################
-            read_and_set_parameters = [par for par in camera_params if not par['readonly']]
-            read_only_parameters = [par for par in camera_params if par['readonly']]
-
-            # List of priority for ordering the parameters in the UI.
-            priority = ['Exposure Time',
-                        'ADC Speed',
-                        'ADC Analog Gain',
-                        'ADC Quality',
-                        'ROIs',
-                        'Sensor Temperature Set Point',
-                        ]
-            remove = ['Active Width',
-                      'Active Height',
-                      'Active Left Margin',
-                      'Active Top Margin',
-                      'Active Right Margin',
-                      'Active Bottom Margin',
-                      'Shutter Closing Delay',
-                      'Shutter Opening Delay',
-                      'Readout Count',
-                      'ADC Bit Depth',
-                      'Time Stamp Bit Depth',
-                      'Frame Tracking Bit Depth',
-                      'Shutter Delay Resolution',
-                      'Shutter Timing Monde',
-                      'Trigger Response',
-                      'Trigger Determination',
-                      'Output Signal',
-                      'Pixel Format',
-                      'Invert Output Signal',
-                      'Disable Data Formatting',
-                      'Track Frames',
-                      'Clean Section Final Height',
-                      'Clean Section Final Height Count',
-                      'Clean Cycle Count',
-                      'Clean Cycle Height',
-                      'Clean Serial Register',
-                      'Clean Until Trigger',
-                      'Normalize Orientation',
-                      'Correct Pixel Bias',
-                      'Shutter Timing Mode',
-                      'Time Stamps',
-                      'Time Stamp Resolution',
-                      ]
-            read_and_set_parameters = sort_by_priority_list(read_and_set_parameters, priority)
-            if self.settings.child('simple_settings').value():
-                read_and_set_parameters = remove_settings_from_list(read_and_set_parameters,remove)
-
-            # List of priority for ordering the parameters in the UI but for read only params, which is less
-            # important (kindof)
-            priority = ['Sensor Temperature',
-                        'Readout Time Calculation',
-                        'Frame Rate Calculation',
-                        'Pixel Width',
-                        'Pixel Height',
-                        ]
-            remove = ['Sensor Masked Height',
-                      'Sensor Masked Top Margin',
-                      'Sensor Masked Bottom Margin',
-                      'Gap Width',
-                      'Gap Height',
-                      'CCD Characteristics',
-                      'Exact Readout Count Maximum',
-                      'Pixel Width',
-                      'Pixel Height',
-                      'Frame Size',
-                      'Frame Stride',
-                      'Pixel Bit Depth',
-                      'Sensor Secondary Masked Height',
-                      'Sensor Active Width',
-                      'Sensor Active Height',
-                      'Sensor Active Left Margin',
-                      'Sensor Active Top Margin',
-                      'Sensor Active Right Margin',
-                      'Sensor Active Bottom Margin',
-                      'Sensor Secondary Active Height',
-                      'Sensor Active Extended Height',
-                      'Sensor Temperature Status',
-                      'Orientation',
-                      'Readout Orientation',
-                      'Sensor Type',
-                      ]
-            read_only_parameters = sort_by_priority_list(read_only_parameters, priority)
-            if self.settings.child('simple_settings').value():
-                read_only_parameters = remove_settings_from_list(read_only_parameters, remove)
+            # Get all parameters, sorted in read_only or settable groups, from the saved layout if possible
+            read_and_set_parameters, read_only_parameters, values, source = self._get_camera_schema()
 
             # Initialisation of the parameters
             self.settings.addChild({'title': 'Settable Camera Parameters',
@@ -268,6 +1418,33 @@ class DAQ_2DViewer_picam(DAQ_Viewer_base):
                                     'children': read_only_parameters,
                                     })
 
+            # Cache of the displayed attributes values, taken from the freshly built parameters
+            self._attribute_params = {param.title(): param
+                                      for group in ['settable_camera_parameters', 'read_only_camera_parameters']
+                                      for param in self.settings.child(group).children()}
+            if 'ROIs' in self._attribute_params:
+                if len(values['ROIs']) > 1:
+                    # Several ROIs left set in the camera
+                    self._show_rois(values['ROIs'], enable=True)
+            self.snapshot = AttributeSnapshot(self.controller, values)
+            self.calibrations = CalibrationCache(self.settings.child('corrections', 'cache_entries').value(),
+                                                 str(get_set_local_dir().joinpath('picam_calibrations')))
+            self._update_corrections(force=True)
+            if self.settings.child('frame_tracking', 'enabled').value():
+                self._apply_frame_tracking()
+            self._list_presets()
+
+            # Low priority timer reading the temperature and calculated values
+            self.status_timer = QtCore.QTimer()
+            self.status_timer.setTimerType(QtCore.Qt.CoarseTimer)
+            self.status_timer.timeout.connect(self._poll_status)
+            self._configure_status_polling()
+            self._read_status()
+            self.settings.child('diagnostics', 'init_time').setValue(
+                f'{(time.perf_counter() - start) * 1E3:.0f} ms ({source})')
+
+            self._configure_statistics()
+            self._configure_auto_exposure()
             # Prepare the viewer (2D by default)
             self._prepare_view()
 
@@ -286,8 +1463,20 @@ class DAQ_2DViewer_picam(DAQ_Viewer_base):
         """
         Terminate the communication protocol
         """
-        # Terminate the communication
-        self.controller.close()
+        self._stop_recording()
+        if self.status_timer is not None:
+            self.status_timer.stop()
+            self.status_timer = None
+        if self.callback_thread is not None:
+            # The callback thread must not be waiting on the camera when it is closed
+            self._grab_pending.clear()
+            self._free_running.clear()
+            self._cancel_acquisition_wait()
+            self.callback_thread.quit()
+            self.callback_thread.wait()
+            self.callback_thread = None
+        # Terminate the communication, unless another plugin uses the camera
+        camera_manager.close(self.controller)
         self.controller = None  # Garbage collect the controller
         # Clear all the parameters
         self.settings.child('settable_camera_parameters').clearChildren()
@@ -310,33 +1499,183 @@ class DAQ_2DViewer_picam(DAQ_Viewer_base):
         for param in self.settings.child('settable_camera_parameters', "rois").children():
             param.setOpts(enabled=enabled)
 
-    def _prepare_view(self):
-        """Preparing a data viewer by emitting temporary data. Typically, needs to be called whenever the
-        ROIs are changed"""
+    def _get_frame_shape(self):
+        """Shape (rows, columns) of the frames read with the current ROI and binning. With several ROIs, frames are
+        single rows holding all the ROIs (see split_rois)."""
+        rois = self._get_rois()
+        if len(rois) > 1:
+            return 1, sum(int(np.prod(get_roi_shape(roi))) for roi in rois)
         wx = self.settings.child('settable_camera_parameters', 'rois', 'width').value()
         wy = self.settings.child('settable_camera_parameters', 'rois', 'height').value()
         bx = self.settings.child('settable_camera_parameters', 'rois', 'x_binning').value()
         by = self.settings.child('settable_camera_parameters', 'rois', 'y_binning').value()
+        return wy // by, wx // bx
+
+    def _configure_ring_buffer(self):
+        """Size the frame slots from the current ROI, reallocating them only if needed."""
+        self.ring_buffer.configure(self._get_frame_shape(), np.float32 if self.processing else self._frame_dtype,
+                                   n_slots=self.settings.child('acquisition', 'ring_slots').value())
+        self.settings.child('acquisition', 'ring_memory').setValue(self.ring_buffer.nbytes / 1024 ** 2)
+
+    def _frames_to_channels(self, frames):
+        """Convert a stack of frames (first axis being the frame index) into the emitted data channels, each
+        channel being a stack of the same length: one view per ROI. Subclasses override it to emit processed data
+        (e.g. spectra)."""
+        return split_rois(frames, [get_roi_shape(roi) for roi in self._get_rois()])
 
-        sizex = wx // bx
-        sizey = wy // by
+    def _channel_labels(self):
+        """Labels of the channels returned by _frames_to_channels."""
+        if len(self._get_rois()) > 1:
+            return [f'ROI{ind}' for ind in range(len(self._get_rois()))]
+        return [f'Picam_{self._view_shape}']
 
-        mock_data = np.zeros((sizey, sizex))
+    def _wrap_channels(self, channels, ind=None):
+        """DataFromPlugins holding the channels: the whole stacks as DataND if `ind` is None, otherwise their frame
+        `ind`. With several ROIs, each channel is wrapped on its own as their shapes differ."""
+        labels = self._channel_labels()
+        if len(self._get_rois()) > 1:
+            groups = [(f'Picam_{label}', [channel], [label]) for channel, label in zip(channels, labels)]
+        else:
+            groups = [('Picam', channels, labels)]
+        data = []
+        for name, group, group_labels in groups:
+            if ind is None:
+                data.append(DataFromPlugins(name=name, data=group, dim='DataND', nav_axes=[0], labels=group_labels))
+            else:
+                arrays = [np.atleast_1d(np.squeeze(channel[ind])) for channel in group]
+                data.append(DataFromPlugins(name=name, data=arrays, dim='Data2D' if arrays[0].ndim == 2 else 'Data1D',
+                                            labels=group_labels))
+        return data
+
+    def _prepare_view(self):
+        """Preparing a data viewer by emitting temporary data. Typically, needs to be called whenever the
+        ROIs are changed"""
+        self._configure_ring_buffer()
+
+        mock_channels = self._frames_to_channels(np.zeros((1,) + self._get_frame_shape(), dtype=self._frame_dtype))
+        sizey, sizex = (mock_channels[0].shape[1:] + (1,))[:2]
 
         if sizey != 1 and sizex != 1:
             data_shape = 'Data2D'
         else:
             data_shape = 'Data1D'
+        # Stacked bursts are displayed with frames as navigation axis
+        view_shape = 'DataND' if self.stacked_view else data_shape
+        view = (data_shape, view_shape, tuple(channel.shape[1:] for channel in mock_channels), self.emit_frames,
+                tuple(self.statistics.statistics))
 
-        if data_shape != self.data_shape:
+        if view != self._view:
             self.data_shape = data_shape
+            self._view_shape = view_shape
+            self._view = view
             # init the viewers
-            self.data_grabed_signal_temp.emit([DataFromPlugins(name='Picam',
-                                                               data=[np.squeeze(mock_data)],
-                                                               dim=self.data_shape,
-                                                               labels=[f'Picam_{self.data_shape}'])])
+            ind = None if view_shape == 'DataND' else 0
+            data = self._wrap_channels(mock_channels, ind) if self.emit_frames else []
+            self.data_grabed_signal_temp.emit(data + self._statistics_data(self._reduce(mock_channels), ind))
             QtWidgets.QApplication.processEvents()
 
+    def _set_trigger_response(self, response):
+        """Set the Trigger Response attribute, if the camera has it. Return whether it is set."""
+        attribute = self.controller.get_attribute('Trigger Response', error_on_missing=False)
+        if attribute is None or not attribute.writable:
+            return response == 'No Response'
+        if self._trigger_restore is None:
+            self._trigger_restore = self.controller.get_attribute_value('Trigger Response')
+        self.controller.set_attribute_value('Trigger Response', response)
+        if 'Trigger Response' in self.snapshot.values:
+            self._apply_attribute_changes(*self.snapshot.refresh(['Trigger Response']), log=False)
+        return True
+
+    def _arm_scan(self):
+        """Arm the camera for the armed scan frames: a single acquisition with a fixed frame count (Readout Count)
+        in the usual ring buffer, the grabs then consuming its frames in order without any setup."""
+        # The previous scan may have ended by itself, with all its frames acquired
+        self.controller.clear_acquisition()
+        trigger = self.settings.child('scan', 'trigger').value()
+        self._scan_free_running = trigger == 'Internal'
+        if not self._set_trigger_response(SCAN_TRIGGERS[trigger]):
+            self.emit_status(ThreadCommand('Update_Status', ['The camera has no external trigger, using internal',
+                                                             'log']))
+            self._scan_free_running = True
+        self._toggle_non_online_parameters(enabled=False)
+        if self.tracking != self.settings.child('frame_tracking', 'enabled').value():
+            self._apply_frame_tracking()
+        nframes = self.settings.child('scan', 'frames').value()
+        self.controller.setup_acquisition(mode='sequence',
+                                          nframes=self.settings.child('acquisition', 'buffer_frames').value())
+        self.controller.set_attribute_value('Readout Count', nframes)
+        self._skipped_frames = 0
+        self._lost = 0
+        self._scan_index = 0
+        self.settings.child('acquisition', 'overruns').setValue(0)
+        self.settings.child('scan', 'consumed').setValue(0)
+        if self.settings.child('recording', 'record').value():
+            self._start_recording()
+        self.tracker.reset(time.time(), time.perf_counter())
+        self.cosmic_filter.reset()
+        self._cancel_wait.clear()
+        self.controller.start_acquisition()
+        self._scan_armed = True
+        self.emit_status(ThreadCommand('Update_Status', [f'Armed for {nframes} frames ({trigger} trigger)']))
+
+    def _disarm_scan(self, restore_trigger=False):
+        """Stop the armed acquisition, if any, restoring the trigger if `restore_trigger`."""
+        if self._scan_armed:
+            self._scan_armed = False
+            self._cancel_acquisition_wait()
+            self.controller.stop_acquisition()
+            self._stop_recording()
+            self.controller.clear_acquisition()
+            self._toggle_non_online_parameters(enabled=True)
+        if restore_trigger and self._trigger_restore is not None:
+            self._set_trigger_response(self._trigger_restore)
+            self._trigger_restore = None
+
+    def _wait_scan_frames(self):
+        """Wait for the frames of the current scan step. Called from the callback thread."""
+        target = self._scan_index + self._scan_step
+        # Externally triggered frames come whenever the scan gets there
+        timeout = None if self.settings.child('scan', 'trigger').value() == 'Internal' else float('inf')
+        acquired = self._wait_cancellable(since='start', nframes=target, timeout=timeout)
+        if acquired is False and not self._cancel_wait.is_set():
+            # The acquisition ends by itself after the last armed frame
+            return self.controller.get_frames_status().acquired >= target
+        return acquired
+
+    def _read_scan_frames(self):
+        """Read the frames of the current scan step, their average if several. Frames of the step already overwritten
+        in the camera buffer are counted as lost, the step then taking the next frames. Called from the callback
+        thread."""
+        start = self._scan_index
+        new = self.controller.get_new_images_range()
+        if new is not None:
+            start = max(start, new[0])
+        frames, rng = self._read_batch(rng=(start, start + self._scan_step), return_rng=True)
+        if len(frames) == 0:
+            return None
+        # Frames skipped on purpose (see _grab_scan) are not lost, so pylablib's skipped frames are not used
+        lost = rng[0] - self._scan_index
+        self._scan_index = rng[1]
+        if len(frames) > 1:
+            return self._process_in_place(np.mean(frames, axis=0))[np.newaxis], lost
+        stored = self._store_frames(frames)
+        # Scan steps are never dropped, they are emitted outside of the frame slots if these are still used
+        return (self._copy_frames(frames) if stored is None else stored), lost
+
+    def _grab_scan(self, Naverage):
+        """Grab of the armed scan mode: arm the camera if needed, then consume the next frames."""
+        nframes = self.settings.child('scan', 'frames').value()
+        if self._scan_armed and self._scan_free_running:
+            # Without a trigger, the camera does not wait for the scan: frames acquired before the step was reached
+            # are skipped, the step only using the frames acquired from now on
+            self._scan_index = max(self._scan_index, self.controller.get_frames_status().acquired)
+        if not self._scan_armed or self._scan_index + Naverage > nframes:
+            # First step, or all the armed frames consumed: a new scan
+            self._arm_scan()
+        self._scan_step = Naverage
+        self.settings.child('scan', 'consumed').setValue(self._scan_index)
+        self.callback_signal.emit()
+
     def grab_data(self, Naverage=1, **kwargs):
         """
         Grabs the data. Synchronous method (kinda).
@@ -344,14 +1683,45 @@ class DAQ_2DViewer_picam(DAQ_Viewer_base):
         Naverage: (int) Number of averaging
         kwargs: (dict) of others optionals arguments
         """
+        self.profiler.record_since('gui_return')
         try:
+            if self.scan_mode:
+                self._grab_scan(Naverage)
+                return
+            if self._exposure_request is not None:
+                self._apply_exposure_request()
+            averaging = self.averaging
+            self.accumulator.configure(self.accumulator.mode, Naverage)
+            if averaging != self.averaging:
+                self._prepare_view()
             # Warning, acquisition_in_progress returns 1,0 and not a real bool
             if not self.controller.acquisition_in_progress():
                 # 0. Disable all non online-settable parameters
                 self._toggle_non_online_parameters(enabled=False)
-                # 1. Start acquisition
+                if self.tracking != self.settings.child('frame_tracking', 'enabled').value():
+                    self._apply_frame_tracking()
+                # 1. Start acquisition, with a ring buffer large enough for the bursts
                 self.controller.clear_acquisition()
+                self.controller.setup_acquisition(mode='sequence',
+                                                  nframes=self.settings.child('acquisition', 'buffer_frames').value())
+                self._skipped_frames = 0
+                self._lost = 0
+                self.accumulator.reset()
+                self._latest_frame = None
+                self._last_display = 0.
+                self.settings.child('acquisition', 'overruns').setValue(0)
+                if self.settings.child('recording', 'record').value():
+                    self._start_recording()
+                self.tracker.reset(time.time(), time.perf_counter())
+                self.cosmic_filter.reset()
+                self._cancel_wait.clear()
                 self.controller.start_acquisition()
+            if self.display_throttled:
+                # The callback thread hands over the latest frame at the next display period
+                self._grab_pending.set()
+                if self._free_running.is_set():
+                    return
+                self._free_running.set()
             #Then start the acquisition
             self.callback_signal.emit()  # will trigger the wait for acquisition
 
@@ -362,25 +1732,75 @@ class DAQ_2DViewer_picam(DAQ_Viewer_base):
         """optional asynchrone method called when the detector has finished its acquisition of data"""
         raise NotImplementedError
 
+    def _cancel_acquisition_wait(self, timeout=5.):
+        """Interrupt the frame wait of the callback thread and wait until it is idle. Return whether it is."""
+        self._cancel_wait.set()
+        if self.callback_thread is None:
+            return True
+        return self.callback_thread.callback.idle.wait(timeout)
+
     def stop(self):
-        """Stop the acquisition."""
+        """Stop the acquisition. The callback thread is idle when this returns, the time it took is shown in the
+        diagnostics."""
+        start = time.perf_counter()
+        self._scan_armed = False
+        self._grab_pending.clear()
+        self._free_running.clear()
+        if not self._cancel_acquisition_wait():
+            self.emit_status(ThreadCommand('Update_Status', ['The acquisition thread did not stop in time', 'log']))
         self.controller.stop_acquisition()
+        self.settings.child('diagnostics', 'stop_latency').setValue((time.perf_counter() - start) * 1E3)
+        self._stop_recording()
         self.controller.clear_acquisition()
         self._toggle_non_online_parameters(enabled=True)
+        self._update_timings(force=True)
+        if self._status_poll_pending:
+            self._read_status()
         return ''
 
 class PicamCallback(QtCore.QObject):
     """Callback object for the picam library"""
-    data_sig = QtCore.Signal()
-    def __init__(self,wait_fn):
+    data_sig = QtCore.Signal(object, int)
+
+    def __init__(self, wait_fn, read_fn, free_run_fn=None, profiler=None):
         super().__init__()
-        #Set the wait function
+        # Set the wait and read functions
         self.wait_fn = wait_fn
+        self.read_fn = read_fn
+        # Tells whether to keep acquiring after an emission (display throttling)
+        self.free_run_fn = free_run_fn
+        # Times the wait, the read and the dispatch of the data to emit_data
+        self.profiler = PipelineProfiler(enabled=False) if profiler is None else profiler
+        # Cleared while waiting for or reading frames
+        self.idle = threading.Event()
+        self.idle.set()
 
     def wait_for_acquisition(self):
-        new_data = self.wait_fn()
-        if new_data is not False: #will be returned if the main thread called CancelWait
-            self.data_sig.emit()
+        self.idle.clear()
+        try:
+            self._wait_and_read()
+        finally:
+            self.idle.set()
+
+    def _wait_and_read(self):
+        profiler = self.profiler
+        while True:
+            start = profiler.clock()
+            new_data = self.wait_fn()
+            profiler.record('wait', start)
+            if new_data is False:  # will be returned if the main thread called CancelWait
+                return
+            # Reading right after the wait, in this thread, so that no frame arrives in between.
+            # Nothing is returned while an average is still being accumulated: wait again.
+            start = profiler.clock()
+            data = self.read_fn()
+            profiler.record('read', start)
+            if data is not None:
+                profiler.mark('dispatch')
+                self.data_sig.emit(*data)
+                # When free running, keep draining frames until the acquisition is stopped
+                if self.free_run_fn is None or not self.free_run_fn():
+                    return
 
 if __name__ == '__main__':
     main(__file__)
\ No newline at end of file
@@ -0,0 +1,278 @@
+import threading
+import time
+
+import numpy as np
+from easydict import EasyDict as edict
+from pymodaq.daq_utils.daq_utils import ThreadCommand, getLineInfo, DataFromPlugins
+from pymodaq.daq_viewer.utility_classes import DAQ_Viewer_base, comon_parameters, main
+
+from qtpy import QtCore
+
+from .daq_2Dviewer_picam import PicamCallback, SCAN_TRIGGERS
+from ...hardware.picam_backends import BACKENDS, LazyCameraParams, camera_enumeration
+from ...hardware.picam_manager import MATCH_MODES, SynchronizedAcquisition, camera_manager
+
+
+class DAQ_2DViewer_picam_sync(DAQ_Viewer_base):
+    """
+        Synchronized acquisition of several Princeton Instruments cameras.
+
+        The selected cameras run a continuous acquisition each. Their frames are waited for and read in parallel (one
+        worker per camera), matched by frame number or timestamp, and each matched set is emitted as one dataset
+        holding one channel per camera, plus the skew of the set (time spread of its frames) as a 0D channel.
+        Cameras are opened through the camera manager, so that they can be shared with picam viewers of the same
+        process. Each camera keeps the ROI and settings it was left with.
+
+        See Also
+        --------
+        DAQ_2DViewer_picam, picam_manager.SynchronizedAcquisition
+    """
+    picam_params = comon_parameters + [
+        {'title': 'Backend:', 'name': 'backend', 'type': 'list', 'value': 'Picam', 'limits': BACKENDS},
+        {'title': 'Cameras:', 'name': 'serial_numbers', 'type': 'itemselect', 'value': {}},
+        {'title': 'Refresh cameras:', 'name': 'refresh_cameras', 'type': 'bool_push', 'label': 'Refresh',
+         'value': False},
+        {'title': 'Exposure Time (ms):', 'name': 'exposure', 'type': 'float', 'value': 10., 'min': 0.},
+        {'title': 'Trigger:', 'name': 'trigger', 'type': 'list', 'value': 'Internal', 'limits': list(SCAN_TRIGGERS)},
+        {'title': 'Match frames by:', 'name': 'match_mode', 'type': 'list', 'value': 'Frame number',
+         'limits': MATCH_MODES},
+        {'title': 'Timestamp tolerance (ms):', 'name': 'tolerance', 'type': 'float', 'value': 5., 'min': 0.},
+        {'title': 'Buffer size (frames):', 'name': 'buffer_frames', 'type': 'int', 'value': 100, 'min': 1},
+        {'title': 'Synchronization', 'name': 'sync', 'type': 'group', 'children': [
+            {'title': 'Matched sets/s:', 'name': 'sets_per_s', 'type': 'float', 'value': 0., 'readonly': True},
+            {'title': 'Frames/s per camera:', 'name': 'frames_per_s', 'type': 'str', 'value': '', 'readonly': True},
+            {'title': 'Skew p50/p99 (ms):', 'name': 'skew', 'type': 'str', 'value': '', 'readonly': True},
+            {'title': 'Unmatched frames:', 'name': 'unmatched', 'type': 'int', 'value': 0, 'readonly': True},
+            {'title': 'Duplicate frames:', 'name': 'duplicates', 'type': 'int', 'value': 0, 'readonly': True,
+             'tip': 'Frames replaced by a frame of the same camera with the same frame number or time, counted as '
+                    'unmatched'},
+            {'title': 'Refresh period (s):', 'name': 'refresh_period', 'type': 'float', 'value': 1., 'min': 0.1},
+        ]},
+    ]
+    params = LazyCameraParams('picam_params')
+
+    callback_signal = QtCore.Signal()
+
+    # Naverage is not supported, frames are emitted as matched
+    hardware_averaging = False
+
+    def __init__(self, parent=None, params_state=None):
+        super().__init__(parent, params_state)
+        self.cameras = []
+        self.acquisition = None
+        self.callback_thread = None
+        self._cancel_wait = threading.Event()
+        self._grab_pending = threading.Event()
+        self._unmatched = 0
+        self._untimed_reported = False
+        self._last_statistics = 0.
+        self._wait_slice = 0.1
+
+    def _selected_serial_numbers(self):
+        return list(self.settings.child('serial_numbers').value().get('selected', []))
+
+    def _apply_camera_settings(self):
+        """Set the exposure time and trigger of all the cameras."""
+        exposure = self.settings.child('exposure').value()
+        response = SCAN_TRIGGERS[self.settings.child('trigger').value()]
+        for camera in self.cameras:
+            camera.set_attribute_value('Exposure Time', exposure, truncate=True)
+            if camera.get_attribute('Trigger Response', error_on_missing=False) is not None:
+                camera.set_attribute_value('Trigger Response', response)
+        # Wait slices of about one frame period, see DAQ_2DViewer_picam._wait_cancellable
+        self._wait_slice = min(max(exposure * 1E-3, 0.01), 0.2)
+
+    def _create_acquisition(self):
+        if self.acquisition is not None:
+            self.acquisition.close()
+        self.acquisition = SynchronizedAcquisition(self.cameras, self.settings.child('match_mode').value(),
+                                                   self.settings.child('tolerance').value() * 1E-3)
+
+    def _reconfigure(self, apply):
+        """Call `apply` with the acquisition stopped, then start the acquisition again if it was running. A grab
+        waiting for its matched set still gets it, from the new acquisition."""
+        running = self.acquisition is not None and self.acquisition.running
+        pending = self._grab_pending.is_set()
+        if running:
+            self.stop()
+        apply()
+        if running:
+            if pending:
+                self._grab_pending.set()
+            self._start_acquisition()
+
+    def commit_settings(self, param):
+        """Commit setting changes to the devices."""
+        if param.name() in ['refresh_cameras', 'backend']:
+            if param.name() == 'backend' or param.value():
+                serial_numbers = camera_enumeration.serial_numbers(self.settings.child('backend').value(),
+                                                                   refresh=param.name() == 'refresh_cameras')
+                selected = [serial_number for serial_number in self._selected_serial_numbers()
+                            if serial_number in serial_numbers]
+                self.settings.child('serial_numbers').setValue(dict(all_items=serial_numbers, selected=selected))
+        elif param.name() in ['exposure', 'trigger']:
+            self._reconfigure(self._apply_camera_settings)
+        elif param.name() in ['match_mode', 'tolerance']:
+            self._reconfigure(self._create_acquisition)
+        elif param.name() == 'serial_numbers':
+            self.emit_status(ThreadCommand('Update_Status', ['Camera selection applied at the next initialization']))
+
+    def ini_detector(self, controller=None):
+        """Open the selected cameras and start the callback thread.
+
+        Returns
+        -------
+        self.status (edict): with initialization status: three fields:
+            * info (str)
+            * controller (object) initialized controller
+            *initialized: (bool): False if initialization failed otherwise True
+        """
+        try:
+            self.status.update(edict(initialized=False, info="", x_axis=None, y_axis=None, controller=None))
+            if self.settings.child('controller_status').value() == "Slave":
+                raise Exception('The synchronized cameras cannot be a slave detector')
+            serial_numbers = self._selected_serial_numbers()
+            if not serial_numbers:
+                raise Exception('No camera selected')
+            backend = self.settings.child('backend').value()
+            self.cameras = []
+            for serial_number in serial_numbers:
+                self.cameras.append(camera_manager.open(backend, serial_number))
+            for camera in self.cameras:
+                camera.set_frame_format('array')
+            self.controller = self.cameras
+            self._apply_camera_settings()
+            self._create_acquisition()
+
+            # The callback thread reads the cameras until stopped, emitting a matched set when a grab is pending
+            callback = PicamCallback(self._wait_for_frames, self._read_frames, lambda: True)
+            self.callback_thread = QtCore.QThread()
+            callback.moveToThread(self.callback_thread)
+            callback.data_sig.connect(self.emit_data)
+            self.callback_signal.connect(callback.wait_for_acquisition)
+            self.callback_thread.callback = callback
+            self.callback_thread.start()
+
+            self.status.info = f"Initialised {len(self.cameras)} cameras"
+            self.status.initialized = True
+            self.status.controller = self.controller
+            return self.status
+
+        except Exception as e:
+            # The cameras opened before the failure are released
+            for camera in self.cameras:
+                camera_manager.close(camera)
+            self.cameras = []
+            self.emit_status(ThreadCommand('Update_Status', [getLineInfo() + str(e), 'log']))
+            self.status.info = getLineInfo() + str(e)
+            self.status.initialized = False
+            return self.status
+
+    def _wait_for_frames(self):
+        """Wait for and read the new frames of all the cameras, in parallel. Called from the callback thread."""
+        if self._cancel_wait.is_set():
+            return False
+        return self.acquisition.collect(self._wait_slice)
+
+    def _read_frames(self):
+        """Newest matched set of frames and its skew, and the number of frames left unmatched since the previous
+        one. None if there is no new set or no grab pending, sets being then dropped so that the camera buffers do
+        not overflow. Called from the callback thread."""
+        matched = self.acquisition.pop()
+        if matched is None or not self._grab_pending.is_set():
+            return None
+        self._grab_pending.clear()
+        unmatched = self.acquisition.matcher.unmatched
+        lost, self._unmatched = unmatched - self._unmatched, unmatched
+        return matched, lost
+
+    def _update_statistics(self, force=False):
+        now = time.perf_counter()
+        if not force and now - self._last_statistics < self.settings.child('sync', 'refresh_period').value():
+            return
+        self._last_statistics = now
+        statistics = self.acquisition.statistics()
+        self.settings.child('sync', 'sets_per_s').setValue(statistics['sets_per_s'])
+        self.settings.child('sync', 'frames_per_s').setValue(
+            ', '.join(f'{rate:.1f}' for rate in statistics['frames_per_s']))
+        self.settings.child('sync', 'skew').setValue(f"{statistics['skew_p50_ms']:.3f} / "
+                                                     f"{statistics['skew_p99_ms']:.3f}")
+        self.settings.child('sync', 'unmatched').setValue(statistics['unmatched'])
+        self.settings.child('sync', 'duplicates').setValue(statistics['duplicates'])
+
+    def emit_data(self, matched, lost):
+        """Emit a matched set of frames, one channel per camera, and its skew."""
+        try:
+            frames, skew = matched
+            if lost:
+                self.emit_status(ThreadCommand('Update_Status', [f'{lost} frame(s) could not be matched']))
+            if self.acquisition.untimed and not self._untimed_reported and self.acquisition.matcher.mode == 'Timestamp':
+                self._untimed_reported = True
+                self.emit_status(ThreadCommand('Update_Status', [
+                    'No camera timestamp, frames matched by host time (spread over the frames read together)',
+                    'log']))
+            self._update_statistics()
+            data = []
+            for serial_number, frame in zip(self._selected_serial_numbers(), frames):
+                frame = np.squeeze(frame)
+                data.append(DataFromPlugins(name=serial_number, data=[frame],
+                                            dim='Data2D' if frame.ndim == 2 else 'Data1D', labels=[serial_number]))
+            data.append(DataFromPlugins(name='Skew', data=[np.array([skew * 1E3])], dim='Data0D',
+                                        labels=['skew (ms)']))
+            self.data_grabed_signal.emit(data)
+        except Exception as e:
+            self.emit_status(ThreadCommand('Update_Status', [str(e), 'log']))
+
+    def grab_data(self, Naverage=1, **kwargs):
+        """Start the acquisition of all the cameras if needed, the callback thread then emits the next matched set.
+        ----------
+        Naverage: (int) Number of averaging, not supported
+        kwargs: (dict) of others optionals arguments
+        """
+        try:
+            self._grab_pending.set()
+            if not self.acquisition.running:
+                self._start_acquisition()
+        except Exception as e:
+            self.emit_status(ThreadCommand('Update_Status', [getLineInfo() + str(e), "log"]))
+
+    def _start_acquisition(self):
+        """Start the acquisition of all the cameras, and the reads of the callback thread."""
+        self._cancel_wait.clear()
+        self._unmatched = 0
+        self._untimed_reported = False
+        self.acquisition.start(self.settings.child('buffer_frames').value())
+        self.callback_signal.emit()
+
+    def stop(self):
+        """Stop the acquisition of all the cameras."""
+        self._cancel_wait.set()
+        self._grab_pending.clear()
+        if self.callback_thread is not None:
+            self.callback_thread.callback.idle.wait(5.)
+        if self.acquisition is not None and self.acquisition.running:
+            self._update_statistics(force=True)
+            self.acquisition.stop()
+        return ''
+
+    def close(self):
+        """Stop the callback thread and the worker pool, then release the cameras."""
+        self.stop()
+        if self.callback_thread is not None:
+            self.callback_thread.quit()
+            self.callback_thread.wait()
+            self.callback_thread = None
+        if self.acquisition is not None:
+            self.acquisition.close()
+            self.acquisition = None
+        for camera in self.cameras:
+            camera_manager.close(camera)
+        self.cameras = []
+        self.controller = None
+        self.status.initialized = False
+        self.status.controller = None
+        self.status.info = ""
+
+
+if __name__ == '__main__':
+    main(__file__)
@@ -0,0 +1,104 @@
+import time
+
+from pymodaq.daq_utils.daq_utils import ThreadCommand, getLineInfo
+from pymodaq.daq_viewer.utility_classes import main
+
+from ..plugins_2D.daq_2Dviewer_picam import DAQ_2DViewer_picam
+from ...hardware.picam_utils import remove_settings_from_list
+
+
+class DAQ_NDViewer_picam(DAQ_2DViewer_picam):
+    """
+        Kinetic series version of the picam viewer.
+
+        At each grab, the camera is armed for a series of N frames (Readout Count, through pylablib's snap mode),
+        acquires them at its own rate without any software round-trip in between, and the whole series is emitted
+        as a single DataND block (frames x y x x) once its readout is complete.
+
+        See Also
+        --------
+        DAQ_2DViewer_picam
+    """
+    # A series is acquired at each grab, there is no armed scan
+    picam_params = remove_settings_from_list(DAQ_2DViewer_picam.picam_params, ['Armed scan']) + [
+        {'title': 'Kinetic series', 'name': 'kinetics', 'type': 'group', 'children': [
+            {'title': 'Frames per series:', 'name': 'nframes', 'type': 'int', 'value': 10, 'min': 1},
+            {'title': 'Timeout (s, 0: from frame rate):', 'name': 'timeout', 'type': 'float', 'value': 0.,
+             'min': 0.},
+        ]},
+    ]
+
+    # Series are averaged by PyMoDAQ
+    hardware_averaging = False
+
+    @property
+    def stacked_view(self):
+        return True
+
+    def _series_timeout(self):
+        """Time allowed for a series to complete, in s."""
+        timeout = self.settings.child('kinetics', 'timeout').value()
+        if timeout > 0:
+            return timeout
+        frame_rate = self.controller.get_attribute_value('Frame Rate Calculation', error_on_missing=False)
+        nframes = self.settings.child('kinetics', 'nframes').value()
+        return 10. + (2 * nframes / frame_rate if frame_rate else 0.)
+
+    def _wait_for_frames(self):
+        """Wait for the whole series. Called from the callback thread."""
+        nframes = self.settings.child('kinetics', 'nframes').value()
+        acquired = self._wait_cancellable(since='start', nframes=nframes, timeout=self._series_timeout())
+        if acquired is False and not self._cancel_wait.is_set():
+            # The camera may already consider the acquisition finished once the series is complete
+            return self.controller.get_frames_status().acquired >= nframes
+        return acquired
+
+    def _read_frames(self):
+        """Read the whole series in a single call. Called from the callback thread."""
+        frames = self._read_batch()
+        status = self.controller.get_frames_status()
+        lost = status.skipped - self._skipped_frames
+        self._skipped_frames = status.skipped
+        if len(frames) == 0:
+            return None
+        # The raw series has been handed to the recorder, the emitted one is corrected and cleaned in a new array
+        return self._copy_frames(frames), lost
+
+    def ini_detector(self, controller=None):
+        """Detector communication initialization (see DAQ_2DViewer_picam). The acquisition settings specific to
+        continuous acquisition are hidden."""
+        self.status = super().ini_detector(controller)
+        for name in ['readout_mode', 'burst_emission', 'buffer_frames', 'averaging_mode', 'reset_averaging',
+                     'display_throttling', 'max_display_rate']:
+            self.settings.child('acquisition', name).hide()
+        return self.status
+
+    def grab_data(self, Naverage=1, **kwargs):
+        """
+        Arm the camera for a series of frames and start it, the series being emitted by the callback thread once
+        complete.
+        ----------
+        Naverage: (int) Number of averaging, done by PyMoDAQ
+        kwargs: (dict) of others optionals arguments
+        """
+        try:
+            self._toggle_non_online_parameters(enabled=False)
+            if self.tracking != self.settings.child('frame_tracking', 'enabled').value():
+                self._apply_frame_tracking()
+            # Each series is a new acquisition, with a buffer holding the whole series
+            self.controller.clear_acquisition()
+            self.controller.setup_acquisition(mode='snap', nframes=self.settings.child('kinetics', 'nframes').value())
+            self._skipped_frames = 0
+            if self.settings.child('recording', 'record').value() and self.recorder is None:
+                self._start_recording()
+            self.tracker.reset(time.time(), time.perf_counter())
+            self._cancel_wait.clear()
+            self.controller.start_acquisition()
+            self.callback_signal.emit()  # will trigger the wait for the series
+
+        except Exception as e:
+            self.emit_status(ThreadCommand('Update_Status', [getLineInfo() + str(e), "log"]))
+
+
+if __name__ == '__main__':
+    main(__file__)
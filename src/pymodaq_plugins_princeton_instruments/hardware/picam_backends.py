@@ -0,0 +1,145 @@
+"""Camera backends usable by the picam plugins.
+
+A backend knows how to list the available cameras and how to open one of them. The 'Picam' backend drives real
+hardware through pylablib, while the 'Simulated' backend uses a software camera with the same interface.
+"""
+import threading
+import time
+
+import pylablib.devices.PrincetonInstruments as PI
+
+from .picam_simulator import SimulatedPicamCamera, list_simulated_cameras
+from .picam_utils import get_roi_shape
+
+
+BACKENDS = ['Picam', 'Simulated']
+
+# Time (in s) during which a camera enumeration is reused
+ENUMERATION_TTL = 60.
+
+
+def list_cameras(backend):
+    """List the cameras available with the given backend."""
+    if backend == 'Picam':
+        return PI.list_cameras()
+    elif backend == 'Simulated':
+        return list_simulated_cameras()
+    raise ValueError(f'Unknown camera backend: {backend}')
+
+
+def list_serial_numbers(backends=BACKENDS, errors=None):
+    """Serial numbers of all the cameras found with the given backends.
+    A backend failing to enumerate (typically because the picam library is not installed) is simply skipped,
+    its error message being stored in the `errors` dictionary if given."""
+    serial_numbers = []
+    for backend in backends:
+        try:
+            serial_numbers.extend([cam.serial_number for cam in list_cameras(backend)])
+        except Exception as e:
+            if errors is not None:
+                errors[backend] = str(e)
+    return serial_numbers
+
+
+class CameraEnumerationCache:
+    """Enumerate the cameras of a backend on demand and reuse the result for `ttl` seconds.
+
+    Enumerating loads the picam library and scans the USB/GigE buses, which is slow: it is only done when the
+    serial number list of a backend is actually needed, and at most once per `ttl` unless explicitly refreshed.
+    """
+    def __init__(self, ttl=ENUMERATION_TTL):
+        self.ttl = ttl
+        # Error of the last enumeration of each backend which failed
+        self.errors = {}
+        self._serial_numbers = {}
+        self._timestamps = {}
+        self._lock = threading.Lock()
+
+    def serial_numbers(self, backend, refresh=False):
+        """Serial numbers of the cameras available with `backend`, enumerated again if `refresh` or if the cache
+        expired. The other backends are not enumerated."""
+        with self._lock:
+            if refresh or backend not in self._serial_numbers or \
+                    time.monotonic() - self._timestamps[backend] > self.ttl:
+                errors = {}
+                self._serial_numbers[backend] = list_serial_numbers([backend], errors=errors)
+                self.errors.pop(backend, None)
+                self.errors.update(errors)
+                self._timestamps[backend] = time.monotonic()
+            return list(self._serial_numbers[backend])
+
+    def invalidate(self):
+        """Force new enumerations at the next requests."""
+        with self._lock:
+            self._serial_numbers.clear()
+
+
+camera_enumeration = CameraEnumerationCache()
+
+
+class LazyCameraParams:
+    """Class attribute giving the plugin parameters, with the serial number list (or selection) filled from the camera
+    enumeration cache only when the parameters are accessed (i.e. when the plugin settings are shown or the plugin
+    instantiated) rather than when the plugin module is imported.
+
+    The parameters are read from the class attribute named `attribute`, so that subclasses only have to extend it.
+    Only the cameras of the default backend (value of the 'backend' parameter) are listed.
+    """
+    def __init__(self, attribute='picam_params'):
+        self.attribute = attribute
+
+    def __get__(self, instance, owner):
+        params = []
+        backend = next((param['value'] for param in getattr(owner, self.attribute) if param['name'] == 'backend'),
+                       BACKENDS[0])
+        for param in getattr(owner, self.attribute):
+            if param['name'] == 'serial_number':
+                serial_numbers = camera_enumeration.serial_numbers(backend)
+                param = dict(param, limits=serial_numbers, value=serial_numbers[0] if serial_numbers else '')
+            elif param['name'] == 'serial_numbers':
+                # Selection of several cameras
+                serial_numbers = camera_enumeration.serial_numbers(backend)
+                param = dict(param, value=dict(all_items=serial_numbers, selected=serial_numbers[:2]))
+            params.append(param)
+        return params
+
+
+class MultiROIPicamCamera(PI.PicamCamera):
+    """Pylablib's picam camera, extended to read out several ROIs.
+
+    Pylablib only supports a single ROI. With several ones, the frames are read as single rows holding the data of
+    each ROI one after the other (see picam_processing.split_rois), the ROIs being set with :meth:`set_rois`.
+    """
+    def get_rois(self):
+        """List of the ROIs as (x, width, x_binning, y, height, y_binning) tuples."""
+        return [tuple(roi) for roi in self.cav["ROIs"]]
+
+    def set_rois(self, rois):
+        """Set several ROIs, given as (x, width, x_binning, y, height, y_binning) tuples. Clears the acquisition."""
+        self.clear_acquisition()
+        self.cav["ROIs"] = [tuple(int(field) for field in roi) for roi in rois]
+        return self.get_rois()
+
+    def get_roi(self):
+        if len(self.cav["ROIs"]) > 1:
+            # Bounding box of the ROIs, binning of the first one
+            rois = self.get_rois()
+            xb, yb = rois[0][2], rois[0][5]
+            return (min(r[0] for r in rois), max(r[0] + r[1] for r in rois),
+                    min(r[3] for r in rois), max(r[3] + r[4] for r in rois), xb, yb)
+        return super().get_roi()
+
+    def _get_data_dimensions_rc(self):
+        rois = self.get_rois()
+        if len(rois) > 1:
+            return 1, sum(get_roi_shape(roi)[0] * get_roi_shape(roi)[1] for roi in rois)
+        return super()._get_data_dimensions_rc()
+
+
+def open_camera(backend, serial_number, **kwargs):
+    """Open a camera with the given backend. Extra keyword arguments are passed to the simulated camera only."""
+    if backend == 'Picam':
+        return MultiROIPicamCamera(serial_number)
+    elif backend == 'Simulated':
+        return SimulatedPicamCamera(serial_number, **kwargs)
+    raise ValueError(f'Unknown camera backend: {backend}')
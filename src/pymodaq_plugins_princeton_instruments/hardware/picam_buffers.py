@@ -0,0 +1,137 @@
+"""Preallocated frame storage for the data handed off to the viewer.
+
+Pylablib returns frames in freshly allocated arrays, frames are then copied into the slots of a ring buffer
+allocated once for the current ROI, and downstream code only receives read-only views of the slots. This is not a
+zero-copy path: storing costs one copy per frame on top of the read. What the slots bring is a bounded memory
+footprint and, with dark/flat corrections, a destination for the corrected frames (the correction then being the
+copy). Slots handed off are never overwritten while any array using them is alive.
+"""
+import threading
+import weakref
+
+import numpy as np
+
+
+SLOT_REUSE_POLICIES = ['Drop', 'Allocate']
+
+
+class FrameRingBuffer:
+    """Fixed number of frame slots in a single contiguous (n_slots, height, width) array.
+
+    Frames are stored in consecutive slots and returned as read-only views, so that a burst of frames is a single
+    3D view. Slots stay leased as long as this view, or any array derived from it, is referenced (by the viewer, a
+    saver, ...): each lease is an array over its own buffer object, which all the derived views keep alive, and the
+    slots are free again once it is garbage collected. When the next slots are still leased, the reuse policy decides
+    what happens:
+
+        * 'Drop': the new frames are dropped (no slots are returned), the views handed off earlier stay valid.
+        * 'Allocate': the frames are returned in a new array, leaving the leased slots untouched.
+
+    Both cases, as well as bursts larger than the buffer (always returned in a new array), are counted.
+    """
+    def __init__(self, n_slots=16, policy='Drop'):
+        self.n_slots = max(int(n_slots), 1)
+        self.policy = policy
+        self.shape = None
+        self.dtype = None
+        self.allocations = 0
+        self.dropped = 0
+        self.fallback_allocations = 0
+        self._buffer = None
+        self._next = 0
+        self._leased = np.zeros(self.n_slots, dtype=bool)
+        # (first slot, last slot + 1, weak reference to the buffer object of the lease)
+        self._leases = []
+        self._lock = threading.Lock()
+
+    @property
+    def nbytes(self):
+        """Memory used by the slots, in bytes."""
+        return 0 if self._buffer is None else self._buffer.nbytes
+
+    @property
+    def leased(self):
+        """Number of slots currently handed off."""
+        with self._lock:
+            self._collect()
+            return int(np.count_nonzero(self._leased))
+
+    def configure(self, shape, dtype, n_slots=None):
+        """Set the frame shape and dtype, reallocating the slots only if they (or their number) changed."""
+        shape = tuple(shape)
+        dtype = np.dtype(dtype)
+        n_slots = self.n_slots if n_slots is None else max(int(n_slots), 1)
+        with self._lock:
+            if self._buffer is None or shape != self.shape or dtype != self.dtype or n_slots != self.n_slots:
+                self.shape = shape
+                self.dtype = dtype
+                self.n_slots = n_slots
+                self._buffer = np.empty((n_slots,) + shape, dtype=dtype)
+                # The arrays leased from the previous slots keep them alive
+                self._leased = np.zeros(n_slots, dtype=bool)
+                self._leases = []
+                self._next = 0
+                self.allocations += 1
+
+    def _collect(self):
+        """Free the slots of the leases no longer referenced."""
+        leases = [lease for lease in self._leases if lease[2]() is not None]
+        if len(leases) != len(self._leases):
+            self._leases = leases
+            self._leased[:] = False
+            for start, stop, _ in leases:
+                self._leased[start:stop] = True
+
+    def _find_free(self, nframes):
+        """First of `nframes` consecutive free slots, looking from the slot following the last lease so that a
+        frame kept downstream for long only takes its own slot. None if there are none."""
+        for offset in range(self.n_slots):
+            start = (self._next + offset) % self.n_slots
+            if start + nframes <= self.n_slots and not self._leased[start:start + nframes].any():
+                return start
+        return None
+
+    def reserve(self, nframes, shape=None, dtype=None):
+        """Lease `nframes` consecutive slots and return them as a writable view, for the caller to fill them
+        (e.g. with processed frames) before handing them off. The buffer is reconfigured if `shape` or `dtype` differ
+        from its current ones. Return None if the frames are to be dropped, the slots being still leased."""
+        if (shape is not None and tuple(shape) != self.shape) or (dtype is not None and np.dtype(dtype) != self.dtype):
+            # The ROI changed without the buffer being configured, e.g. adjusted by the camera
+            self.configure(self.shape if shape is None else shape, self.dtype if dtype is None else dtype)
+        with self._lock:
+            if nframes > self.n_slots:
+                return self._fallback(nframes)
+            self._collect()
+            start = self._find_free(nframes)
+            if start is None:
+                if self.policy == 'Allocate':
+                    return self._fallback(nframes)
+                self.dropped += nframes
+                return None
+            # An array over a buffer object of its own, kept alive by all the views derived from the lease
+            lease = np.asarray(memoryview(self._buffer[start:start + nframes]))
+            self._leases.append((start, start + nframes, weakref.ref(lease.base)))
+            self._leased[start:start + nframes] = True
+            self._next = (start + nframes) % self.n_slots
+            return lease
+
+    def store(self, frames):
+        """Copy a stack of frames (first axis being the frame index) into consecutive slots.
+        Return a read-only view of the stored frames, None if they were dropped."""
+        frames = np.asarray(frames)
+        view = self.reserve(len(frames), frames.shape[1:], frames.dtype)
+        if view is None:
+            return None
+        np.copyto(view, frames)
+        return self.hand_off(view)
+
+    @staticmethod
+    def hand_off(view):
+        """Read-only view of reserved slots, to be handed downstream."""
+        view = view.view()
+        view.flags.writeable = False
+        return view
+
+    def _fallback(self, nframes):
+        self.fallback_allocations += 1
+        return np.empty((nframes,) + self.shape, dtype=self.dtype)
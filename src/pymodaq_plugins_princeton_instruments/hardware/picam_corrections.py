@@ -0,0 +1,143 @@
+"""Dark frame and flat field corrections.
+
+Master dark and flat frames only apply to the camera and acquisition settings they were taken with: they are stored
+under a key made of the camera serial number, the ROIs (including binning), the ADC speed and gain and the exposure
+time. A least recently used set of them is kept in memory, and all of them are saved on disk so that they survive a
+restart.
+"""
+import collections
+import hashlib
+import os
+
+import numpy as np
+
+
+# Camera attributes (besides the ROI) on which the master frames depend
+CORRECTION_KEY_ATTRIBUTES = ['Exposure Time', 'ADC Speed', 'ADC Analog Gain']
+
+CORRECTION_KINDS = ['dark', 'flat']
+
+
+def make_correction_key(camera, values):
+    """Key of the master frames of a camera (e.g. its serial number) for the given attribute values (as cached in
+    an AttributeSnapshot)."""
+    rois = tuple(tuple(int(v) for v in roi) for roi in values['ROIs']) if 'ROIs' in values else None
+    return (camera, rois) + tuple(values.get(name) for name in CORRECTION_KEY_ATTRIBUTES)
+
+
+class CalibrationCache:
+    """Master frames by correction key, with least recently used eviction from memory and storage on disk.
+
+    Parameters
+    ----------
+    max_entries: (int) number of keys kept in memory
+    directory: (str) folder where the master frames are saved, None to keep them in memory only
+    """
+    def __init__(self, max_entries=8, directory=None):
+        self.max_entries = max(int(max_entries), 1)
+        self.directory = directory
+        self._entries = collections.OrderedDict()
+
+    def _path(self, key):
+        digest = hashlib.sha1(repr(key).encode()).hexdigest()[:16]
+        return os.path.join(self.directory, f'master_{digest}.npz')
+
+    def get(self, key):
+        """Master frames for a key, as a dictionary {kind: frame} (possibly empty)."""
+        if key in self._entries:
+            self._entries.move_to_end(key)
+            return self._entries[key]
+        entry = {}
+        if self.directory is not None and os.path.isfile(self._path(key)):
+            with np.load(self._path(key)) as data:
+                # A hash collision would give frames of another key
+                if str(data['key']) == repr(key):
+                    entry = {kind: data[kind] for kind in CORRECTION_KINDS if kind in data}
+        self._store(key, entry)
+        return entry
+
+    def put(self, key, kind, frame):
+        """Store a master frame of the given kind ('dark' or 'flat') for a key, in memory and on disk."""
+        entry = dict(self.get(key))
+        entry[kind] = np.asarray(frame, dtype=np.float32)
+        self._store(key, entry)
+        if self.directory is not None:
+            os.makedirs(self.directory, exist_ok=True)
+            np.savez(self._path(key), key=repr(key), **entry)
+
+    def _store(self, key, entry):
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def clear(self, disk=False):
+        """Forget the master frames in memory, and on disk if `disk`."""
+        self._entries.clear()
+        if disk and self.directory is not None and os.path.isdir(self.directory):
+            for name in os.listdir(self.directory):
+                if name.startswith('master_') and name.endswith('.npz'):
+                    os.remove(os.path.join(self.directory, name))
+
+
+class FrameCorrector:
+    """Dark subtraction and flat field normalization, with float32 arithmetic.
+
+    The flat field is converted into a per-pixel gain (mean of the dark subtracted flat divided by it), so that
+    correcting a frame costs one subtraction and one multiplication. Masters are replaced as a whole, so that they
+    can be changed while frames are being corrected in another thread.
+    """
+    def __init__(self):
+        self._masters = (None, None)
+
+    @property
+    def dark(self):
+        return self._masters[0]
+
+    @property
+    def gain(self):
+        return self._masters[1]
+
+    @property
+    def active(self):
+        return any(master is not None for master in self._masters)
+
+    @property
+    def shape(self):
+        """Shape of the frames the corrections apply to, None if inactive."""
+        for master in self._masters:
+            if master is not None:
+                return master.shape
+        return None
+
+    def set_masters(self, dark=None, flat=None):
+        """Set the master frames to apply, None disabling the corresponding correction."""
+        dark = None if dark is None else np.asarray(dark, dtype=np.float32)
+        gain = None
+        if flat is not None:
+            signal = np.asarray(flat, dtype=np.float32) - (0 if dark is None else dark)
+            valid = signal > 0
+            gain = np.ones(signal.shape, dtype=np.float32)
+            if valid.any():
+                np.divide(signal[valid].mean(), signal, out=gain, where=valid)
+        self._masters = (dark, gain)
+
+    def apply(self, frames, out=None):
+        """Correct frames (the last two axes being the pixels), writing the result in `out` (float32 or float64,
+        possibly `frames` itself).
+
+        Returns `out`, or None (leaving `out` untouched) if there is no correction or the masters do not match the
+        shape of the frames, e.g. when the ROI just changed."""
+        dark, gain = masters = self._masters
+        shape = next((master.shape for master in masters if master is not None), None)
+        if shape is None or np.shape(frames)[-2:] != shape:
+            return None
+        if out is None:
+            out = np.empty(np.shape(frames), dtype=np.float32)
+        if dark is not None:
+            np.subtract(frames, dark, out=out, casting='unsafe')
+        elif out is not frames:
+            np.copyto(out, frames, casting='unsafe')
+        if gain is not None:
+            np.multiply(out, gain, out=out)
+        return out
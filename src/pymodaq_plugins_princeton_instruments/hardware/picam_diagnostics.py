@@ -0,0 +1,129 @@
+"""Timing probes of the acquisition pipeline.
+
+A grab goes through ``grab_data`` -> ``callback_signal`` -> ``PicamCallback.wait_for_acquisition`` (wait for the
+frames, then read them) -> ``data_sig`` -> ``emit_data`` (wrap the frames into DataFromPlugins) ->
+``data_grabed_signal`` -> GUI, which calls ``grab_data`` again. The duration of each of these stages is kept over a
+rolling window, from which percentiles and histograms are computed on demand, so that recording a sample only costs
+two ``perf_counter`` calls and an array assignment.
+"""
+import json
+import threading
+import time
+
+import numpy as np
+
+
+# Stage names and their descriptions
+PIPELINE_STAGES = {
+    'wait': 'wait for the frames (callback thread)',
+    'read': 'read of the frames (callback thread)',
+    'wrap': 'conversion of the frames into the emitted data',
+    'dispatch': 'data_sig emission to emit_data start (queued signal)',
+    'gui_return': 'data_grabed_signal emission to the next grab_data',
+}
+
+# Histogram bin edges, in s: log-spaced from 1 us to 10 s
+HISTOGRAM_EDGES = np.logspace(-6, 1, 57)
+
+
+class StageStatistics:
+    """Rolling window of the durations (in s) of one pipeline stage."""
+    def __init__(self, window=1000):
+        self._samples = np.zeros(max(int(window), 1))
+        self._next = 0
+        self.count = 0  # Total number of samples, including those out of the window
+
+    @property
+    def samples(self):
+        """Durations in the window, oldest first."""
+        if self.count < len(self._samples):
+            return self._samples[:self.count].copy()
+        return np.roll(self._samples, -self._next)
+
+    def add(self, duration):
+        self._samples[self._next] = duration
+        self._next = (self._next + 1) % len(self._samples)
+        self.count += 1
+
+    def percentiles(self, q=(50, 90, 99)):
+        """Percentiles of the durations in the window, NaN if empty."""
+        samples = self.samples
+        if len(samples) == 0:
+            return np.full(len(q), np.nan)
+        return np.percentile(samples, q)
+
+    def histogram(self, edges=HISTOGRAM_EDGES):
+        """Number of durations in the window falling in each bin."""
+        return np.histogram(self.samples, bins=edges)[0]
+
+    def summary(self):
+        """Statistics of the window, durations in ms."""
+        samples = self.samples * 1E3
+        p50, p90, p99 = self.percentiles() * 1E3
+        return {'count': self.count, 'window': len(samples),
+                'mean_ms': float(samples.mean()) if len(samples) else float('nan'),
+                'p50_ms': float(p50), 'p90_ms': float(p90), 'p99_ms': float(p99),
+                'max_ms': float(samples.max()) if len(samples) else float('nan')}
+
+
+class PipelineProfiler:
+    """Durations of the pipeline stages, see PIPELINE_STAGES.
+
+    Stages are either timed around a call (``start = profiler.clock(); ...; profiler.record(stage, start)``) or
+    between two threads: :meth:`mark` stores the time of an event (e.g. a signal emission) and :meth:`record_since`
+    records the time elapsed since then, once. When disabled, probes only cost an attribute lookup.
+    """
+    def __init__(self, window=1000, enabled=True):
+        self.enabled = enabled
+        self.window = window
+        self.stages = {}
+        self._marks = {}
+        self._lock = threading.Lock()
+        self.reset()
+
+    @staticmethod
+    def clock():
+        return time.perf_counter()
+
+    def reset(self, window=None):
+        """Forget all the recorded durations, optionally changing the window length."""
+        if window is not None:
+            self.window = window
+        with self._lock:
+            self.stages = {stage: StageStatistics(self.window) for stage in PIPELINE_STAGES}
+            self._marks = {}
+
+    def record(self, stage, start):
+        """Record the duration of a stage started at `start` (as given by :meth:`clock`)."""
+        if self.enabled:
+            self.stages[stage].add(time.perf_counter() - start)
+
+    def mark(self, stage):
+        """Store the start time of a stage ending in another thread."""
+        if self.enabled:
+            self._marks[stage] = time.perf_counter()
+
+    def record_since(self, stage):
+        """Record the duration of a stage since its mark, if any, and clear the mark."""
+        start = self._marks.pop(stage, None)
+        if start is not None and self.enabled:
+            self.stages[stage].add(time.perf_counter() - start)
+
+    def summary(self):
+        """Statistics of each stage, durations in ms."""
+        with self._lock:
+            return {stage: stats.summary() for stage, stats in self.stages.items()}
+
+    def export(self, path, metadata=None):
+        """Write the statistics, histograms and samples of each stage to a JSON file."""
+        with self._lock:
+            stages = {stage: dict(stats.summary(), description=PIPELINE_STAGES[stage],
+                                  histogram=stats.histogram().tolist(),
+                                  samples_ms=(stats.samples * 1E3).tolist())
+                      for stage, stats in self.stages.items()}
+        content = {'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                   'metadata': dict(metadata or {}),
+                   'histogram_edges_ms': (HISTOGRAM_EDGES * 1E3).tolist(),
+                   'stages': stages}
+        with open(path, 'w') as f:
+            json.dump(content, f, indent=2)
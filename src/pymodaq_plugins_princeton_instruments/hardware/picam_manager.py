@@ -0,0 +1,261 @@
+"""Several cameras in one process: shared opening, and synchronized acquisition.
+
+Cameras are opened once per process by the :class:`CameraManager` and shared by the plugins using them. A
+:class:`SynchronizedAcquisition` waits for and reads the frames of several cameras in parallel, in a pool with one
+worker per camera, and groups them by frame number or timestamp with a :class:`FrameMatcher`, so that the cameras
+are emitted as a single dataset. The time spread of each matched set (skew) and the throughput are kept.
+Frames without camera timestamp (metadata not supported) are given host times spread over the time since the previous
+read of their camera, and counted.
+"""
+import collections
+import concurrent.futures
+import threading
+import time
+
+import numpy as np
+
+from .picam_backends import camera_enumeration, open_camera
+from .picam_diagnostics import StageStatistics
+from .picam_process import ProcessCamera
+from .picam_processing import FRAME_INFO_FIELDS, frame_info_columns
+
+
+MATCH_MODES = ['Frame number', 'Timestamp']
+
+
+class CameraManagerError(Exception):
+    """Raised when a camera cannot be shared as requested."""
+
+
+class CameraManager:
+    """Cameras opened once per process, shared by all the plugins using them and closed with the last one."""
+    def __init__(self):
+        self._cameras = {}  # (backend, serial number) -> [camera, number of users, opened in a worker process]
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def serial_numbers(backend, refresh=False):
+        """Serial numbers of the cameras available with `backend`, from the enumeration shared by all plugins."""
+        return camera_enumeration.serial_numbers(backend, refresh=refresh)
+
+    def open(self, backend, serial_number, process=False, **kwargs):
+        """Open a camera (see open_camera), in a worker process if `process` (see picam_process.ProcessCamera), or
+        return it if it is already open. A camera being opened only once, it cannot be shared between users asking
+        for it in and out of a worker process: CameraManagerError is then raised."""
+        with self._lock:
+            key = (backend, serial_number)
+            if key not in self._cameras:
+                camera = ProcessCamera(backend, serial_number, **kwargs) if process else \
+                    open_camera(backend, serial_number, **kwargs)
+                self._cameras[key] = [camera, 0, process]
+            elif self._cameras[key][2] != process:
+                raise CameraManagerError(f'Camera {serial_number} is already open '
+                                         f'{"in" if self._cameras[key][2] else "out of"} a separate process')
+            self._cameras[key][1] += 1
+            return self._cameras[key][0]
+
+    def close(self, camera):
+        """Release a camera, closing it if no one else uses it. Return whether it was closed."""
+        with self._lock:
+            for key, entry in self._cameras.items():
+                if entry[0] is camera:
+                    entry[1] -= 1
+                    if entry[1] > 0:
+                        return False
+                    del self._cameras[key]
+                    break
+        camera.close()
+        return True
+
+    def users(self, camera):
+        """Number of plugins using a camera."""
+        with self._lock:
+            return next((entry[1] for entry in self._cameras.values() if entry[0] is camera), 0)
+
+
+camera_manager = CameraManager()
+
+
+class FrameMatcher:
+    """Groups frames of several cameras taken at the same time.
+
+    Frames are identified either by their frame number since the acquisition start ('Frame number', which needs the
+    cameras to be triggered together) or by their time ('Timestamp', matched within `tolerance` seconds). Frames left
+    behind a matched set, pending for too long, or replaced by a frame of the same camera with the same key (counted
+    as duplicates too) are dropped and counted as unmatched.
+    """
+    def __init__(self, ncameras, mode='Frame number', tolerance=1E-3, max_pending=64):
+        self.mode = mode
+        self.tolerance = tolerance
+        self.max_pending = max_pending
+        self.unmatched = 0
+        self.duplicates = 0
+        self._pending = [collections.OrderedDict() for _ in range(ncameras)]  # key -> (frame, time)
+
+    def add(self, camera, keys, frames, times):
+        """Add frames of a camera, with their frame numbers and times (in s)."""
+        pending = self._pending[camera]
+        for key, frame, t in zip(keys, frames, times):
+            key = key if self.mode == 'Frame number' else t
+            if pending.pop(key, None) is not None:
+                self.duplicates += 1
+                self.unmatched += 1
+            pending[key] = (frame, t)
+        while len(pending) > self.max_pending:
+            pending.popitem(last=False)
+            self.unmatched += 1
+
+    def _find(self, camera, key):
+        """Key of the pending frame of a camera matching `key` of the first camera, None if there is none."""
+        pending = self._pending[camera]
+        if self.mode == 'Frame number':
+            return key if key in pending else None
+        if not pending:
+            return None
+        nearest = min(pending, key=lambda t: abs(t - key))
+        return nearest if abs(nearest - key) <= self.tolerance else None
+
+    def pop_latest(self):
+        """Frames and times (one per camera) of the newest complete set, None if there is none yet.
+        Older pending frames are dropped."""
+        for key in reversed(self._pending[0]):
+            keys = [key] + [self._find(camera, key) for camera in range(1, len(self._pending))]
+            if None in keys:
+                continue
+            frames, times = [], []
+            for pending, matched in zip(self._pending, keys):
+                while True:
+                    older, (frame, t) = pending.popitem(last=False)
+                    if older == matched:
+                        break
+                    self.unmatched += 1
+                frames.append(frame)
+                times.append(t)
+            return frames, times
+        return None
+
+    def reset(self):
+        for pending in self._pending:
+            pending.clear()
+        self.unmatched = 0
+        self.duplicates = 0
+
+
+class SynchronizedAcquisition:
+    """Continuous acquisition of several cameras, read in parallel and emitted as matched sets.
+
+    Parameters
+    ----------
+    cameras: (list) opened cameras
+    mode: (str) one of MATCH_MODES
+    tolerance: (float) maximum time difference (in s) of frames matched by timestamp
+    """
+    def __init__(self, cameras, mode='Frame number', tolerance=1E-3):
+        self.cameras = list(cameras)
+        self.matcher = FrameMatcher(len(self.cameras), mode, tolerance)
+        self.skew = StageStatistics(1000)
+        self.frames_read = [0] * len(self.cameras)
+        self.sets = 0
+        self.untimed = 0
+        self._starts = [0.] * len(self.cameras)
+        self._last_reads = [0.] * len(self.cameras)
+        self._resolutions = [1E6] * len(self.cameras)
+        self._fields = [FRAME_INFO_FIELDS] * len(self.cameras)
+        self._t_start = None
+        self._pool = concurrent.futures.ThreadPoolExecutor(max_workers=len(self.cameras),
+                                                           thread_name_prefix='picam_sync')
+
+    @property
+    def running(self):
+        return self._t_start is not None
+
+    def _map(self, fn, *args):
+        """Call fn(index, camera, *args) for all the cameras in parallel and return the results in order."""
+        futures = [self._pool.submit(fn, ind, camera, *args) for ind, camera in enumerate(self.cameras)]
+        return [future.result() for future in futures]
+
+    def _start_camera(self, ind, camera, nframes, timestamps):
+        camera.clear_acquisition()
+        camera.enable_metadata(timestamps)
+        camera.setup_acquisition(mode='sequence', nframes=nframes)
+        self._resolutions[ind] = camera.get_attribute_value('Time Stamp Resolution', error_on_missing=False,
+                                                            default=1E6)
+        self._fields[ind] = camera.get_frame_info_fields()
+        self._starts[ind] = self._last_reads[ind] = time.perf_counter()
+        camera.start_acquisition()
+
+    def start(self, nframes=100):
+        """Set up and start all the cameras, in parallel so that they start as close as possible to each other.
+        Timestamps (frame metadata) are enabled when matching by timestamp."""
+        self.matcher.reset()
+        self.skew = StageStatistics(1000)
+        self.frames_read = [0] * len(self.cameras)
+        self.sets = 0
+        self.untimed = 0
+        self._map(self._start_camera, nframes, self.matcher.mode == 'Timestamp')
+        self._t_start = time.perf_counter()
+
+    def stop(self):
+        self._map(lambda ind, camera: camera.stop_acquisition())
+        self._t_start = None
+
+    def _collect_camera(self, ind, camera, timeout):
+        """Wait up to `timeout` for frames of a camera and read all its new ones, with their frame numbers and
+        times: timestamps (converted to the host clock) if available, otherwise host times spread evenly from the
+        previous read to this one, so that frames read together keep distinct times."""
+        try:
+            if camera.wait_for_frame(since='lastread', nframes=1, timeout=timeout) is False:
+                return False
+        except camera.TimeoutError:
+            return True
+        if camera.get_new_images_range() is None:
+            return True  # pylablib cannot read an empty range in 'array' frame format
+        frames, infos, rng = camera.read_multiple_images(return_info=True, return_rng=True)
+        now = time.perf_counter()
+        if frames is None or len(frames) == 0:
+            return True
+        last_read, self._last_reads[ind] = self._last_reads[ind], now
+        keys = range(rng[0], rng[0] + len(frames))
+        columns = frame_info_columns(infos, self._fields[ind])
+        timestamps = None if columns is None else columns.get('timestamp_start')
+        if timestamps is None or np.any(timestamps < 0):
+            times = now - (now - last_read) / len(frames) * np.arange(len(frames) - 1, -1, -1)
+            self.untimed += len(frames)
+        else:
+            times = self._starts[ind] + timestamps / self._resolutions[ind]
+        self.matcher.add(ind, keys, frames, times)
+        self.frames_read[ind] += len(frames)
+        return True
+
+    def collect(self, timeout=0.1):
+        """Wait for and read the new frames of all the cameras in parallel, each wait lasting at most `timeout`.
+        Return False if an acquisition is stopped."""
+        return all(self._map(self._collect_camera, timeout))
+
+    def pop(self):
+        """Newest matched set of frames (one per camera) and its skew in s, None if there is none yet."""
+        matched = self.matcher.pop_latest()
+        if matched is None:
+            return None
+        frames, times = matched
+        skew = max(times) - min(times)
+        self.skew.add(skew)
+        self.sets += 1
+        return frames, skew
+
+    def statistics(self):
+        """Throughput (matched sets and frames of each camera per second), skew percentiles (ms), unmatched frames
+        (and among them duplicates) and frames without camera timestamp."""
+        elapsed = time.perf_counter() - self._t_start if self._t_start is not None else np.nan
+        p50, p99 = self.skew.percentiles((50, 99)) * 1E3
+        return {'sets_per_s': self.sets / elapsed,
+                'frames_per_s': [nframes / elapsed for nframes in self.frames_read],
+                'skew_p50_ms': float(p50), 'skew_p99_ms': float(p99),
+                'unmatched': self.matcher.unmatched, 'duplicates': self.matcher.duplicates,
+                'untimed': self.untimed}
+
+    def close(self):
+        """Stop the cameras and the worker pool (the cameras are not closed)."""
+        if self.running:
+            self.stop()
+        self._pool.shutdown(wait=True)
@@ -0,0 +1,455 @@
+"""Camera running in a separate process, frames being passed through shared memory.
+
+A :class:`ProcessCamera` starts a worker process which opens and owns the camera, and exposes the same interface as
+the camera objects of the backends. Method calls are forwarded to the worker through a control pipe. During an
+acquisition, a reader thread of the worker waits for the frames, copies them into a ring of frame slots in shared
+memory and announces them (index range and metadata) through a data pipe. Frames are then read by the plugin as
+views of the ring, without any copy nor call to the worker, so that the camera keeps being read at its own pace
+when the plugin process is busy (garbage collection, plotting...).
+
+The worker only overwrites a slot once the frame it holds has been read and `held_frames` more frames have been read
+after it: a frame read from a ProcessCamera stays valid until then. When the ring is full, the worker stops reading
+and the frames accumulate in the camera buffer, as they would without the worker.
+"""
+import collections
+import functools
+import multiprocessing
+import threading
+import time
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from .picam_backends import open_camera
+
+
+TFramesStatus = collections.namedtuple("TFramesStatus", ["acquired", "unread", "skipped", "buffer_size"])
+
+# Fields of the camera attributes copied to the plugin process (see SimulatedPicamAttribute)
+ATTRIBUTE_FIELDS = ['name', 'kind', 'exists', 'relevant', 'read_directly', 'writable', 'can_set_online', 'cons_type',
+                    'cons_permanent', 'cons_error', 'min', 'max', 'inc', 'cons_roi', 'labels', 'ilabels', 'values',
+                    'ivalues', 'default']
+
+# Camera calls after which the worker stops reading frames, as they end or reconfigure the acquisition
+ACQUISITION_CALLS = ['setup_acquisition', 'clear_acquisition', 'stop_acquisition', 'set_roi', 'set_rois', 'close']
+
+# Bytes at the start of the shared memory, holding the index of the oldest frame the worker may overwrite
+HEADER_SIZE = 64
+
+# Frames kept valid after being read (see ProcessCamera)
+HELD_FRAMES = 8
+
+
+class ProcessCameraError(RuntimeError):
+    """Error raised by the camera in the worker process"""
+
+
+class ProcessCameraTimeoutError(ProcessCameraError):
+    """Timeout while waiting for frames"""
+
+
+class _CameraWorker:
+    """Worker process side: owns the camera, executes the forwarded calls and reads the frames into the ring."""
+    def __init__(self, camera, control, data):
+        self.camera = camera
+        self.control = control
+        self.data = data
+        self.generation = 0
+        self._shm = None
+        self._reader = None
+        self._stop = threading.Event()
+
+    def describe(self, attribute):
+        return {field: getattr(attribute, field, None) for field in ATTRIBUTE_FIELDS}
+
+    def run(self):
+        # Frames are always read as arrays, the frame format being applied in the plugin process
+        self.camera.set_frame_format('array')
+        while True:
+            command, args, kwargs = self.control.recv()
+            try:
+                result = self.execute(command, args, kwargs)
+                self.control.send(('ok', result))
+            except Exception as e:
+                self.control.send(('error', isinstance(e, self.camera.TimeoutError), f'{type(e).__name__}: {e}'))
+            if command == 'close':
+                break
+
+    def execute(self, command, args, kwargs):
+        if command == 'attributes':
+            return {name: self.describe(attribute) for name, attribute in self.camera.get_all_attributes().items()}
+        elif command == 'attribute':
+            name, update_limits = args
+            attribute = self.camera.get_attribute(name)
+            if update_limits:
+                attribute.update_limits()
+            return self.describe(attribute)
+        elif command == 'truncate_value':
+            name, value = args
+            return self.camera.get_attribute(name).truncate_value(value)
+        elif command == 'getattr':
+            return getattr(self.camera, args[0])
+        elif command == 'setattr':
+            setattr(self.camera, *args)
+            return None
+        elif command == 'start_acquisition':
+            return self.start(args, kwargs)
+        if command in ACQUISITION_CALLS:
+            self.stop_reader()
+        if command == 'close':
+            self.detach()
+        return getattr(self.camera, command)(*args, **kwargs)
+
+    def start(self, args, kwargs):
+        """Start the acquisition and the reader thread, in the shared memory given by the plugin process."""
+        name, nslots = kwargs.pop('ring')
+        self.stop_reader()
+        if self._shm is None or self._shm.name != name:
+            self.detach()
+            self._shm = shared_memory.SharedMemory(name)
+        shape = tuple(self.camera.get_data_dimensions())
+        dtype = np.dtype(np.uint16 if self.camera.get_attribute_value('Pixel Bit Depth') <= 16 else np.uint32)
+        header = np.ndarray((1,), dtype=np.int64, buffer=self._shm.buf)
+        header[0] = 0
+        ring = np.ndarray((nslots,) + shape, dtype=dtype, buffer=self._shm.buf, offset=HEADER_SIZE)
+        self.camera.start_acquisition(*args, **kwargs)
+        self.generation += 1
+        self._stop.clear()
+        self._reader = threading.Thread(target=self._read_loop, args=(ring, header, self.generation), daemon=True)
+        self._reader.start()
+        return self.generation
+
+    def _read_loop(self, ring, header, generation):
+        nslots = len(ring)
+        written = skipped = 0
+        while not self._stop.is_set():
+            free = nslots - (written - int(header[0]))
+            if free <= 0:
+                time.sleep(1E-3)  # Ring full, the frames wait in the camera buffer
+                continue
+            try:
+                self.camera.wait_for_frame(since='lastread', nframes=1, timeout=0.05)
+            except self.camera.TimeoutError:
+                pass
+            rng = self.camera.get_new_images_range()
+            if rng is None:
+                if not self.camera.acquisition_in_progress():
+                    break  # All the frames of the acquisition are read
+                continue
+            frames, infos, rng = self.camera.read_multiple_images(rng=(rng[0], min(rng[1], rng[0] + free)),
+                                                                  return_info=True, return_rng=True)
+            if frames is None or len(frames) == 0:
+                continue
+            first, last = rng[0], rng[0] + len(frames)
+            skipped += max(first - written, 0)
+            # Copy into the slots, in two parts when wrapping around the end of the ring
+            start = first % nslots
+            nfirst = min(len(frames), nslots - start)
+            ring[start:start + nfirst] = frames[:nfirst]
+            ring[:len(frames) - nfirst] = frames[nfirst:]
+            written = last
+            self.data.send((generation, first, last, list(infos), skipped))
+        self.data.send((generation, None, written, [], skipped))  # Acquisition over
+
+    def stop_reader(self):
+        if self._reader is not None:
+            self._stop.set()
+            self._reader.join()
+            self._reader = None
+
+    def detach(self):
+        if self._shm is not None:
+            self._shm.close()
+            self._shm = None
+
+
+def _run_worker(backend, serial_number, kwargs, control, data):
+    """Entry point of the worker process."""
+    try:
+        camera = open_camera(backend, serial_number, **kwargs)
+    except Exception as e:
+        control.send(('error', False, f'{type(e).__name__}: {e}'))
+        return
+    control.send(('ok', None))
+    _CameraWorker(camera, control, data).run()
+
+
+class ProcessAttribute:
+    """Copy of a camera attribute in the plugin process, its value being read and set in the worker."""
+    def __init__(self, camera, description):
+        self._camera = camera
+        self.__dict__.update(description)
+
+    def update_limits(self, force=False):
+        self.__dict__.update(self._camera._call('attribute', self.name, True))
+
+    def truncate_value(self, value):
+        return self._camera._call('truncate_value', self.name, value)
+
+    def get_value(self, enum_as_str=True):
+        return self._camera.get_attribute_value(self.name, enum_as_str=enum_as_str)
+
+    def set_value(self, value, truncate=True):
+        self._camera.set_attribute_value(self.name, value, truncate=truncate)
+
+    def __repr__(self):
+        return "{}(name='{}', kind='{}')".format(self.__class__.__name__, self.name, self.kind)
+
+
+class ProcessCamera:
+    """Camera opened in a worker process (see the module documentation).
+
+    Acquisition state and frames are served from the ring in shared memory, all other calls are forwarded to the
+    camera in the worker.
+
+    Parameters
+    ----------
+    backend, serial_number: camera to open, see picam_backends.open_camera
+    held_frames: (int) number of frames read after a frame before its slot may be reused
+    kwargs: passed to open_camera
+    """
+    Error = ProcessCameraError
+    TimeoutError = ProcessCameraTimeoutError
+
+    # Frames are views of the ring, only valid for a while (see the module documentation)
+    transient_frames = True
+
+    def __init__(self, backend, serial_number, held_frames=HELD_FRAMES, **kwargs):
+        self.held_frames = held_frames
+        self._call_lock = threading.Lock()
+        self._frames_lock = threading.RLock()
+        self._format = 'list'
+        self._nframes = 100
+        self._shm = None
+        self._ring = None
+        self._header = None
+        self._generation = None
+        self._running = False
+        self._acquired = self._last_read = self._last_wait = self._skipped = self._superseded = 0
+        self._infos = []
+        context = multiprocessing.get_context('spawn')
+        self._control, control = context.Pipe()
+        self._data, data = context.Pipe(duplex=False)
+        self._process = context.Process(target=_run_worker, args=(backend, serial_number, kwargs, control, data),
+                                        name=f'picam_{serial_number}', daemon=True)
+        self._process.start()
+        control.close()
+        data.close()
+        try:
+            self._reply()
+            self._attributes = {name: ProcessAttribute(self, description)
+                                for name, description in self._call('attributes').items()}
+        except Exception:
+            self._process.join(5.)
+            raise
+
+    def _reply(self):
+        try:
+            reply = self._control.recv()
+        except EOFError:
+            raise self.Error('the camera process ended')
+        if reply[0] == 'error':
+            raise (self.TimeoutError if reply[1] else self.Error)(reply[2])
+        return reply[1]
+
+    def _call(self, command, *args, **kwargs):
+        with self._call_lock:
+            self._control.send((command, args, kwargs))
+            return self._reply()
+
+    def __getattr__(self, name):
+        # Other camera methods, called in the worker
+        if name.startswith('__') or '_control' not in self.__dict__:
+            raise AttributeError(name)
+        return functools.partial(self._call, name)
+
+    @property
+    def frame_rate(self):
+        """Frame rate of the simulated camera."""
+        return self._call('getattr', 'frame_rate')
+
+    @frame_rate.setter
+    def frame_rate(self, frame_rate):
+        self._call('setattr', 'frame_rate', frame_rate)
+
+    # Attributes
+    def get_attribute(self, name, error_on_missing=True):
+        if name in self._attributes:
+            return self._attributes[name]
+        if error_on_missing:
+            raise self.Error(f"attribute {name} is missing")
+
+    def get_all_attributes(self, copy=False):
+        return dict(self._attributes) if copy else self._attributes
+
+    # Acquisition
+    def set_frame_format(self, fmt):
+        self._format = fmt
+        return fmt
+
+    def setup_acquisition(self, mode="sequence", nframes=100):
+        with self._frames_lock:
+            self._running = False
+            self._nframes = int(nframes)
+            return self._call('setup_acquisition', mode=mode, nframes=nframes)
+
+    def _allocate_ring(self):
+        """Shared memory for the buffer size and the current frame size, reused when it is large enough."""
+        nslots = self._nframes + self.held_frames
+        shape = tuple(self._call('get_data_dimensions'))
+        dtype = np.dtype(np.uint16 if self.get_attribute_value('Pixel Bit Depth') <= 16 else np.uint32)
+        size = HEADER_SIZE + nslots * int(np.prod(shape)) * dtype.itemsize
+        if self._shm is None or self._shm.size < size:
+            self._release_ring()
+            self._shm = shared_memory.SharedMemory(create=True, size=size)
+        self._header = np.ndarray((1,), dtype=np.int64, buffer=self._shm.buf)
+        self._ring = np.ndarray((nslots,) + shape, dtype=dtype, buffer=self._shm.buf, offset=HEADER_SIZE)
+        self._ring.flags.writeable = False
+        return nslots
+
+    def _release_ring(self):
+        self._ring = self._header = None
+        if self._shm is not None:
+            try:
+                self._shm.close()
+            except BufferError:
+                pass  # Frames still referenced, the memory is unmapped once they are garbage collected
+            self._shm.unlink()
+            self._shm = None
+
+    def start_acquisition(self, *args, **kwargs):
+        with self._frames_lock:
+            self._running = False
+            if args or kwargs:
+                self._nframes = int(kwargs.get('nframes', args[1] if len(args) > 1 else self._nframes))
+            nslots = self._allocate_ring()
+            self._acquired = self._last_read = self._last_wait = self._skipped = self._superseded = 0
+            self._infos = [None] * nslots
+            self._generation = self._call('start_acquisition', *args, ring=(self._shm.name, nslots), **kwargs)
+            self._running = True
+
+    def stop_acquisition(self):
+        with self._frames_lock:
+            self._running = False
+            return self._call('stop_acquisition')
+
+    def clear_acquisition(self):
+        with self._frames_lock:
+            self._running = False
+            return self._call('clear_acquisition')
+
+    def acquisition_in_progress(self):
+        with self._frames_lock:
+            self._receive()
+            return self._running
+
+    def _receive(self, timeout=0.):
+        """Process the frame announcements of the worker, waiting up to `timeout` for the first one."""
+        while self._data.poll(timeout):
+            timeout = 0.
+            generation, first, last, infos, skipped = self._data.recv()
+            if generation != self._generation:
+                continue  # Previous acquisition
+            if first is None:
+                self._running = False
+            else:
+                for index, info in enumerate(infos, first):
+                    self._infos[index % len(self._infos)] = info
+            self._acquired = last
+            self._skipped = skipped
+
+    def _release(self):
+        """Let the worker reuse the slots of the frames read `held_frames` frames ago."""
+        if self._header is not None:
+            self._header[0] = max(self._last_read - self.held_frames, 0)
+
+    def get_frames_status(self):
+        with self._frames_lock:
+            self._receive()
+            # As with pylablib, unread frames older than the read ones count as skipped
+            return TFramesStatus(self._acquired, self._acquired - self._last_read, self._skipped + self._superseded,
+                                 self._nframes)
+
+    def get_new_images_range(self):
+        with self._frames_lock:
+            self._receive()
+            return (self._last_read, self._acquired) if self._acquired > self._last_read else None
+
+    def wait_for_frame(self, since="lastread", nframes=1, timeout=20., error_on_stopped=False):
+        t0 = time.perf_counter()
+        with self._frames_lock:
+            self._receive()
+            reference = {'lastread': self._last_read, 'lastwait': self._last_wait, 'now': self._acquired,
+                         'start': 0}[since]
+        while True:
+            with self._frames_lock:
+                if self._acquired - reference >= nframes:
+                    self._last_wait = self._acquired
+                    return True
+                if not self._running:
+                    if error_on_stopped:
+                        raise self.Error("waiting for a frame while acquisition is stopped")
+                    return False
+                remaining = None if timeout is None else timeout - (time.perf_counter() - t0)
+                if remaining is not None and remaining <= 0:
+                    raise self.TimeoutError
+                # Short polls, so that the other calls are not delayed
+                self._receive(0.01 if remaining is None else min(remaining, 0.01))
+
+    def read_multiple_images(self, rng=None, peek=False, missing_frame="skip", return_info=False,
+                             return_rng=False):
+        with self._frames_lock:
+            self._receive()
+            if self._ring is None:
+                result = (None, None, None)
+            else:
+                first, last = self._last_read, self._acquired
+                if rng is not None:
+                    first, last = max(rng[0], first), min(rng[1], last)
+                    last = max(first, last)
+                nslots = len(self._ring)
+                start = first % nslots
+                if start + last - first <= nslots:
+                    frames = self._ring[start:start + last - first]
+                else:
+                    # Wrapping around the end of the ring
+                    frames = np.concatenate([self._ring[start:], self._ring[:last - first - (nslots - start)]])
+                infos = [self._infos[index % nslots] for index in range(first, last)]
+                if self._format != 'array':
+                    frames = list(frames)
+                elif infos:
+                    infos = np.array(infos)
+                if not peek:
+                    self._superseded += max(first - self._last_read, 0)
+                    self._last_read = max(self._last_read, last)
+                    self._release()
+                result = (frames, infos, (first, last))
+        result = result[:1] + ((result[1],) if return_info else ()) + ((result[2],) if return_rng else ())
+        return result[0] if len(result) == 1 else result
+
+    def read_newest_image(self, peek=False, return_info=False):
+        rng = self.get_new_images_range()
+        if rng is None:
+            return None
+        frames, infos = self.read_multiple_images(rng=(rng[1] - 1, rng[1]), peek=peek, return_info=True)
+        if len(frames) == 0:
+            return None
+        return (frames[0], infos[0]) if return_info else frames[0]
+
+    def close(self):
+        """Close the camera and end the worker process."""
+        with self._frames_lock:
+            self._running = False
+        try:
+            if self._process.is_alive():
+                self._call('close')
+        finally:
+            self._process.join(5.)
+            if self._process.is_alive():
+                self._process.terminate()
+            self._control.close()
+            self._data.close()
+            self._release_ring()
+
+    def is_opened(self):
+        return self._process.is_alive()
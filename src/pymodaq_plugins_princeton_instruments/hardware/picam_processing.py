@@ -0,0 +1,552 @@
+"""Frame processing helpers running in the acquisition (callback) thread.
+
+Everything here works on numpy arrays with vectorized operations and preallocated buffers, so that the cost per
+frame stays independent of the python interpreter speed.
+"""
+import numpy as np
+
+
+AVERAGING_MODES = ['Block', 'Running', 'Rolling window']
+COSMIC_RAY_METHODS = ['Off', 'Median of N', 'Laplacian']
+FRAME_STATISTICS = ['Sum', 'Mean', 'Max', 'Saturated pixels', 'Centroid']
+AUTO_EXPOSURE_MODES = ['Off', 'Once', 'Continuous']
+FRAME_INFO_FIELDS = ['frame_index', 'timestamp_start', 'timestamp_end', 'framestamp']
+
+
+class FrameAccumulator:
+    """Average frames in a preallocated buffer.
+
+    Integer frames are summed exactly in an int64 buffer, floating point frames in a float64 one.
+
+    Modes:
+        * 'Block': average of ``naverage`` consecutive frames, then start over.
+        * 'Running': cumulative average of all the frames since the last reset.
+        * 'Rolling window': average of the last ``naverage`` frames.
+    """
+    def __init__(self, mode='Block', naverage=1):
+        self.mode = mode
+        self.naverage = max(int(naverage), 1)
+        self.shape = None
+        self.count = 0
+        self._sum = None
+        self._tmp = None
+        self._window = None
+        self._window_index = 0
+
+    def configure(self, mode, naverage):
+        """Change the averaging mode or number of frames, resetting the accumulation if anything changed."""
+        naverage = max(int(naverage), 1)
+        if mode != self.mode or naverage != self.naverage:
+            self.mode = mode
+            self.naverage = naverage
+            self.reset()
+
+    def reset(self):
+        """Forget the accumulated frames. Buffers are kept and reused if the frame shape does not change."""
+        self.count = 0
+        self._window_index = 0
+
+    def _allocate(self, shape, dtype):
+        sum_dtype = np.int64 if np.issubdtype(dtype, np.integer) else np.float64
+        if self._sum is None or self._sum.shape != shape or self._sum.dtype != sum_dtype:
+            self.shape = shape
+            self._sum = np.zeros(shape, dtype=sum_dtype)
+            self._tmp = np.zeros(shape, dtype=sum_dtype)
+            self._window = None
+            self.count = 0
+        if self.mode == 'Rolling window' and \
+                (self._window is None or self._window.shape[0] != self.naverage or self._window.dtype != dtype):
+            self._window = np.zeros((self.naverage,) + shape, dtype=dtype)
+            self.count = 0
+            self._window_index = 0
+        if self.count == 0:
+            self._sum.fill(0)
+
+    @property
+    def remaining(self):
+        """Number of frames still needed to complete the current block (1 in the other modes)."""
+        if self.mode == 'Block':
+            return max(self.naverage - self.count, 1)
+        return 1
+
+    @property
+    def ready(self):
+        """Whether an average can be emitted."""
+        if self.mode == 'Block':
+            return self.count >= self.naverage
+        return self.count > 0
+
+    def add(self, frames):
+        """Add a stack of frames (first axis being the frame index) to the accumulation.
+        In block mode, frames beyond the end of the current block are ignored: call :meth:`reset` once the
+        average has been used to start the next block."""
+        frames = np.asarray(frames)
+        if len(frames) == 0:
+            return
+        self._allocate(frames.shape[1:], frames.dtype)
+
+        if self.mode == 'Block':
+            frames = frames[:self.naverage - self.count]
+        if self.mode == 'Rolling window':
+            if len(frames) >= self.naverage:
+                # The window is entirely renewed
+                self._window[...] = frames[-self.naverage:]
+                np.sum(self._window, axis=0, dtype=self._sum.dtype, out=self._sum)
+                self._window_index = 0
+                self.count = self.naverage
+                return
+            for frame in frames:
+                # Replace the oldest frame of the window, updating the sum incrementally
+                if self.count >= self.naverage:
+                    np.subtract(self._sum, self._window[self._window_index], out=self._sum)
+                np.add(self._sum, frame, out=self._sum)
+                self._window[self._window_index] = frame
+                self._window_index = (self._window_index + 1) % self.naverage
+                self.count = min(self.count + 1, self.naverage)
+            return
+        np.sum(frames, axis=0, dtype=self._sum.dtype, out=self._tmp)
+        np.add(self._sum, self._tmp, out=self._sum)
+        self.count += len(frames)
+
+    def mean(self, out=None):
+        """Average of the accumulated frames, as float64."""
+        if out is None:
+            out = np.empty(self.shape, dtype=np.float64)
+        return np.divide(self._sum, max(self.count, 1), out=out)
+
+
+def sum_tracks(frames, count, height, spacing, out=None):
+    """Sum the rows of equally spaced tracks, for a stack of frames (first axis being the frame index) whose first
+    row is the first row of the first track.
+
+    The tracks are viewed as a (frames, count, height, width) array without copying, and summed over their height
+    in a single call. Integer frames are summed in uint32, floating point frames in float64.
+    Returns a (frames, count, width) array."""
+    frames = np.ascontiguousarray(frames)
+    nframes, nrows, width = frames.shape
+    if (count - 1) * spacing + height > nrows:
+        raise ValueError(f'{count} tracks of height {height} spaced by {spacing} rows do not fit in {nrows} rows')
+    tracks = np.lib.stride_tricks.as_strided(
+        frames, shape=(nframes, count, height, width),
+        strides=(frames.strides[0], spacing * frames.strides[1], frames.strides[1], frames.strides[2]),
+        writeable=False)
+    dtype = np.uint32 if np.issubdtype(frames.dtype, np.integer) else np.float64
+    return np.sum(tracks, axis=2, dtype=dtype, out=out)
+
+
+def split_rois(frames, shapes):
+    """Split a stack of frames read out with several ROIs into one stack per ROI, without copying.
+
+    The data of the ROIs of a readout follow each other, each ROI being stored row by row. The frames are thus read
+    as a (frames, 1, pixels) array, `shapes` being the (rows, columns) of each ROI. Returns (frames, rows, columns)
+    views. A single ROI is returned as is."""
+    if len(shapes) == 1:
+        return [frames]
+    nframes = len(frames)
+    packed = frames.reshape((nframes, -1))
+    views = []
+    start = 0
+    for rows, columns in shapes:
+        views.append(packed[:, start:start + rows * columns].reshape((nframes, rows, columns)))
+        start += rows * columns
+    return views
+
+
+def frame_info_columns(infos, fields=FRAME_INFO_FIELDS):
+    """Decode the frame infos of a batch of frames returned by pylablib into a dictionary of int64 arrays, one per
+    field.
+
+    `infos` is either a 2D array with one row per frame ('array' frame info format), whose columns are `fields` as
+    given by the camera get_frame_info_fields, or a list of named tuples. Missing values (metadata disabled) are -1.
+    Returns None if there is no info."""
+    if infos is None or len(infos) == 0:
+        return None
+    if isinstance(infos, np.ndarray):
+        rows = infos.reshape((len(infos), -1)).astype(np.int64)
+        return {name: column for name, column in zip(fields, rows.T)}
+    named = next((info for info in infos if info is not None), None)
+    if named is None:
+        return None
+    return {name: np.array([-1 if info is None or getattr(info, name) is None else getattr(info, name)
+                            for info in infos], dtype=np.int64) for name in named._fields}
+
+
+class FrameTracker:
+    """Decode the frame metadata (frame stamps and exposure time stamps) returned by pylablib as frame infos.
+
+    Frames missed by the camera or the library, as opposed to frames overwritten in the buffer or not read, show up
+    as frame stamps increasing by more than the frame indices. Time stamps, counted in camera ticks since the
+    acquisition start, are converted to seconds and referenced to the host clock at the acquisition start.
+    """
+    def __init__(self, resolution=1E6, framestamp_bits=64, fields=FRAME_INFO_FIELDS):
+        self.configure(resolution, framestamp_bits, fields)
+        self.reset()
+
+    def configure(self, resolution, framestamp_bits, fields=FRAME_INFO_FIELDS):
+        """Set the time stamp resolution (ticks per second), the frame stamp bit depth and the names of the frame
+        info fields (the columns of 'array' frame infos, see frame_info_columns)."""
+        self.resolution = float(resolution)
+        self._framestamp_mask = np.uint64(2 ** int(framestamp_bits) - 1) if framestamp_bits < 64 else None
+        self.fields = list(fields)
+
+    def reset(self, t_start_wall=0., t_start_perf=0.):
+        """Forget the previous frames, `t_start_wall` and `t_start_perf` being the host time (time.time and
+        time.perf_counter) at the acquisition start."""
+        self.t_start_wall = t_start_wall
+        self.t_start_perf = t_start_perf
+        self.gaps = 0
+        self.interval = np.nan
+        self.last_exposure_end = np.nan
+        self._last = None  # frame index, frame stamp and start time stamp of the last frame
+
+    def update(self, infos):
+        """Decode the infos of a batch of frames, in acquisition order.
+        Return the host timestamps of the frames (exposure start), or None if the camera returned no metadata."""
+        columns = frame_info_columns(infos, self.fields)
+        if columns is None or any(name not in columns for name in FRAME_INFO_FIELDS):
+            return None
+        indices, ts_start, ts_end, framestamps = [columns[name] for name in FRAME_INFO_FIELDS]
+        if np.any(ts_start < 0) or np.any(framestamps < 0):
+            return None  # Metadata disabled or not supported
+        timestamps = self.t_start_wall + ts_start / self.resolution
+        if self._last is not None:
+            indices = np.concatenate([[self._last[0]], indices])
+            framestamps = np.concatenate([[self._last[1]], framestamps])
+            ts_start = np.concatenate([[self._last[2]], ts_start])
+        if len(indices) > 1:
+            # Frame stamps wrap around at their bit depth
+            stamp_steps = np.diff(framestamps.astype(np.uint64))
+            if self._framestamp_mask is not None:
+                stamp_steps &= self._framestamp_mask
+            self.gaps += int(np.sum(stamp_steps.astype(np.int64) - np.diff(indices)))
+            self.interval = (ts_start[-1] - ts_start[0]) / (indices[-1] - indices[0]) / self.resolution
+        self.last_exposure_end = ts_end[-1] / self.resolution
+        self._last = (indices[-1], framestamps[-1], ts_start[-1])
+        return timestamps
+
+
+class CosmicRayFilter:
+    """Detect and replace cosmic ray hits, frame by frame, in preallocated float32 buffers.
+
+    Methods:
+        * 'Median of N': pixels exceeding the median of the last ``nframes`` cleaned frames by more than
+          ``threshold`` times the noise are replaced by that median. Needs a static scene, and at least 3 frames in
+          the history before cleaning anything.
+        * 'Laplacian': pixels whose Laplacian (4 neighbours, i.e. 2 along the row for single row spectra) exceeds
+          ``threshold`` times the noise are replaced by the mean of their neighbours. Works on single frames, but
+          only sees sharp features.
+
+    The noise is estimated for each frame from the median absolute deviation of the residuals (in counts, at least
+    1), and only positive outliers are hits. Frames read out with several ROIs (see split_rois) are cleaned ROI by
+    ROI, each with its own filter, so that pixels of different ROIs are never compared.
+    """
+    def __init__(self, method='Off', nframes=5, threshold=8.):
+        self.method = method
+        self.nframes = max(int(nframes), 3)
+        self.threshold = threshold
+        self.shape = None
+        self.total_hits = 0
+        self._out = None
+        self._history = None
+        self._filled = 0
+        self._next = 0
+        self._roi_shapes = None
+        self._roi_filters = []
+
+    def configure(self, method, nframes, threshold):
+        """Change the settings, forgetting the frame history if the method or its length changed."""
+        nframes = max(int(nframes), 3)
+        if method != self.method or nframes != self.nframes:
+            self.method = method
+            self.nframes = nframes
+            self._history = None
+            self.reset()
+        self.threshold = threshold
+        for roi_filter in self._roi_filters:
+            roi_filter.configure(method, nframes, threshold)
+
+    def reset(self):
+        self._filled = 0
+        self._next = 0
+        self.total_hits = 0
+        for roi_filter in self._roi_filters:
+            roi_filter.reset()
+
+    def _allocate(self, nframes, shape):
+        if shape != self.shape:
+            self.shape = shape
+            self._out = None
+            self._history = None
+            self._filled = 0
+            self._next = 0
+            self._reference = np.empty(shape, dtype=np.float32)
+            self._residual = np.empty(shape, dtype=np.float32)
+            self._tmp = np.empty(shape, dtype=np.float32)
+            self._mask = np.empty(shape, dtype=bool)
+            self._padded = np.empty((shape[0] + 2, shape[1] + 2), dtype=np.float32)
+        if self.method == 'Median of N' and self._history is None:
+            self._history = np.empty((self.nframes,) + shape, dtype=np.float32)
+            self._scratch = np.empty_like(self._history)
+
+    def apply(self, frames, shapes=None, out=None):
+        """Clean a stack of frames (first axis being the frame index), read out with the ROIs of the given
+        (rows, columns) `shapes` if several (see split_rois). The cleaned frames are written into `out` (floating
+        point, possibly `frames` themselves), or into a float32 buffer of the filter valid until the next call.
+        Return the cleaned frames and the number of hits in each frame."""
+        frames = np.asarray(frames)
+        nframes = len(frames)
+        self._allocate(nframes, frames.shape[1:])
+        if out is None:
+            if self._out is None or len(self._out) < nframes:
+                self._out = np.empty((nframes,) + frames.shape[1:], dtype=np.float32)
+            out = self._out[:nframes]
+        if shapes is not None and len(shapes) > 1:
+            return out, self._apply_rois(frames, out, [tuple(shape) for shape in shapes])
+        np.copyto(out, frames, casting='unsafe')
+        hits = np.zeros(nframes, dtype=np.int64)
+        for ind in range(nframes):
+            if self.method == 'Median of N':
+                hits[ind] = self._clean_median(out[ind])
+            elif self.method == 'Laplacian':
+                hits[ind] = self._clean_laplacian(out[ind])
+        self.total_hits += int(hits.sum())
+        return out, hits
+
+    def _apply_rois(self, frames, out, shapes):
+        """Clean each ROI of the frames with its own filter into `out`. Return the number of hits in each frame."""
+        if shapes != self._roi_shapes:
+            self._roi_shapes = shapes
+            self._roi_filters = [CosmicRayFilter(self.method, self.nframes, self.threshold) for _ in shapes]
+        hits = np.zeros(len(frames), dtype=np.int64)
+        for roi_filter, roi_frames, roi_out in zip(self._roi_filters, split_rois(frames, shapes),
+                                                   split_rois(out, shapes)):
+            _, roi_hits = roi_filter.apply(roi_frames, out=roi_out)
+            hits += roi_hits
+        self.total_hits += int(hits.sum())
+        return hits
+
+    def _replace_outliers(self, frame):
+        """Replace the pixels whose residual is above threshold by the reference. Return the number of hits."""
+        # The noise is estimated on a subsample of the large frames
+        step = 4 if self._residual.size > 65536 else 1
+        sigma = max(1.4826 * float(np.median(np.abs(self._residual[::step, ::step]))), 1.)
+        np.greater(self._residual, self.threshold * sigma, out=self._mask)
+        nhits = int(np.count_nonzero(self._mask))
+        if nhits:
+            np.copyto(frame, self._reference, where=self._mask)
+        return nhits
+
+    def _clean_median(self, frame):
+        nhits = 0
+        if self._filled >= 3:
+            # Median (the upper one for an even history) by sorting a copy of the history with an odd-even
+            # transposition network: whole frame min/max operations are much faster than numpy's median or
+            # partition along a short axis
+            scratch = self._scratch[:self._filled]
+            np.copyto(scratch, self._history[:self._filled])
+            for step in range(self._filled):
+                for ind in range(step % 2, self._filled - 1, 2):
+                    np.minimum(scratch[ind], scratch[ind + 1], out=self._tmp)
+                    np.maximum(scratch[ind], scratch[ind + 1], out=scratch[ind + 1])
+                    np.copyto(scratch[ind], self._tmp)
+            np.copyto(self._reference, scratch[self._filled // 2])
+            np.subtract(frame, self._reference, out=self._residual)
+            nhits = self._replace_outliers(frame)
+        # The history holds cleaned frames, so that a hit does not bias the next references
+        self._history[self._next] = frame
+        self._next = (self._next + 1) % self.nframes
+        self._filled = min(self._filled + 1, self.nframes)
+        return nhits
+
+    def _clean_laplacian(self, frame):
+        height, width = frame.shape
+        padded = self._padded
+        padded[1:-1, 1:-1] = frame
+        # Edges are mirrored (without repeating the edge pixels), so that edge pixels also have two neighbours
+        if height > 1:
+            padded[0, 1:-1] = frame[1]
+            padded[-1, 1:-1] = frame[-2]
+        if width > 1:
+            padded[:, 0] = padded[:, 2]
+            padded[:, -1] = padded[:, -3]
+        # Mean of the neighbours as reference, single rows (spectra) or columns only having 2 of them
+        reference = self._reference
+        reference.fill(0)
+        if height > 1:
+            np.add(padded[:-2, 1:-1], padded[2:, 1:-1], out=reference)
+        if width > 1:
+            np.add(reference, padded[1:-1, :-2], out=reference)
+            np.add(reference, padded[1:-1, 2:], out=reference)
+        np.multiply(reference, 1 / (2 * ((height > 1) + (width > 1)) or 1), out=reference)
+        np.subtract(frame, reference, out=self._residual)
+        return self._replace_outliers(frame)
+
+
+class FrameStatistics:
+    """Reductions of a stack of frames (first axis being the frame index) into one value per frame.
+
+    Each statistic is a single vectorized pass over the stack, the sum and the centroid sharing the column profile
+    of the frames (sum over the rows): 'Sum', 'Mean', 'Max', 'Saturated pixels' (pixels at or above the saturation
+    level) and 'Centroid' (intensity weighted x and y, in pixels of the frames, y only for frames with several
+    rows). Integer frames are summed in int64, floating point ones in float64.
+    """
+    def __init__(self, statistics=(), saturation=2 ** 16 - 1):
+        self.statistics = []
+        self.saturation = saturation
+        self._coordinates = {}
+        self.configure(statistics, saturation)
+
+    def configure(self, statistics, saturation):
+        """Select the statistics (in FRAME_STATISTICS) and set the saturation level."""
+        self.statistics = [name for name in FRAME_STATISTICS if name in statistics]
+        self.saturation = saturation
+
+    @property
+    def active(self):
+        return bool(self.statistics)
+
+    def labels(self, frame_shape):
+        """Labels of the values returned by :meth:`compute` for frames of the given shape."""
+        labels = []
+        for name in self.statistics:
+            if name == 'Centroid':
+                labels += ['Centroid x'] + (['Centroid y'] if len(frame_shape) == 2 and frame_shape[0] > 1 else [])
+            else:
+                labels.append(name)
+        return labels
+
+    def _coordinate(self, size):
+        if size not in self._coordinates:
+            self._coordinates[size] = np.arange(size, dtype=np.float64)
+        return self._coordinates[size]
+
+    def compute(self, frames):
+        """Statistics of each frame of a stack of 1D or 2D frames, as a list of arrays (one value per frame) in the
+        order of :meth:`labels`."""
+        frames = np.asarray(frames)
+        if frames.ndim == 2:
+            frames = frames[:, np.newaxis]
+        nframes, nrows, ncolumns = frames.shape
+        dtype = np.int64 if np.issubdtype(frames.dtype, np.integer) else np.float64
+        columns = total = None
+        if any(name in self.statistics for name in ['Sum', 'Mean', 'Centroid']):
+            columns = np.sum(frames, axis=1, dtype=dtype)
+            total = np.sum(columns, axis=1)
+        values = []
+        for name in self.statistics:
+            if name == 'Sum':
+                values.append(total)
+            elif name == 'Mean':
+                values.append(total / (nrows * ncolumns))
+            elif name == 'Max':
+                values.append(np.max(frames, axis=(1, 2)))
+            elif name == 'Saturated pixels':
+                values.append(np.count_nonzero(frames >= self.saturation, axis=(1, 2)))
+            elif name == 'Centroid':
+                # Frames without any signal have no centroid
+                with np.errstate(divide='ignore', invalid='ignore'):
+                    weights = np.where(total != 0, total, np.nan)
+                    values.append(columns @ self._coordinate(ncolumns) / weights)
+                    if nrows > 1:
+                        rows = np.sum(frames, axis=2, dtype=dtype)
+                        values.append(rows @ self._coordinate(nrows) / weights)
+        return values
+
+
+class AutoExposure:
+    """Exposure control loop bringing the bright pixels of the frames to a target fraction of the ADC full scale.
+
+    The level of a frame is a high percentile of its pixels (robust to a few hot pixels or cosmic rays), taken with
+    a partial sort of a subsampled grid of pixels (one out of `subsampling` along each axis), together with its dark
+    level (a low percentile). The signal above the dark level being proportional to the exposure time, the next
+    exposure time is the current one scaled by the ratio of the target signal to the measured one, by at most
+    MAX_STEP (the signal of saturated frames is only known to be too high). A run ends when the level is within
+    `tolerance` of the target ('Converged'), when the exposure time reaches its limits ('Exposure limit') or after
+    `max_iterations` changes ('Not converged'). In 'Continuous' mode, a new run starts when the level of a
+    converged run (or at an exposure limit) leaves a dead band of twice the tolerance, a run which did not converge
+    staying stopped until the loop is reset. The `settling` frames following each change are ignored, as they may
+    have been exposed (or read) before the change.
+
+    Levels are measured in the acquisition thread (:meth:`measure`), the exposure times computed where the camera
+    is set (:meth:`update`).
+    """
+    MAX_STEP = 10.
+    DARK_PERCENTILE = 5.
+    SATURATED_FILL = 0.98
+
+    def __init__(self, mode='Off', target=0.7, percentile=99.5, tolerance=0.05, subsampling=4, settling=2,
+                 max_iterations=10, full_scale=2 ** 16 - 1):
+        self.configure(mode, target, percentile, tolerance, subsampling, settling, max_iterations, full_scale)
+
+    def configure(self, mode, target, percentile, tolerance, subsampling, settling, max_iterations, full_scale):
+        """Change the settings (target and tolerance as fractions of the full scale) and start a new run."""
+        self.mode = mode
+        self.target = target
+        self.percentile = percentile
+        self.tolerance = tolerance
+        self.subsampling = max(int(subsampling), 1)
+        self.settling = max(int(settling), 0)
+        self.max_iterations = max(int(max_iterations), 1)
+        self.full_scale = full_scale
+        self.reset()
+
+    def reset(self):
+        self.iterations = 0
+        self.state = 'Converging'
+        self.level = None
+        self._settle = 0
+
+    @property
+    def active(self):
+        """Whether frame levels are needed, i.e. a run is ongoing or the exposure is followed continuously."""
+        return (self.mode == 'Continuous' and self.state != 'Not converged') or \
+            (self.mode == 'Once' and self.state == 'Converging')
+
+    def measure(self, frame):
+        """Level and dark level (in counts) of a 1D or 2D frame."""
+        frame = np.asarray(frame)
+        step = self.subsampling
+        sample = (frame[::step, ::step] if frame.ndim == 2 else frame[::step]).ravel()
+        high = int(round(self.percentile / 100 * (sample.size - 1)))
+        low = int(round(self.DARK_PERCENTILE / 100 * (sample.size - 1)))
+        sample = np.partition(sample, (low, high))
+        return float(sample[high]), float(sample[low])
+
+    def update(self, level, dark, exposure, truncate=None):
+        """Next exposure time for a frame of the given levels exposed with `exposure`, None if it is kept.
+        `truncate` brings an exposure time within the limits of the camera."""
+        if self._settle > 0:
+            self._settle -= 1
+            return None
+        if not self.active:
+            return None
+        self.level = level
+        target = self.target * self.full_scale
+        deviation = abs(level - target)
+        if self.state == 'Not converged':
+            return None
+        if self.state != 'Converging':
+            # Continuous mode: new run once the signal changed beyond the dead band
+            if deviation <= 2 * self.tolerance * self.full_scale:
+                return None
+            self.iterations = 0
+            self.state = 'Converging'
+        if deviation <= self.tolerance * self.full_scale:
+            self.state = 'Converged'
+            return None
+        if self.iterations >= self.max_iterations:
+            self.state = 'Not converged'
+            return None
+        signal = level - dark
+        ratio = (target - dark) / signal if signal > 0 else self.MAX_STEP
+        if level >= self.SATURATED_FILL * self.full_scale:
+            ratio = min(ratio, 0.5)
+        new_exposure = exposure * min(max(ratio, 1 / self.MAX_STEP), self.MAX_STEP)
+        if truncate is not None:
+            new_exposure = truncate(new_exposure)
+        if new_exposure == exposure:
+            self.state = 'Exposure limit'
+            return None
+        self.iterations += 1
+        self._settle = self.settling
+        return new_exposure
@@ -0,0 +1,243 @@
+"""Streaming of the acquired frames to disk, from the acquisition (callback) thread.
+
+Frames are queued by the acquisition thread and written by a dedicated writer thread, either in a chunked and
+resizable HDF5 dataset (h5py is an optional dependency) or in a memory-mapped ``.npy`` file of fixed capacity.
+The queue is bounded: when the disk cannot keep up, the acquisition thread either blocks or drops frames, and
+dropped frames are counted.
+
+File layout:
+    * HDF5: ``frames`` (N, height, width) dataset chunked by frame, with ``frame_index`` and ``timestamp``
+      datasets of length N. The acquisition metadata (exposure, ROI...) are stored as attributes of ``frames``.
+    * npy: ``<name>.npy`` holds the frames, ``<name>_frames.npy`` a structured array with the frame index and
+      timestamp of each frame, and ``<name>.json`` the acquisition metadata. The frame file is truncated to the
+      number of recorded frames when closed.
+
+An existing recording is never overwritten: when the file already exists, a counter is appended to its name
+(``<name>_001.h5``...), so that every acquisition start writes a new file.
+"""
+import json
+import os
+import queue
+import threading
+import time
+
+import numpy as np
+
+try:
+    import h5py
+except ImportError:  # Only needed for the HDF5 format
+    h5py = None
+
+
+RECORDING_FORMATS = ['HDF5', 'npy']
+BACKPRESSURE_POLICIES = ['Block', 'Drop']
+
+FRAME_INFO_DTYPE = np.dtype([('frame_index', np.int64), ('timestamp', np.float64)])
+
+
+class RecorderError(Exception):
+    """Raised when a recording cannot be started or written."""
+
+
+class _HDF5Writer:
+    def __init__(self, path, shape, dtype, metadata):
+        if h5py is None:
+            raise RecorderError('h5py is needed to record in the HDF5 format')
+        self.file = h5py.File(path, 'w')
+        self.frames = self.file.create_dataset('frames', shape=(0,) + shape, maxshape=(None,) + shape,
+                                               chunks=(1,) + shape, dtype=dtype)
+        self.frame_index = self.file.create_dataset('frame_index', shape=(0,), maxshape=(None,), dtype=np.int64)
+        self.timestamp = self.file.create_dataset('timestamp', shape=(0,), maxshape=(None,), dtype=np.float64)
+        for key, value in metadata.items():
+            self.frames.attrs[key] = value
+        self.count = 0
+        self.capacity = None
+
+    def write(self, frames, infos):
+        end = self.count + len(frames)
+        for dataset in [self.frames, self.frame_index, self.timestamp]:
+            dataset.resize(end, axis=0)
+        self.frames[self.count:end] = frames
+        self.frame_index[self.count:end] = infos['frame_index']
+        self.timestamp[self.count:end] = infos['timestamp']
+        self.count = end
+
+    def close(self):
+        self.file.close()
+
+
+class _NpyWriter:
+    def __init__(self, path, shape, dtype, metadata, capacity):
+        root = os.path.splitext(path)[0]
+        self.path = root + '.npy'
+        self.frames = np.lib.format.open_memmap(self.path, mode='w+', dtype=dtype, shape=(capacity,) + shape)
+        self.infos = np.lib.format.open_memmap(root + '_frames.npy', mode='w+', dtype=FRAME_INFO_DTYPE,
+                                               shape=(capacity,))
+        self.metadata_path = root + '.json'
+        self.metadata = dict(metadata)
+        self.count = 0
+        self.capacity = capacity
+
+    def write(self, frames, infos):
+        end = self.count + len(frames)
+        self.frames[self.count:end] = frames
+        self.infos[self.count:end] = infos
+        self.count = end
+
+    def close(self):
+        self.frames.flush()
+        self.infos.flush()
+        frame_shape = self.frames.shape[1:]
+        del self.frames, self.infos
+        if self.count < self.capacity:
+            _truncate_npy(self.path, (self.count,) + frame_shape)
+            _truncate_npy(os.path.splitext(self.path)[0] + '_frames.npy', (self.count,))
+        with open(self.metadata_path, 'w') as f:
+            json.dump(dict(self.metadata, recorded_frames=self.count), f, indent=2, default=str)
+
+
+def _unique_root(root, suffixes):
+    """Return `root`, or `root` followed by the first free counter, so that none of the files made of the root and
+    one of `suffixes` exists."""
+    candidate = root
+    counter = 0
+    while any(os.path.exists(candidate + suffix) for suffix in suffixes):
+        counter += 1
+        candidate = f'{root}_{counter:03d}'
+    return candidate
+
+
+def _truncate_npy(path, shape):
+    """Shrink a .npy file to a smaller first dimension, rewriting its header in place."""
+    with open(path, 'r+b') as f:
+        version = np.lib.format.read_magic(f)
+        if version == (1, 0):
+            _, fortran_order, dtype = np.lib.format.read_array_header_1_0(f)
+        else:
+            _, fortran_order, dtype = np.lib.format.read_array_header_2_0(f)
+        data_offset = f.tell()
+        text = repr({'descr': np.lib.format.dtype_to_descr(dtype), 'fortran_order': fortran_order,
+                     'shape': tuple(shape)})
+        # The header keeps its length, numpy ignoring the trailing spaces
+        prefix_length = 8 + (2 if version == (1, 0) else 4)
+        text = text.ljust(data_offset - prefix_length - 1) + '\n'
+        f.seek(prefix_length)
+        f.write(text.encode('latin1'))
+        f.truncate(data_offset + int(np.prod(shape)) * dtype.itemsize)
+
+
+class StreamRecorder:
+    """Write frames to disk from a writer thread fed by a bounded queue.
+
+    Parameters
+    ----------
+    path: (str) file to write, its extension being replaced according to the format. If the file exists, a
+        counter is appended to its name, the path actually written being given by `path` once started
+    fmt: (str) one of RECORDING_FORMATS
+    frame_shape: (tuple) shape of the frames, as given by the ROI
+    dtype: numpy dtype of the frames
+    metadata: (dict) acquisition metadata stored along the frames
+    queue_size: (int) maximum number of frame batches waiting to be written
+    policy: (str) what to do when the queue is full, 'Block' the acquisition thread or 'Drop' the frames
+    capacity: (int) maximum number of frames, needed by the npy format (the file is preallocated)
+    """
+    def __init__(self, path, fmt='HDF5', frame_shape=(1, 1), dtype=np.uint16, metadata=None, queue_size=64,
+                 policy='Block', capacity=10000):
+        self.path = path
+        self.fmt = fmt
+        self.frame_shape = tuple(frame_shape)
+        self.dtype = np.dtype(dtype)
+        self.metadata = dict(metadata or {})
+        self.policy = policy
+        self.capacity = capacity
+        self.queued_frames = 0
+        self.written_frames = 0
+        # Counted by both the acquisition and the writer threads, see _count_dropped
+        self.dropped_frames = 0
+        self._dropped_lock = threading.Lock()
+        self.error = None
+        self._closed = False
+        self._queue = queue.Queue(maxsize=max(int(queue_size), 1))
+        self._writer = None
+        self._thread = None
+
+    @property
+    def queue_fill(self):
+        """Number of batches waiting to be written."""
+        return self._queue.qsize()
+
+    def _count_dropped(self, nframes):
+        with self._dropped_lock:
+            self.dropped_frames += nframes
+
+    def start(self):
+        """Create the file and start the writer thread."""
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        metadata = dict(self.metadata, start_time=time.strftime('%Y-%m-%dT%H:%M:%S'))
+        root = os.path.splitext(self.path)[0]
+        if self.fmt == 'HDF5':
+            self.path = _unique_root(root, ['.h5']) + '.h5'
+            self._writer = _HDF5Writer(self.path, self.frame_shape, self.dtype, metadata)
+        elif self.fmt == 'npy':
+            self.path = _unique_root(root, ['.npy', '_frames.npy', '.json']) + '.npy'
+            self._writer = _NpyWriter(self.path, self.frame_shape, self.dtype, metadata, self.capacity)
+        else:
+            raise RecorderError(f'Unknown recording format: {self.fmt}')
+        self._thread = threading.Thread(target=self._write_loop, name='picam_recorder', daemon=True)
+        self._thread.start()
+
+    def put(self, frames, first_index=None, timestamp=None):
+        """Queue a stack of frames (first axis being the frame index) for writing. Called from the acquisition
+        thread, the frames must not be modified afterwards. Return False if the frames were dropped."""
+        nframes = len(frames)
+        if nframes == 0:
+            return True
+        if self._closed or self.error is not None or frames.shape[1:] != self.frame_shape:
+            self._count_dropped(nframes)
+            return False
+        infos = np.empty(nframes, dtype=FRAME_INFO_DTYPE)
+        infos['frame_index'] = np.arange(nframes) + (self.queued_frames if first_index is None else first_index)
+        infos['timestamp'] = time.time() if timestamp is None else timestamp
+        while True:
+            try:
+                # Blocking by slices, so that a frame put while closing does not block forever
+                self._queue.put((frames, infos), block=self.policy == 'Block', timeout=0.1)
+                break
+            except queue.Full:
+                if self.policy != 'Block' or self._closed:
+                    self._count_dropped(nframes)
+                    return False
+        self.queued_frames += nframes
+        return True
+
+    def _write_loop(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            frames, infos = item
+            try:
+                if self._writer.capacity is not None and \
+                        self._writer.count + len(frames) > self._writer.capacity:
+                    # The file is full, only the frames which fit are written
+                    nfit = self._writer.capacity - self._writer.count
+                    self._count_dropped(len(frames) - nfit)
+                    frames, infos = frames[:nfit], infos[:nfit]
+                self._writer.write(frames, infos)
+                self.written_frames += len(frames)
+            except Exception as e:
+                self.error = e
+                self._count_dropped(len(frames))
+
+    def close(self):
+        """Write the queued frames, then close the file."""
+        self._closed = True
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
@@ -0,0 +1,195 @@
+"""Parameter tree layout of the camera attributes, and its cache on disk.
+
+Building the camera parameters queries the value of every attribute of the camera before ordering them and removing
+the ones hidden in simple settings. The resulting layout (titles, types, limits, order) only depends on the camera
+model and firmware, so it is saved per camera and reused at the next initialization: only the values of the displayed
+attributes are then read, in a single pass.
+"""
+import hashlib
+import json
+import os
+import re
+
+from .picam_utils import define_pymodaq_pyqt_parameter, sort_by_priority_list, remove_settings_from_list, \
+    get_parameter_limits
+
+
+# Increase when the way parameters are built changes, so that older layouts are rebuilt
+SCHEMA_VERSION = 1
+
+# Order of the settable parameters in the UI, and the ones hidden in simple settings
+SETTABLE_PRIORITY = ['Exposure Time',
+                     'ADC Speed',
+                     'ADC Analog Gain',
+                     'ADC Quality',
+                     'ROIs',
+                     'Sensor Temperature Set Point',
+                     ]
+SETTABLE_HIDDEN = ['Active Width',
+                   'Active Height',
+                   'Active Left Margin',
+                   'Active Top Margin',
+                   'Active Right Margin',
+                   'Active Bottom Margin',
+                   'Shutter Closing Delay',
+                   'Shutter Opening Delay',
+                   'Readout Count',
+                   'ADC Bit Depth',
+                   'Time Stamp Bit Depth',
+                   'Frame Tracking Bit Depth',
+                   'Shutter Delay Resolution',
+                   'Shutter Timing Monde',
+                   'Trigger Response',
+                   'Trigger Determination',
+                   'Output Signal',
+                   'Pixel Format',
+                   'Invert Output Signal',
+                   'Disable Data Formatting',
+                   'Track Frames',
+                   'Clean Section Final Height',
+                   'Clean Section Final Height Count',
+                   'Clean Cycle Count',
+                   'Clean Cycle Height',
+                   'Clean Serial Register',
+                   'Clean Until Trigger',
+                   'Normalize Orientation',
+                   'Correct Pixel Bias',
+                   'Shutter Timing Mode',
+                   'Time Stamps',
+                   'Time Stamp Resolution',
+                   ]
+
+# Same for the read only parameters, which are less important (kindof)
+READ_ONLY_PRIORITY = ['Sensor Temperature',
+                      'Readout Time Calculation',
+                      'Frame Rate Calculation',
+                      'Pixel Width',
+                      'Pixel Height',
+                      ]
+READ_ONLY_HIDDEN = ['Sensor Masked Height',
+                    'Sensor Masked Top Margin',
+                    'Sensor Masked Bottom Margin',
+                    'Gap Width',
+                    'Gap Height',
+                    'CCD Characteristics',
+                    'Exact Readout Count Maximum',
+                    'Pixel Width',
+                    'Pixel Height',
+                    'Frame Size',
+                    'Frame Stride',
+                    'Pixel Bit Depth',
+                    'Sensor Secondary Masked Height',
+                    'Sensor Active Width',
+                    'Sensor Active Height',
+                    'Sensor Active Left Margin',
+                    'Sensor Active Top Margin',
+                    'Sensor Active Right Margin',
+                    'Sensor Active Bottom Margin',
+                    'Sensor Secondary Active Height',
+                    'Sensor Active Extended Height',
+                    'Sensor Temperature Status',
+                    'Orientation',
+                    'Readout Orientation',
+                    'Sensor Type',
+                    ]
+
+
+def build_camera_schema(controller, simple_settings=True):
+    """Parameters of the camera attributes, as two lists of dictionaries (settable and read only), sorted and
+    filtered for the UI. The value of every attribute is queried."""
+    camera_params = []
+    for attribute in controller.get_all_attributes(copy=True).values():
+        param = define_pymodaq_pyqt_parameter(attribute)
+        if param is not None:
+            camera_params.append(param)
+    settable = sort_by_priority_list([par for par in camera_params if not par['readonly']], SETTABLE_PRIORITY)
+    read_only = sort_by_priority_list([par for par in camera_params if par['readonly']], READ_ONLY_PRIORITY)
+    if simple_settings:
+        settable = remove_settings_from_list(settable, SETTABLE_HIDDEN)
+        read_only = remove_settings_from_list(read_only, READ_ONLY_HIDDEN)
+    return settable, read_only
+
+
+def fill_schema_values(controller, schema):
+    """Set the current values (and the limits which are not permanent, as cached in the attribute objects) into the
+    parameters of a cached layout, reading only the displayed attributes. Return the values by title."""
+    values = {}
+    for params in schema:
+        for param in params:
+            title = param['title']
+            attribute = controller.get_attribute(title)
+            value = values[title] = controller.get_attribute_value(title)
+            if param['type'] == 'group':
+                # ROIs, the parameters show the first one
+                for child, field in zip(param['children'], value[0]):
+                    child['value'] = field
+            else:
+                param['value'] = value
+                if not attribute.cons_permanent:
+                    limits = get_parameter_limits(attribute)
+                    if limits is None:
+                        param.pop('limits', None)
+                    else:
+                        param['limits'] = limits
+    return values
+
+
+def _json_default(value):
+    # Numpy scalars found in the values and limits
+    if hasattr(value, 'item'):
+        return value.item()
+    raise TypeError(f'{type(value).__name__} is not serializable')
+
+
+class SchemaCache:
+    """Parameter layouts saved as JSON files, one per camera model and serial number.
+
+    A layout is reused only if it was saved with the same SCHEMA_VERSION, ordering lists and simple settings option,
+    and for the same set of camera attributes (which changes with the firmware or the picam library).
+    """
+    def __init__(self, directory):
+        self.directory = directory
+
+    def _path(self, model, serial_number):
+        name = re.sub(r'[^\w\-]+', '_', f'{model}_{serial_number}')
+        return os.path.join(self.directory, f'{name}.json')
+
+    @staticmethod
+    def _signature(controller, simple_settings):
+        """What a layout depends on, besides the camera identity."""
+        content = repr((SCHEMA_VERSION, SETTABLE_PRIORITY, SETTABLE_HIDDEN, READ_ONLY_PRIORITY, READ_ONLY_HIDDEN,
+                        bool(simple_settings), sorted(controller.get_all_attributes())))
+        return hashlib.sha1(content.encode()).hexdigest()
+
+    def load(self, controller, model, serial_number, simple_settings=True):
+        """Cached (settable, read only) parameters of a camera without their values, None if missing or outdated."""
+        try:
+            with open(self._path(model, serial_number)) as f:
+                content = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if content.get('version') != SCHEMA_VERSION or \
+                content.get('signature') != self._signature(controller, simple_settings):
+            return None
+        return content['settable'], content['read_only']
+
+    def save(self, controller, model, serial_number, schema, simple_settings=True):
+        """Save the (settable, read only) parameters of a camera."""
+        settable, read_only = schema
+        content = {'version': SCHEMA_VERSION, 'model': model, 'serial_number': serial_number,
+                   'signature': self._signature(controller, simple_settings),
+                   'settable': settable, 'read_only': read_only}
+        os.makedirs(self.directory, exist_ok=True)
+        with open(self._path(model, serial_number), 'w') as f:
+            json.dump(content, f, indent=2, default=_json_default)
+
+    def clear(self, model=None, serial_number=None):
+        """Remove the saved layout of a camera, or all of them if no camera is given."""
+        if model is not None:
+            path = self._path(model, serial_number)
+            if os.path.exists(path):
+                os.remove(path)
+        elif os.path.isdir(self.directory):
+            for name in os.listdir(self.directory):
+                if name.endswith('.json'):
+                    os.remove(os.path.join(self.directory, name))
@@ -0,0 +1,404 @@
+"""Software simulation of a Picam camera.
+
+The simulated camera mimics the subset of pylablib's ``PicamCamera`` interface that is used by the
+plugins (attributes, ROIs, acquisition setup, frame waiting and reading), so that the plugins can be
+exercised without any hardware or picam library installed.
+Frames are generated on the fly from the elapsed time since the acquisition start, at a configurable
+rate and sensor size. Frame counting, waiting and reading, as well as the frame and frame info formats, are
+pylablib's own (``ICamera``), so that the frames are returned exactly as by the real camera.
+"""
+import collections
+import threading
+import time
+
+import numpy as np
+from pylablib.devices.interface import camera
+
+
+TCameraInfo = collections.namedtuple("TCameraInfo", ["name", "serial_number", "model", "interface"])
+TDeviceInfo = collections.namedtuple("TDeviceInfo", ["name", "serial_number", "model", "interface"])
+TFrameInfo = collections.namedtuple("TFrameInfo", ["frame_index", "timestamp_start", "timestamp_end", "framestamp"])
+TPicamROI = collections.namedtuple("TPicamROI", ["x", "width", "x_binning", "y", "height", "y_binning"])
+TROIConstraints = collections.namedtuple("TROIConstraints",
+                                         ["flags", "nrois", "xrng", "wrng", "xbins", "yrng", "hrng", "ybins"])
+
+SIMULATED_SERIAL_NUMBERS = ['SIM-0001', 'SIM-0002']
+SIMULATED_MAX_ROIS = 8
+
+
+class SimulatedPicamError(RuntimeError):
+    """Generic simulated camera error"""
+
+
+class SimulatedPicamTimeoutError(SimulatedPicamError):
+    """Timeout while waiting for frames"""
+
+
+def list_simulated_cameras():
+    """List the simulated cameras, in the same format as pylablib's ``list_cameras``"""
+    return [TCameraInfo('Simulated Sensor', sn, 'Simulated PyLoN', 'Virtual') for sn in SIMULATED_SERIAL_NUMBERS]
+
+
+class SimulatedPicamAttribute:
+    """Attribute of the simulated camera, exposing the same fields as pylablib's ``PicamAttribute``.
+
+    Enumerations keep their labels in ``labels`` as ``{label: index}``, values are stored as indices and
+    translated back with ``enum_as_str``.
+    """
+    def __init__(self, name, kind, value, writable=True, can_set_online=False, cons_type="None", min=None,
+                 max=None, inc=None, labels=None, cons_permanent=True, getter=None):
+        self.name = name
+        self.kind = kind
+        self.exists = True
+        self.relevant = True
+        self.read_directly = getter is not None
+        self.writable = writable
+        self.can_set_online = writable and can_set_online
+        self.cons_type = cons_type
+        self.cons_permanent = cons_permanent
+        self.cons_error = True
+        self.min = min
+        self.max = max
+        self.inc = inc
+        self.cons_roi = None
+        self.labels = dict(labels) if labels is not None else {}
+        self.ilabels = {v: k for k, v in self.labels.items()}
+        self.values = list(self.labels.keys())
+        self.ivalues = list(self.labels.values())
+        self._getter = getter
+        self._value = self._as_type(value)
+        self.default = value
+
+    def _as_type(self, value):
+        if self.kind == 'Enumeration' and isinstance(value, str):
+            return self.labels[value]
+        if self.kind in ['Integer', 'Large Integer']:
+            return int(value)
+        if self.kind == 'Floating Point':
+            return float(value)
+        if self.kind == 'Boolean':
+            return bool(value)
+        if self.kind == 'ROIs':
+            return [TPicamROI(*r) for r in value]
+        return value
+
+    def update_limits(self, force=False):
+        """Constraints of the simulated attributes never change; kept for interface compatibility"""
+        pass
+
+    def truncate_value(self, value):
+        """Truncate value to lie within attribute limits"""
+        if self.cons_type == "Range":
+            value = min(max(value, self.min), self.max)
+        elif self.cons_type == "Collection" and value not in self.ivalues:
+            value = min(self.ivalues, key=lambda v: abs(v - value))
+        return value
+
+    def get_value(self, enum_as_str=True):
+        value = self._getter() if self._getter is not None else self._value
+        if enum_as_str and self.kind == 'Enumeration':
+            value = self.ilabels[value]
+        return value
+
+    def set_value(self, value, truncate=True):
+        if not self.writable:
+            raise SimulatedPicamError(f"attribute {self.name} is read-only")
+        value = self._as_type(value)
+        if truncate:
+            value = self.truncate_value(value)
+        self._value = value
+
+    def __repr__(self):
+        return "{}(name='{}', kind='{}')".format(self.__class__.__name__, self.name, self.kind)
+
+
+class SimulatedPicamCamera(camera.ICamera):
+    """Simulated Picam camera.
+
+    Args:
+        serial_number: serial number reported by the camera (any string is accepted)
+        sensor_shape: ``(height, width)`` of the simulated sensor, in pixels
+        frame_rate: fixed frame rate in Hz; if ``None`` or 0, the rate is derived from the exposure time and the
+            calculated readout time, as on the real hardware
+    """
+    Error = SimulatedPicamError
+    TimeoutError = SimulatedPicamTimeoutError
+    _TFrameInfo = TFrameInfo
+
+    _wait_sleep_period = 1E-3
+
+    def __init__(self, serial_number=None, sensor_shape=(512, 512), frame_rate=None):
+        super().__init__()
+        self.serial_number = serial_number if serial_number else SIMULATED_SERIAL_NUMBERS[0]
+        self.sensor_shape = tuple(int(s) for s in sensor_shape)
+        self.frame_rate = frame_rate
+        self._lock = threading.RLock()
+        self._opened = True
+        self._acq_running = False
+        self._t_start = None
+        self._acquired_at_stop = 0
+        self._period = 1.
+        self._frame_template = None
+        self._template_exposure = None
+        self.attributes = self._build_attributes()
+
+    # Attributes
+    def _build_attributes(self):
+        height, width = self.sensor_shape
+        attrs = [
+            SimulatedPicamAttribute('Exposure Time', 'Floating Point', 10., can_set_online=True, cons_type="Range",
+                                    min=0., max=1E6, inc=1E-3),
+            SimulatedPicamAttribute('ADC Speed', 'Floating Point', 2., cons_type="Collection",
+                                    labels={'0.1': 0.1, '1': 1., '2': 2.}),
+            SimulatedPicamAttribute('ADC Analog Gain', 'Enumeration', 'Medium', cons_type="Collection",
+                                    labels={'Low': 1, 'Medium': 2, 'High': 3}),
+            SimulatedPicamAttribute('ADC Quality', 'Enumeration', 'Low Noise', cons_type="Collection",
+                                    labels={'Low Noise': 1, 'High Capacity': 2}),
+            SimulatedPicamAttribute('ADC Bit Depth', 'Integer', 16, cons_type="Collection", labels={'16': 16}),
+            SimulatedPicamAttribute('ROIs', 'ROIs', [(0, width, 1, 0, height, 1)]),
+            SimulatedPicamAttribute('Sensor Temperature Set Point', 'Floating Point', -70., cons_type="Range",
+                                    min=-120., max=30., inc=0.1),
+            SimulatedPicamAttribute('Readout Count', 'Large Integer', 0, cons_type="Range", min=0, max=2 ** 31),
+            SimulatedPicamAttribute('Shutter Timing Mode', 'Enumeration', 'Normal', cons_type="Collection",
+                                    labels={'Normal': 1, 'Always Closed': 2, 'Always Open': 3}),
+            SimulatedPicamAttribute('Trigger Response', 'Enumeration', 'No Response', cons_type="Collection",
+                                    labels={'No Response': 1, 'Readout Per Trigger': 2,
+                                            'Expose During Trigger Pulse': 4}),
+            SimulatedPicamAttribute('Track Frames', 'Boolean', False, cons_type="Collection",
+                                    labels={'False': False, 'True': True}),
+            SimulatedPicamAttribute('Time Stamps', 'Enumeration', 'None', cons_type="Collection",
+                                    labels={'None': 0, 'Exposure Started': 1, 'Exposure Ended': 2,
+                                            'Exposure Started, Exposure Ended': 3}),
+            SimulatedPicamAttribute('Time Stamp Resolution', 'Large Integer', 1000000, cons_type="Collection",
+                                    labels={'1000000': 1000000}),
+            SimulatedPicamAttribute('Time Stamp Bit Depth', 'Integer', 64, cons_type="Collection",
+                                    labels={'64': 64}),
+            SimulatedPicamAttribute('Frame Tracking Bit Depth', 'Integer', 64, cons_type="Collection",
+                                    labels={'64': 64}),
+            SimulatedPicamAttribute('Sensor Temperature', 'Floating Point', -70., writable=False,
+                                    getter=self._get_sensor_temperature),
+            SimulatedPicamAttribute('Sensor Temperature Status', 'Enumeration', 'Locked', writable=False,
+                                    labels={'Unlocked': 1, 'Locked': 2}),
+            SimulatedPicamAttribute('Readout Time Calculation', 'Floating Point', 0., writable=False,
+                                    getter=self._get_readout_time),
+            SimulatedPicamAttribute('Frame Rate Calculation', 'Floating Point', 0., writable=False,
+                                    getter=lambda: 1. / self._get_frame_period()),
+            SimulatedPicamAttribute('Pixel Width', 'Floating Point', 20., writable=False),
+            SimulatedPicamAttribute('Pixel Height', 'Floating Point', 20., writable=False),
+            SimulatedPicamAttribute('Sensor Active Width', 'Integer', width, writable=False),
+            SimulatedPicamAttribute('Sensor Active Height', 'Integer', height, writable=False),
+            SimulatedPicamAttribute('Pixel Bit Depth', 'Integer', 16, writable=False),
+            SimulatedPicamAttribute('Frame Size', 'Integer', 0, writable=False,
+                                    getter=lambda: int(np.prod(self._get_data_dimensions_rc())) * 2),
+        ]
+        attributes = {a.name: a for a in attrs}
+        attributes['ROIs'].cons_roi = TROIConstraints(0, SIMULATED_MAX_ROIS, (0, width - 1, 1), (1, width, 1), None,
+                                                      (0, height - 1, 1), (1, height, 1), None)
+        return attributes
+
+    def _get_sensor_temperature(self):
+        setpoint = self.attributes['Sensor Temperature Set Point'].get_value()
+        return setpoint + 0.05 * np.sin(time.time())
+
+    def _get_readout_time(self):
+        """Readout time in ms, from the number of read pixels and the ADC speed (in MHz)"""
+        npx = int(np.prod(self._get_data_dimensions_rc()))
+        return npx / (self.attributes['ADC Speed'].get_value() * 1E6) * 1E3
+
+    def _get_frame_period(self):
+        """Frame period in s"""
+        if self.frame_rate:
+            return 1. / self.frame_rate
+        return max(self.attributes['Exposure Time'].get_value() + self._get_readout_time(), 1E-3) * 1E-3
+
+    def get_attribute(self, name, error_on_missing=True):
+        if name in self.attributes:
+            return self.attributes[name]
+        if error_on_missing:
+            raise self.Error(f"attribute {name} is missing")
+
+    def get_all_attributes(self, copy=False):
+        return dict(self.attributes) if copy else self.attributes
+
+    def get_attribute_value(self, name, error_on_missing=True, default=None, enum_as_str=True):
+        attr = self.get_attribute(name, error_on_missing=error_on_missing and default is None)
+        return default if attr is None else attr.get_value(enum_as_str=enum_as_str)
+
+    def set_attribute_value(self, name, value, truncate=True, error_on_missing=True):
+        attr = self.get_attribute(name, error_on_missing=error_on_missing)
+        if attr is not None:
+            with self._lock:
+                if self._acq_running and not attr.can_set_online:
+                    raise self.Error(f"attribute {name} can not be set during acquisition")
+                attr.set_value(value, truncate=truncate)
+
+    def get_all_attribute_values(self, root="", enum_as_str=True):
+        return {k: a.get_value(enum_as_str=enum_as_str) for k, a in self.attributes.items()}
+
+    # Device info and ROIs
+    def get_device_info(self):
+        return TDeviceInfo('Simulated Sensor', self.serial_number, 'Simulated PyLoN', 'Virtual')
+
+    def get_detector_size(self):
+        return self.sensor_shape[1], self.sensor_shape[0]
+
+    def get_roi(self):
+        rois = self.get_rois()
+        if len(rois) > 1:
+            # Bounding box of the ROIs, binning of the first one (see MultiROIPicamCamera)
+            return (min(r[0] for r in rois), max(r[0] + r[1] for r in rois),
+                    min(r[3] for r in rois), max(r[3] + r[4] for r in rois), rois[0][2], rois[0][5])
+        x, w, xb, y, h, yb = rois[0]
+        return x, x + w, y, y + h, xb, yb
+
+    def get_rois(self):
+        return [tuple(roi) for roi in self.attributes['ROIs'].get_value()]
+
+    def set_rois(self, rois):
+        height, width = self.sensor_shape
+        if not 1 <= len(rois) <= SIMULATED_MAX_ROIS:
+            raise self.Error(f"between 1 and {SIMULATED_MAX_ROIS} ROIs are supported")
+        for x, w, xb, y, h, yb in rois:
+            if x < 0 or y < 0 or x + w > width or y + h > height or not (1 <= xb <= w and 1 <= yb <= h):
+                raise self.Error(f"invalid ROI: {(x, w, xb, y, h, yb)}")
+        self.clear_acquisition()
+        self.attributes['ROIs'].set_value(rois)
+        return self.get_rois()
+
+    def set_roi(self, hstart=0, hend=None, vstart=0, vend=None, hbin=1, vbin=1):
+        height, width = self.sensor_shape
+        hend = width if hend is None else min(hend, width)
+        vend = height if vend is None else min(vend, height)
+        hstart, vstart = max(0, hstart), max(0, vstart)
+        hbin = max(1, min(hbin, hend - hstart))
+        vbin = max(1, min(vbin, vend - vstart))
+        self.clear_acquisition()
+        self.attributes['ROIs'].set_value([(hstart, hend - hstart, hbin, vstart, vend - vstart, vbin)])
+        return self.get_roi()
+
+    def _get_data_dimensions_rc(self):
+        rois = self.attributes['ROIs'].get_value()
+        if len(rois) > 1:
+            # The ROIs of a readout are packed in a single row
+            return 1, sum((h // yb) * (w // xb) for x, w, xb, y, h, yb in rois)
+        x, w, xb, y, h, yb = rois[0]
+        return h // yb, w // xb
+
+    # Acquisition
+    def _commit_parameters(self):
+        pass
+
+    def setup_acquisition(self, mode="sequence", nframes=100):
+        self.clear_acquisition()
+        super().setup_acquisition(mode=mode, nframes=int(nframes))
+        self.attributes['Readout Count'].set_value(int(nframes) if mode == 'snap' else 0)
+
+    def clear_acquisition(self):
+        self.stop_acquisition()
+        super().clear_acquisition()
+
+    def start_acquisition(self, *args, **kwargs):
+        self.stop_acquisition()
+        super().start_acquisition(*args, **kwargs)
+        with self._lock:
+            self._frame_counter.reset(self._acq_params['nframes'])
+            self._prepare_template()
+            self._period = self._get_frame_period()
+            self._t_start = time.perf_counter()
+            self._acq_running = True
+
+    def stop_acquisition(self):
+        with self._lock:
+            if self._acq_running:
+                self._acquired_at_stop = self._get_acquired_frames()
+                self._frame_counter.update_acquired_frames(self._acquired_at_stop)
+                self._acq_running = False
+
+    def _frame_limit(self):
+        """Number of frames after which the acquisition stops (Readout Count, 0 for continuous acquisition)."""
+        return self.attributes['Readout Count'].get_value()
+
+    def acquisition_in_progress(self):
+        limit = self._frame_limit()
+        if self._acq_running and limit and self._get_acquired_frames() >= limit:
+            # Ended by itself: pylablib only counts the frames of running acquisitions, count the last ones now
+            self._frame_counter.update_acquired_frames(limit)
+            return False
+        return self._acq_running
+
+    def _get_acquired_frames(self):
+        if self._t_start is None:
+            return None
+        if not self._acq_running:
+            return self._acquired_at_stop
+        n = int((time.perf_counter() - self._t_start) / self._period)
+        limit = self._frame_limit()
+        if limit:
+            n = min(n, limit)
+        return n
+
+    def _prepare_template(self):
+        """Precompute a noisy gaussian spot in the current ROI, so that generating a frame costs one addition. The
+        signal is proportional to the exposure time (1000 counts at 10 ms) over a 100 counts offset"""
+        self._template_exposure = self.attributes['Exposure Time'].get_value()
+        rois = self.attributes['ROIs'].get_value()
+        if len(rois) > 1:
+            self._prepare_multi_roi_template(rois)
+            return
+        height, width = self._get_data_dimensions_rc()
+        yy, xx = np.ogrid[:height, :width]
+        x_profile = (xx - width / 2) ** 2 / (2 * (width / 8 + 1) ** 2)
+        y_profile = (yy - height / 2) ** 2 / (2 * (height / 8 + 1) ** 2)
+        spot = 100. * self._template_exposure * np.exp(-(x_profile + y_profile))
+        noise = np.random.default_rng(0).normal(100., 5., size=(height, width))
+        self._frame_template = np.clip(spot + noise, 0, 2 ** 16 - 17).astype(np.uint16)
+
+    def _prepare_multi_roi_template(self, rois):
+        """Several ROIs: a horizontal line spectrum on the whole sensor, binned in each ROI and packed in a row"""
+        height, width = self.sensor_shape
+        xx = np.arange(width)
+        spectrum = 100. + sum(100. * self._template_exposure * np.exp(-(xx - center) ** 2 / 8.) for center in np.linspace(0, width, 7)[1:-1])
+        sensor = spectrum[np.newaxis] + np.random.default_rng(0).normal(0., 5., size=(height, width))
+        data = []
+        for x, w, xb, y, h, yb in rois:
+            region = sensor[y:y + (h // yb) * yb, x:x + (w // xb) * xb]
+            data.append(region.reshape((h // yb, yb, w // xb, xb)).mean(axis=(1, 3)).ravel())
+        self._frame_template = np.clip(np.concatenate(data), 0, 2 ** 16 - 17).astype(np.uint16)[np.newaxis]
+
+    def _generate_frame(self, idx):
+        if self.attributes['Exposure Time'].get_value() != self._template_exposure:
+            # Exposure changed during the acquisition
+            self._prepare_template()
+        return self._frame_template + np.uint16(idx % 16)
+
+    def _frame_info(self, idx):
+        """Frame metadata (time stamps in us), as read from the frames by the real camera"""
+        t_start = int(idx * self._period * 1E6)
+        t_end = t_start + int(self.attributes['Exposure Time'].get_value() * 1E3)
+        return TFrameInfo(idx, t_start, t_end, idx + 1)
+
+    def _wait_for_next_frame(self, timeout=20., idx=None):
+        # Sleep until the next frame is due, but never longer than the polling period
+        next_frame = self._t_start + ((idx or 0) + 1) * self._period
+        delay = min(max(next_frame - time.perf_counter(), 0), self._wait_sleep_period)
+        time.sleep(delay if timeout is None else min(delay, timeout))
+
+    def _read_frames(self, rng, return_info=False):
+        """Frames of the range (list of 2D arrays) and, as for the real camera, their metadata only if it is
+        enabled (otherwise pylablib fills in the frame indices)"""
+        frames = [self._generate_frame(i) for i in range(*rng)]
+        metadata = self.attributes['Time Stamps'].get_value(enum_as_str=False) == 3 and \
+            self.attributes['Track Frames'].get_value()
+        infos = [self._frame_info(i) for i in range(*rng)] if return_info and metadata else None
+        return frames, infos
+
+    def enable_metadata(self, enable=True):
+        self.attributes['Time Stamps'].set_value('Exposure Started, Exposure Ended' if enable else 'None')
+        self.attributes['Track Frames'].set_value(enable)
+
+    def close(self):
+        self.clear_acquisition()
+        self._opened = False
+
+    def is_opened(self):
+        return self._opened
@@ -12,6 +12,31 @@ def get_ROI_dictlist(ROI):
     return RDL
 
 
+def get_roi_shape(roi):
+    """Shape (rows, columns) of the data read out for a picam ROI (x, width, x_binning, y, height, y_binning)."""
+    x, width, x_binning, y, height, y_binning = roi
+    return height // y_binning, width // x_binning
+
+
+def parse_rois(text):
+    """ROIs written one per line as 'x, width, x_binning, y, height, y_binning' (blank lines and lines starting with
+    # are ignored), as a list of tuples."""
+    rois = []
+    for line in text.splitlines():
+        line = line.split('#')[0].strip()
+        if line:
+            fields = [int(field) for field in line.replace(';', ',').split(',')]
+            if len(fields) != 6:
+                raise ValueError(f'A ROI needs 6 fields (x, width, x_binning, y, height, y_binning): {line}')
+            rois.append(tuple(fields))
+    return rois
+
+
+def format_rois(rois):
+    """Inverse of parse_rois."""
+    return '\n'.join(', '.join(str(int(field)) for field in roi) for roi in rois)
+
+
 def define_pymodaq_pyqt_parameter(parameter):
     """Gets a parameter object from the pylablib module and initialise a dictionary compatible with pyqtgraph.
     Useful for getting automatically the parameters available for a camera.
@@ -112,3 +137,91 @@ def remove_settings_from_list(values, remove_list):
     Remove settings belonging to the list.
     """
     return [val for val in values if val['title'] not in remove_list]
+
+
+def get_parameter_limits(parameter):
+    """
+    Limits of a parameter, as defined in the pyqtgraph parameter by define_pymodaq_pyqt_parameter.
+    Only uses the constraints cached in the parameter object, i.e. does not query the device.
+    """
+    if parameter.kind == 'Enumeration':
+        return list(parameter.labels.keys())
+    elif parameter.kind in ['Integer', 'Large Integer', 'Floating Point']:
+        if parameter.labels != {}:
+            return list(parameter.labels.values())
+        elif parameter.cons_type == "Range" and parameter.cons_permanent is True:
+            return [parameter.min, parameter.max]
+    return None
+
+
+# Attributes whose value or constraints are known to change when the key attribute is modified.
+ATTRIBUTE_DEPENDENCIES = {
+    'ADC Quality': ['ADC Speed', 'ADC Analog Gain', 'ADC Bit Depth'],
+    'ADC Speed': ['ADC Analog Gain', 'ADC Bit Depth'],
+    'ROIs': ['Frame Size', 'Frame Stride', 'Readout Stride'],
+    'Sensor Temperature Set Point': ['Sensor Temperature Status'],
+    'Readout Control Mode': ['ROIs', 'Frames per Readout', 'Kinetics Window Height'],
+}
+
+# Attributes computed by the library from the others, refreshed after any change.
+CALCULATED_ATTRIBUTES = ['Readout Time Calculation',
+                         'Frame Rate Calculation',
+                         'Readout Rate Calculation',
+                         'Exact Readout Count Maximum',
+                         ]
+
+# Read only attributes changing without any setting change, polled periodically.
+VOLATILE_ATTRIBUTES = ['Sensor Temperature',
+                       'Sensor Temperature Status',
+                       'Readout Time Calculation',
+                       'Frame Rate Calculation',
+                       ]
+
+
+class AttributeSnapshot:
+    """
+    Cached values and constraints of a set of camera attributes.
+
+    After an attribute is modified, only this attribute and the ones known to depend on it are queried again,
+    instead of the whole set. Constraints are only updated for attributes whose constraints are not permanent.
+    The number of device calls is counted, so that the cost of each refresh can be monitored.
+    """
+    def __init__(self, controller, values):
+        self.controller = controller
+        self.values = dict(values)
+        self.limits = {name: get_parameter_limits(controller.get_attribute(name)) for name in self.values}
+        self.device_calls = 0
+
+    def get_dependents(self, name):
+        """The attribute itself and the cached attributes that may change along with it."""
+        dependents = [name] + ATTRIBUTE_DEPENDENCIES.get(name, []) + CALCULATED_ATTRIBUTES
+        return [dep for dep in dict.fromkeys(dependents) if dep in self.values]
+
+    def refresh(self, names=None):
+        """Query again the given attributes (all the cached ones by default).
+        Return two dictionaries with the values and the limits which changed."""
+        if names is None:
+            names = list(self.values)
+        new_values = {}
+        new_limits = {}
+        for name in names:
+            attribute = self.controller.get_attribute(name)
+            if not attribute.cons_permanent:
+                attribute.update_limits()
+                self.device_calls += 1
+                limits = get_parameter_limits(attribute)
+                if limits != self.limits[name]:
+                    self.limits[name] = new_limits[name] = limits
+            value = self.controller.get_attribute_value(name)
+            self.device_calls += 1
+            if value != self.values[name]:
+                self.values[name] = new_values[name] = value
+        return new_values, new_limits
+
+    def refresh_after_change(self, name):
+        """Query again the attributes which may have changed after `name` was modified."""
+        return self.refresh(self.get_dependents(name))
+
+    def refresh_after_changes(self, names):
+        """Query again, once each, the attributes which may have changed after all of `names` were modified."""
+        return self.refresh(list(dict.fromkeys(dep for name in names for dep in self.get_dependents(name))))
@@ -0,0 +1,80 @@
+import pytest
+
+from pymodaq_plugins_princeton_instruments.hardware import picam_backends
+from pymodaq_plugins_princeton_instruments.hardware.picam_backends import CameraEnumerationCache, \
+    LazyCameraParams, list_cameras, list_serial_numbers, open_camera
+
+
+def test_simulated_backend():
+    serial_numbers = [cam.serial_number for cam in list_cameras('Simulated')]
+    assert set(serial_numbers) <= set(list_serial_numbers())
+    camera = open_camera('Simulated', serial_numbers[0], sensor_shape=(16, 32))
+    try:
+        assert camera.get_device_info().serial_number == serial_numbers[0]
+        assert camera.get_detector_size() == (32, 16)
+    finally:
+        camera.close()
+
+
+def test_unknown_backend():
+    with pytest.raises(ValueError):
+        list_cameras('Unknown')
+    with pytest.raises(ValueError):
+        open_camera('Unknown', 'SN')
+
+
+def test_enumeration_errors():
+    errors = {}
+    assert list_serial_numbers(['Simulated', 'Unknown'], errors=errors) == list_serial_numbers(['Simulated'])
+    assert set(errors) == {'Unknown'}
+
+
+@pytest.fixture
+def counted_enumeration(monkeypatch):
+    calls = []
+
+    def list_serial_numbers(backends, errors=None):
+        calls.append(backends)
+        if backends == ['Picam']:
+            errors['Picam'] = 'No picam library'
+            return []
+        return [f'SN{len(calls)}']
+    monkeypatch.setattr(picam_backends, 'list_serial_numbers', list_serial_numbers)
+    return calls
+
+
+def test_enumeration_cache(counted_enumeration):
+    cache = CameraEnumerationCache(ttl=60.)
+    assert cache.serial_numbers('Simulated') == cache.serial_numbers('Simulated') == ['SN1']
+    assert cache.serial_numbers('Simulated', refresh=True) == ['SN2']
+    cache.invalidate()
+    assert cache.serial_numbers('Simulated') == ['SN3']
+    cache.ttl = 0.
+    cache.serial_numbers('Simulated')
+    assert counted_enumeration == [['Simulated']] * 4
+
+
+def test_enumeration_by_backend(counted_enumeration):
+    cache = CameraEnumerationCache(ttl=60.)
+    assert cache.serial_numbers('Simulated') == ['SN1']
+    assert not cache.errors
+    # Only the requested backend is enumerated, its failure being kept
+    assert cache.serial_numbers('Picam') == []
+    assert set(cache.errors) == {'Picam'}
+    assert cache.serial_numbers('Simulated') == ['SN1']
+    assert counted_enumeration == [['Simulated'], ['Picam']]
+
+
+def test_lazy_params(monkeypatch, counted_enumeration):
+    monkeypatch.setattr(picam_backends, 'camera_enumeration', CameraEnumerationCache())
+
+    class Plugin:
+        picam_params = [{'name': 'backend', 'type': 'list', 'value': 'Simulated', 'limits': ['Picam', 'Simulated']},
+                        {'name': 'serial_number', 'type': 'list', 'limits': []}]
+        params = LazyCameraParams('picam_params')
+
+    assert not counted_enumeration  # Nothing enumerated at the class definition
+    assert Plugin.params[1]['limits'] == ['SN1']
+    assert Plugin.picam_params[1]['limits'] == []
+    # Only the default backend is enumerated
+    assert counted_enumeration == [['Simulated']]
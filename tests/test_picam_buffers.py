@@ -0,0 +1,88 @@
+import numpy as np
+
+from pymodaq_plugins_princeton_instruments.hardware.picam_buffers import FrameRingBuffer
+
+
+def test_store_returns_read_only_views():
+    ring = FrameRingBuffer(n_slots=4)
+    ring.configure((2, 3), np.uint16)
+    frames = np.arange(2 * 2 * 3, dtype=np.uint16).reshape((2, 2, 3))
+    stored = ring.store(frames)
+    np.testing.assert_array_equal(stored, frames)
+    assert not stored.flags.writeable
+    assert ring.leased == 2
+
+
+def test_configure_reallocates_only_on_change():
+    ring = FrameRingBuffer(n_slots=4)
+    ring.configure((2, 3), np.uint16)
+    ring.configure((2, 3), np.uint16)
+    assert ring.allocations == 1
+    ring.configure((4, 3), np.uint16)
+    assert ring.allocations == 2
+    assert ring.nbytes == 4 * 4 * 3 * 2
+
+
+def test_leased_slots_are_not_overwritten():
+    ring = FrameRingBuffer(n_slots=2, policy='Drop')
+    ring.configure((1, 2), np.uint16)
+    first = ring.store(np.ones((2, 1, 2), dtype=np.uint16))
+    assert ring.store(np.full((1, 1, 2), 2, dtype=np.uint16)) is None
+    assert ring.dropped == 1
+    np.testing.assert_array_equal(first, 1)
+    # The slots are used as long as any view of the frames is
+    frame = np.squeeze(first[1])
+    del first
+    assert ring.store(np.full((1, 1, 2), 3, dtype=np.uint16)) is None
+    assert ring.leased == 2
+    np.testing.assert_array_equal(frame, 1)
+    del frame
+    assert ring.leased == 0
+    np.testing.assert_array_equal(ring.store(np.full((1, 1, 2), 3, dtype=np.uint16)), 3)
+
+
+def test_leased_slots_are_skipped():
+    ring = FrameRingBuffer(n_slots=3)
+    ring.configure((1, 2), np.uint16)
+    kept = ring.store(np.ones((1, 1, 2), dtype=np.uint16))
+    for value in range(2, 8):
+        np.testing.assert_array_equal(ring.store(np.full((1, 1, 2), value, dtype=np.uint16)), value)
+    np.testing.assert_array_equal(kept, 1)
+    assert ring.dropped == 0
+
+
+def test_allocate_policy():
+    ring = FrameRingBuffer(n_slots=2, policy='Allocate')
+    ring.configure((1, 2), np.uint16)
+    first = ring.store(np.ones((2, 1, 2), dtype=np.uint16))
+    second = ring.store(np.full((1, 1, 2), 2, dtype=np.uint16))
+    np.testing.assert_array_equal(second, 2)
+    np.testing.assert_array_equal(first, 1)
+    assert ring.fallback_allocations == 1
+
+
+def test_burst_larger_than_the_ring():
+    ring = FrameRingBuffer(n_slots=2)
+    ring.configure((1, 2), np.uint16)
+    frames = np.arange(6, dtype=np.uint16).reshape((3, 1, 2))
+    np.testing.assert_array_equal(ring.store(frames), frames)
+    assert ring.fallback_allocations == 1
+    assert ring.leased == 0
+
+
+def test_store_reconfigures_on_shape_change():
+    ring = FrameRingBuffer(n_slots=2)
+    ring.configure((1, 2), np.uint16)
+    stored = ring.store(np.zeros((1, 3, 3), dtype=np.uint16))
+    assert stored.shape == (1, 3, 3) and ring.shape == (3, 3)
+    assert ring.allocations == 2
+
+
+def test_reserve_and_hand_off():
+    ring = FrameRingBuffer(n_slots=2)
+    ring.configure((1, 2), np.uint16)
+    slots = ring.reserve(1, (3, 3), np.float32)
+    assert slots.shape == (1, 3, 3) and slots.dtype == np.float32 and slots.flags.writeable
+    slots[:] = 1.
+    assert not FrameRingBuffer.hand_off(slots).flags.writeable
+    assert ring.leased == 1
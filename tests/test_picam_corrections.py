@@ -0,0 +1,62 @@
+import numpy as np
+
+from pymodaq_plugins_princeton_instruments.hardware.picam_corrections import CalibrationCache, FrameCorrector, \
+    make_correction_key
+from pymodaq_plugins_princeton_instruments.hardware.picam_simulator import TPicamROI
+
+
+def test_correction_key():
+    values = {'ROIs': [TPicamROI(0, 10, 1, 0, 20, 2)], 'Exposure Time': 10., 'ADC Speed': 2., 'Pixel Width': 20.}
+    assert make_correction_key('SN', values) == ('SN', ((0, 10, 1, 0, 20, 2),), 10., 2., None)
+
+
+def test_put_and_get():
+    cache = CalibrationCache(max_entries=2)
+    cache.put('key', 'dark', np.ones((2, 2)))
+    entry = cache.get('key')
+    assert set(entry) == {'dark'}
+    assert entry['dark'].dtype == np.float32
+    assert cache.get('other') == {}
+
+
+def test_least_recently_used_eviction():
+    cache = CalibrationCache(max_entries=2)
+    for key in ['a', 'b']:
+        cache.put(key, 'dark', np.zeros(2))
+    cache.get('a')
+    cache.put('c', 'dark', np.zeros(2))
+    assert cache.get('a') != {}
+    assert cache.get('b') == {}
+
+
+def test_disk_storage(tmp_path):
+    key = ('model', (0, 10, 1, 0, 10, 1), 100.)
+    cache = CalibrationCache(max_entries=1, directory=str(tmp_path))
+    cache.put(key, 'dark', np.full((2, 2), 3.))
+    cache.put(key, 'flat', np.full((2, 2), 5.))
+    cache.put('other', 'dark', np.zeros(2))  # Evicts key from memory
+    entry = CalibrationCache(directory=str(tmp_path)).get(key)
+    np.testing.assert_array_equal(entry['dark'], 3.)
+    np.testing.assert_array_equal(entry['flat'], 5.)
+    cache.clear(disk=True)
+    assert CalibrationCache(directory=str(tmp_path)).get(key) == {}
+
+
+def test_dark_and_flat():
+    corrector = FrameCorrector()
+    assert not corrector.active and corrector.apply(np.zeros((1, 2, 2))) is None
+    dark = np.full((2, 2), 100.)
+    flat = dark + [[100., 300.], [200., 200.]]
+    corrector.set_masters(dark, flat)
+    frames = np.array([dark + [[50., 150.], [100., 100.]]], dtype=np.uint16)
+    np.testing.assert_allclose(corrector.apply(frames), 100.)
+    # Frames of another shape (e.g. while the ROI changes) are not corrected
+    assert corrector.apply(np.zeros((1, 3, 3))) is None
+
+
+def test_correction_in_place():
+    corrector = FrameCorrector()
+    corrector.set_masters(dark=np.ones((2, 2)))
+    average = np.full((2, 2), 3.)
+    assert corrector.apply(average, out=average) is average
+    np.testing.assert_array_equal(average, 2.)
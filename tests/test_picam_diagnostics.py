@@ -0,0 +1,50 @@
+import json
+
+import numpy as np
+import pytest
+
+from pymodaq_plugins_princeton_instruments.hardware.picam_diagnostics import HISTOGRAM_EDGES, PIPELINE_STAGES, \
+    PipelineProfiler, StageStatistics
+
+
+def test_stage_statistics_window():
+    stats = StageStatistics(window=4)
+    assert np.all(np.isnan(stats.percentiles()))
+    for duration in range(6):
+        stats.add(duration)
+    np.testing.assert_array_equal(stats.samples, [2, 3, 4, 5])
+    assert stats.count == 6
+    assert stats.percentiles([0, 100]).tolist() == [2, 5]
+    assert stats.summary()['max_ms'] == 5000.
+    assert stats.histogram().sum() == 4
+
+
+def test_profiler_marks():
+    profiler = PipelineProfiler(window=10)
+    profiler.record('read', profiler.clock())
+    profiler.mark('dispatch')
+    profiler.record_since('dispatch')
+    profiler.record_since('dispatch')  # The mark is used once
+    summary = profiler.summary()
+    assert summary['read']['count'] == summary['dispatch']['count'] == 1
+    assert summary['wait']['count'] == 0
+
+
+def test_profiler_disabled():
+    profiler = PipelineProfiler(enabled=False)
+    profiler.record('read', profiler.clock())
+    profiler.mark('dispatch')
+    profiler.record_since('dispatch')
+    assert all(stats.count == 0 for stats in profiler.stages.values())
+
+
+def test_profiler_export(tmp_path):
+    profiler = PipelineProfiler(window=10)
+    profiler.stages['wait'].add(1E-3)
+    profiler.export(tmp_path / 'timings.json', metadata={'scenario': 'test'})
+    with open(tmp_path / 'timings.json') as f:
+        content = json.load(f)
+    assert set(content['stages']) == set(PIPELINE_STAGES)
+    assert content['stages']['wait']['p50_ms'] == pytest.approx(1.)
+    assert len(content['histogram_edges_ms']) == len(HISTOGRAM_EDGES)
+    assert content['metadata'] == {'scenario': 'test'}
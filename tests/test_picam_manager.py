@@ -0,0 +1,122 @@
+import time
+
+import numpy as np
+import pytest
+
+from pymodaq_plugins_princeton_instruments.hardware.picam_manager import CameraManager, CameraManagerError, \
+    FrameMatcher, SynchronizedAcquisition
+
+
+def test_camera_manager_shares_cameras():
+    manager = CameraManager()
+    camera = manager.open('Simulated', 'SIM-0001')
+    assert manager.open('Simulated', 'SIM-0001') is camera
+    assert manager.open('Simulated', 'SIM-0002') is not camera
+    assert manager.users(camera) == 2
+    assert not manager.close(camera)
+    assert manager.close(camera)
+    assert manager.users(camera) == 0
+    # Opened again once closed
+    assert manager.open('Simulated', 'SIM-0001') is not camera
+
+
+def test_camera_manager_rejects_process_mismatch():
+    manager = CameraManager()
+    camera = manager.open('Simulated', 'SIM-0001')
+    try:
+        with pytest.raises(CameraManagerError):
+            manager.open('Simulated', 'SIM-0001', process=True)
+        assert manager.users(camera) == 1
+    finally:
+        manager.close(camera)
+
+
+def test_match_by_frame_number():
+    matcher = FrameMatcher(2, 'Frame number')
+    matcher.add(0, [0, 1, 2], ['a0', 'a1', 'a2'], [0., 1., 2.])
+    matcher.add(1, [1, 2], ['b1', 'b2'], [1., 2.])
+    frames, times = matcher.pop_latest()
+    assert frames == ['a2', 'b2']
+    assert matcher.unmatched == 3  # a0, a1 and b1, left behind the matched set
+    assert matcher.pop_latest() is None
+
+
+def test_match_by_timestamp():
+    matcher = FrameMatcher(2, 'Timestamp', tolerance=1E-3)
+    matcher.add(0, [0, 1], ['a0', 'a1'], [0., 0.1])
+    matcher.add(1, [5, 6], ['b0', 'b1'], [0.0005, 0.2])
+    frames, times = matcher.pop_latest()
+    assert frames == ['a0', 'b0']
+    assert np.ptp(times) <= 1E-3
+
+
+def test_duplicate_keys():
+    matcher = FrameMatcher(2, 'Timestamp')
+    matcher.add(0, [0, 1], ['a0', 'a1'], [0.5, 0.5])
+    # The replaced frame is counted
+    assert matcher.duplicates == matcher.unmatched == 1
+    matcher.add(1, [0], ['b0'], [0.5])
+    assert matcher.pop_latest()[0] == ['a1', 'b0']
+
+
+def test_max_pending():
+    matcher = FrameMatcher(2, 'Frame number', max_pending=2)
+    matcher.add(0, range(5), range(5), range(5))
+    assert matcher.unmatched == 3
+    assert matcher.pop_latest() is None
+    matcher.reset()
+    assert matcher.unmatched == 0
+
+
+@pytest.fixture
+def simulated_cameras():
+    manager = CameraManager()
+    cameras = [manager.open('Simulated', serial_number, sensor_shape=(16, 32), frame_rate=200)
+               for serial_number in ['SIM-0001', 'SIM-0002']]
+    for camera in cameras:
+        camera.set_frame_format('array')
+    yield cameras
+    for camera in cameras:
+        manager.close(camera)
+
+
+@pytest.mark.parametrize('mode', ['Frame number', 'Timestamp'])
+def test_synchronized_acquisition(simulated_cameras, mode):
+    acquisition = SynchronizedAcquisition(simulated_cameras, mode, tolerance=2E-3)
+    try:
+        acquisition.start(nframes=50)
+        matched = None
+        for _ in range(50):
+            assert acquisition.collect(timeout=0.1)
+            matched = acquisition.pop()
+            if matched is not None:
+                break
+        frames, skew = matched
+        assert [frame.shape for frame in frames] == [(16, 32), (16, 32)]
+        # Host read times when matching by frame number
+        assert skew <= (2E-3 if mode == 'Timestamp' else 0.1)
+        statistics = acquisition.statistics()
+        assert statistics['sets_per_s'] > 0 and len(statistics['frames_per_s']) == 2
+        # Camera timestamps are only enabled to match by timestamp
+        assert statistics['untimed'] == 0 if mode == 'Timestamp' else statistics['untimed'] > 0
+    finally:
+        acquisition.close()
+    assert not acquisition.running
+
+
+def test_synchronized_acquisition_without_timestamps(simulated_cameras, monkeypatch):
+    for camera in simulated_cameras:
+        # Cameras without metadata support
+        enable_metadata = camera.enable_metadata
+        monkeypatch.setattr(camera, 'enable_metadata', lambda enable=True, fn=enable_metadata: fn(False))
+    acquisition = SynchronizedAcquisition(simulated_cameras, 'Timestamp', tolerance=10E-3)
+    try:
+        acquisition.start(nframes=50)
+        time.sleep(0.05)
+        # Frames read together are given distinct times, none of them being replaced
+        assert acquisition.collect(timeout=0.1)
+        assert min(acquisition.frames_read) > 1
+        assert acquisition.untimed == sum(acquisition.frames_read)
+        assert acquisition.statistics()['duplicates'] == 0
+    finally:
+        acquisition.close()
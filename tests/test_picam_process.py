@@ -0,0 +1,79 @@
+import numpy as np
+import pytest
+
+from pymodaq_plugins_princeton_instruments.hardware.picam_process import ProcessCamera
+
+
+@pytest.fixture(scope='module')
+def process_camera():
+    camera = ProcessCamera('Simulated', 'SIM-TEST', held_frames=2, sensor_shape=(16, 32), frame_rate=500)
+    yield camera
+    camera.close()
+    assert not camera.is_opened()
+
+
+def test_attributes(process_camera):
+    assert process_camera.get_attribute('Exposure Time').writable
+    process_camera.set_attribute_value('Exposure Time', 20.)
+    assert process_camera.get_attribute_value('Exposure Time') == 20.
+    assert process_camera.get_attribute('Missing', error_on_missing=False) is None
+    with pytest.raises(process_camera.Error):
+        process_camera.get_attribute('Missing')
+
+
+def test_frames_in_shared_memory(process_camera):
+    process_camera.set_frame_format('array')
+    process_camera.setup_acquisition(mode='sequence', nframes=4)
+    process_camera.start_acquisition()
+    try:
+        assert process_camera.wait_for_frame(since='start', nframes=3, timeout=5.)
+        frames, rng = process_camera.read_multiple_images(rng=(0, 3), return_rng=True)
+        assert frames.shape == (3, 16, 32) and rng == (0, 3)
+        # Views of the ring, not writable
+        assert not frames.flags.writeable
+        assert np.shares_memory(frames, process_camera._ring)
+        # The worker may only overwrite the frames read before the held ones
+        assert process_camera._header[0] == 1
+        process_camera.wait_for_frame(since='lastread', nframes=3, timeout=5.)
+        frames, rng = process_camera.read_multiple_images(return_rng=True)
+        assert rng[1] - rng[0] == len(frames) > 0
+    finally:
+        process_camera.stop_acquisition()
+
+
+def test_newest_frame_supersedes_the_older_ones(process_camera):
+    process_camera.set_frame_format('array')
+    process_camera.setup_acquisition(mode='sequence', nframes=8)
+    process_camera.start_acquisition()
+    try:
+        process_camera.wait_for_frame(since='start', nframes=4, timeout=5.)
+        rng = process_camera.get_new_images_range()
+        frames, infos = process_camera.read_multiple_images(rng=(rng[1] - 1, rng[1]), return_info=True)
+        # Frame infos as an array in 'array' format, as with pylablib
+        assert isinstance(infos, np.ndarray) and len(infos) == len(frames) == 1
+        assert process_camera.get_frames_status().skipped >= rng[1] - 1 - rng[0]
+    finally:
+        process_camera.stop_acquisition()
+
+
+def test_snap_ends_the_acquisition(process_camera):
+    process_camera.setup_acquisition(mode='snap', nframes=3)
+    process_camera.start_acquisition()
+    assert process_camera.wait_for_frame(since='start', nframes=3, timeout=5.)
+    assert process_camera.wait_for_frame(since='lastread', nframes=4, timeout=5.) is False
+    assert not process_camera.acquisition_in_progress()
+    assert len(process_camera.read_multiple_images()) == 3
+
+
+def test_worker_errors(process_camera):
+    with pytest.raises(process_camera.Error):
+        process_camera.set_rois([(0, 64, 1, 30, 8, 1)])
+    process_camera.frame_rate = 1
+    process_camera.setup_acquisition(mode='sequence', nframes=4)
+    process_camera.start_acquisition()
+    try:
+        with pytest.raises(process_camera.TimeoutError):
+            process_camera.wait_for_frame(since='start', nframes=5, timeout=0.1)
+    finally:
+        process_camera.stop_acquisition()
+        process_camera.frame_rate = 500
@@ -0,0 +1,259 @@
+import numpy as np
+import pytest
+
+from pymodaq_plugins_princeton_instruments.hardware.picam_processing import FrameAccumulator, FrameTracker, \
+    CosmicRayFilter, FrameStatistics, AutoExposure, sum_tracks, split_rois, frame_info_columns
+from pymodaq_plugins_princeton_instruments.hardware.picam_simulator import TFrameInfo
+
+
+def test_split_rois():
+    rois = [np.arange(2 * 3 * 4).reshape((2, 3, 4)), 100 + np.arange(2 * 1 * 5).reshape((2, 1, 5))]
+    packed = np.concatenate([roi.reshape((2, -1)) for roi in rois], axis=1)[:, np.newaxis]
+    views = split_rois(packed, [(3, 4), (1, 5)])
+    for view, roi in zip(views, rois):
+        assert np.shares_memory(view, packed)
+        np.testing.assert_array_equal(view, roi)
+
+
+def test_split_rois_single():
+    frames = np.zeros((2, 3, 4))
+    assert split_rois(frames, [(3, 4)])[0] is frames
+
+
+def test_accumulator_block():
+    accumulator = FrameAccumulator('Block', 3)
+    frames = np.arange(5 * 2 * 2, dtype=np.uint16).reshape((5, 2, 2))
+    accumulator.add(frames[:2])
+    assert not accumulator.ready and accumulator.remaining == 1
+    accumulator.add(frames[2:])  # Frames beyond the block are ignored
+    assert accumulator.ready
+    np.testing.assert_allclose(accumulator.mean(), frames[:3].mean(axis=0))
+    accumulator.reset()
+    assert not accumulator.ready
+
+
+def test_accumulator_running():
+    accumulator = FrameAccumulator('Running', 2)
+    frames = np.random.default_rng(0).random((5, 3, 3))
+    for frame in frames:
+        accumulator.add(frame[np.newaxis])
+    np.testing.assert_allclose(accumulator.mean(), frames.mean(axis=0))
+
+
+def test_accumulator_rolling_window():
+    accumulator = FrameAccumulator('Rolling window', 3)
+    frames = np.arange(6 * 2, dtype=np.int32).reshape((6, 1, 2))
+    accumulator.add(frames[:2])
+    np.testing.assert_allclose(accumulator.mean(), frames[:2].mean(axis=0))
+    accumulator.add(frames[2:5])
+    np.testing.assert_allclose(accumulator.mean(), frames[2:5].mean(axis=0))
+    accumulator.add(frames[5:])
+    np.testing.assert_allclose(accumulator.mean(), frames[3:6].mean(axis=0))
+
+
+def test_accumulator_configure_resets():
+    accumulator = FrameAccumulator('Block', 2)
+    accumulator.add(np.ones((1, 2, 2)))
+    accumulator.configure('Block', 2)
+    assert accumulator.count == 1
+    accumulator.configure('Block', 4)
+    assert accumulator.count == 0 and accumulator.remaining == 4
+
+
+def test_sum_tracks():
+    frames = np.arange(2 * 7 * 3, dtype=np.uint16).reshape((2, 7, 3))
+    tracks = sum_tracks(frames, count=2, height=2, spacing=4)
+    assert tracks.shape == (2, 2, 3)
+    assert tracks.dtype == np.uint32
+    np.testing.assert_array_equal(tracks[:, 0], frames[:, 0:2].sum(axis=1))
+    np.testing.assert_array_equal(tracks[:, 1], frames[:, 4:6].sum(axis=1))
+
+
+def test_sum_tracks_out_of_frame():
+    with pytest.raises(ValueError):
+        sum_tracks(np.zeros((1, 5, 3)), count=2, height=2, spacing=4)
+
+
+def test_frame_info_columns():
+    fields = ['frame_index', 'timestamp_start', 'timestamp_end', 'framestamp']
+    columns = frame_info_columns(np.array([[0, 10, 20, 1], [1, 30, 40, 2]]), fields)
+    np.testing.assert_array_equal(columns['timestamp_start'], [10, 30])
+    columns = frame_info_columns([TFrameInfo(0, 10, 20, 1), None], fields)
+    np.testing.assert_array_equal(columns['framestamp'], [1, -1])
+    assert frame_info_columns([], fields) is None
+    assert frame_info_columns(None, fields) is None
+
+
+def test_tracker_gaps_and_timestamps():
+    tracker = FrameTracker(resolution=1E6, framestamp_bits=64)
+    tracker.reset(t_start_wall=100.)
+    timestamps = tracker.update(np.array([[0, 0, 500, 1], [1, 1000, 1500, 2]]))
+    np.testing.assert_allclose(timestamps, [100., 100.001])
+    # Frame stamp 4 after 2: one frame missed by the camera
+    tracker.update(np.array([[2, 3000, 3500, 4]]))
+    assert tracker.gaps == 1
+    assert tracker.interval == pytest.approx(2E-3)
+    assert tracker.last_exposure_end == pytest.approx(3.5E-3)
+
+
+def test_tracker_fields_by_name():
+    fields = ['frame_index', 'timestamp_start', 'timestamp_end', 'framestamp', 'extra']
+    tracker = FrameTracker(1E6, 64, fields)
+    timestamps = tracker.update(np.array([[0, 10, 20, 1, 7], [1, 1010, 1020, 3, 7]]))
+    np.testing.assert_allclose(timestamps, [1E-5, 1.01E-3])
+    assert tracker.gaps == 1
+
+
+def test_tracker_without_metadata():
+    tracker = FrameTracker()
+    assert tracker.update(None) is None
+    assert tracker.update([TFrameInfo(0, None, None, None)]) is None
+
+
+def test_tracker_framestamp_wrap_around():
+    tracker = FrameTracker(framestamp_bits=8)
+    tracker.update(np.array([[0, 0, 1, 254], [1, 10, 11, 255]]))
+    tracker.update(np.array([[2, 20, 21, 0]]))
+    assert tracker.gaps == 0
+
+
+def _noisy_frames(nframes, shape, level=100., seed=0):
+    return np.random.default_rng(seed).normal(level, 3., (nframes,) + shape).astype(np.float32)
+
+
+def test_cosmic_laplacian():
+    frames = _noisy_frames(2, (20, 30))
+    frames[1, 5, 7] += 1000
+    cosmic_filter = CosmicRayFilter('Laplacian', threshold=8.)
+    cleaned, hits = cosmic_filter.apply(frames)
+    np.testing.assert_array_equal(hits, [0, 1])
+    assert cleaned[1, 5, 7] < 120
+    assert cosmic_filter.total_hits == 1
+
+
+def test_cosmic_laplacian_spectrum():
+    frames = _noisy_frames(1, (1, 200))
+    frames[0, 0, 50] += 1000
+    cleaned, hits = CosmicRayFilter('Laplacian').apply(frames)
+    assert hits[0] == 1 and cleaned[0, 0, 50] < 120
+
+
+def test_cosmic_median_of_n():
+    frames = _noisy_frames(6, (10, 10))
+    frames[5, 2, 3] += 1000
+    cosmic_filter = CosmicRayFilter('Median of N', nframes=5, threshold=8.)
+    cleaned, hits = cosmic_filter.apply(frames)
+    # At least 3 frames are needed in the history before cleaning anything
+    np.testing.assert_array_equal(hits, [0, 0, 0, 0, 0, 1])
+    assert cleaned[5, 2, 3] < 120
+
+
+def test_cosmic_in_place():
+    frames = _noisy_frames(2, (20, 30)).astype(np.float64)
+    frames[1, 5, 7] += 1000
+    cleaned, hits = CosmicRayFilter('Laplacian').apply(frames, out=frames)
+    assert cleaned is frames
+    assert hits[1] == 1 and frames[1, 5, 7] < 120
+
+
+def test_cosmic_multiple_rois():
+    # Two ROIs of very different levels, packed in single rows: no hit at their boundary
+    rois = [_noisy_frames(2, (4, 50), 100.), _noisy_frames(2, (2, 30), 5000., seed=1)]
+    frames = np.concatenate([roi.reshape((2, -1)) for roi in rois], axis=1)[:, np.newaxis]
+    frames[1, 0, 10] += 1000
+    cosmic_filter = CosmicRayFilter('Laplacian', threshold=8.)
+    cleaned, hits = cosmic_filter.apply(frames, [(4, 50), (2, 30)])
+    np.testing.assert_array_equal(hits, [0, 1])
+    assert cleaned.shape == frames.shape
+    assert cleaned[1, 0, 10] < 120
+    np.testing.assert_allclose(cleaned[:, 0, 200:], frames[:, 0, 200:])
+
+
+def test_frame_statistics():
+    frames = np.zeros((2, 3, 4), dtype=np.uint16)
+    frames[0, 1, 2] = 10
+    frames[1, 2, 0] = 65535
+    frames[1, 0, 0] = 5
+    statistics = FrameStatistics(['Centroid', 'Sum', 'Max', 'Saturated pixels', 'Mean'], saturation=65535)
+    # In the order of FRAME_STATISTICS
+    assert statistics.labels((3, 4)) == ['Sum', 'Mean', 'Max', 'Saturated pixels', 'Centroid x', 'Centroid y']
+    total, mean, maximum, saturated, x, y = statistics.compute(frames)
+    np.testing.assert_array_equal(total, [10, 65540])
+    assert total.dtype == np.int64
+    np.testing.assert_allclose(mean, np.array([10, 65540]) / 12)
+    np.testing.assert_array_equal(maximum, [10, 65535])
+    np.testing.assert_array_equal(saturated, [0, 1])
+    np.testing.assert_allclose(x, [2, 0])
+    np.testing.assert_allclose(y, [1, 2 * 65535 / 65540])
+
+
+def test_frame_statistics_spectra():
+    statistics = FrameStatistics(['Centroid'])
+    assert statistics.labels((1, 5)) == ['Centroid x']
+    spectra = np.array([[0., 1., 0., 1., 0.], [0.] * 5])
+    x, = statistics.compute(spectra)
+    assert x[0] == 2.
+    # No signal, no centroid
+    assert np.isnan(x[1])
+    assert not FrameStatistics().active
+
+
+def test_auto_exposure_measure():
+    auto_exposure = AutoExposure('Once', percentile=99., subsampling=1)
+    frame = np.arange(100, dtype=np.uint16).reshape((10, 10))
+    level, dark = auto_exposure.measure(frame)
+    assert level == 98 and dark == 5
+
+
+def test_auto_exposure_converges():
+    auto_exposure = AutoExposure('Once', target=0.5, tolerance=0.05, settling=0, full_scale=1000)
+    exposure = 1.
+    for _ in range(10):
+        # Signal proportional to the exposure time, over a dark level of 100 counts
+        new_exposure = auto_exposure.update(100 + 100 * exposure, 100, exposure)
+        if new_exposure is None:
+            break
+        exposure = new_exposure
+    assert auto_exposure.state == 'Converged'
+    assert exposure == pytest.approx(4.)
+    assert not auto_exposure.active
+
+
+def test_auto_exposure_settling():
+    auto_exposure = AutoExposure('Once', target=0.5, settling=2, full_scale=1000)
+    assert auto_exposure.update(100, 0, 1.) is not None
+    assert auto_exposure.update(100, 0, 5.) is None
+    assert auto_exposure.update(100, 0, 5.) is None
+    assert auto_exposure.update(100, 0, 5.) is not None
+
+
+def test_auto_exposure_exposure_limit():
+    auto_exposure = AutoExposure('Once', target=0.5, settling=0, full_scale=1000)
+    assert auto_exposure.update(100, 0, 10., truncate=lambda exposure: min(exposure, 10.)) is None
+    assert auto_exposure.state == 'Exposure limit'
+
+
+def test_auto_exposure_continuous_max_iterations():
+    # Saturated whatever the exposure: the run stops after max_iterations, also in Continuous mode
+    auto_exposure = AutoExposure('Continuous', settling=0, max_iterations=3, full_scale=1000)
+    exposure = 1.
+    changes = 0
+    for _ in range(10):
+        new_exposure = auto_exposure.update(1000, 0, exposure)
+        if new_exposure is not None:
+            exposure = new_exposure
+            changes += 1
+    assert changes == 3
+    assert auto_exposure.state == 'Not converged'
+    assert not auto_exposure.active
+
+
+def test_auto_exposure_continuous_dead_band():
+    auto_exposure = AutoExposure('Continuous', target=0.7, tolerance=0.05, settling=0, full_scale=1000)
+    assert auto_exposure.update(700, 0, 1.) is None
+    assert auto_exposure.state == 'Converged'
+    # Out of the tolerance, but within the dead band: kept
+    assert auto_exposure.update(780, 0, 1.) is None
+    assert auto_exposure.state == 'Converged'
+    assert auto_exposure.update(900, 0, 1.) == pytest.approx(0.7 / 0.9)
+    assert auto_exposure.state == 'Converging'
@@ -0,0 +1,85 @@
+import json
+
+import numpy as np
+import pytest
+
+from pymodaq_plugins_princeton_instruments.hardware.picam_recorder import RecorderError, StreamRecorder
+
+
+def _frames(nframes, start=0, shape=(2, 3)):
+    return (start + np.arange(nframes * shape[0] * shape[1])).reshape((nframes,) + shape).astype(np.uint16)
+
+
+def test_hdf5(tmp_path):
+    h5py = pytest.importorskip('h5py')
+    recorder = StreamRecorder(str(tmp_path / 'frames.h5'), 'HDF5', (2, 3), np.uint16, metadata={'exposure_time': 5.})
+    recorder.start()
+    assert recorder.put(_frames(2), first_index=10, timestamp=1.)
+    assert recorder.put(_frames(1, 100), first_index=12)
+    recorder.close()
+    assert recorder.written_frames == 3 and recorder.dropped_frames == 0
+    with h5py.File(tmp_path / 'frames.h5', 'r') as f:
+        np.testing.assert_array_equal(f['frames'][:], np.concatenate([_frames(2), _frames(1, 100)]))
+        np.testing.assert_array_equal(f['frame_index'][:], [10, 11, 12])
+        assert f['timestamp'][0] == 1.
+        assert f['frames'].attrs['exposure_time'] == 5.
+
+
+def test_npy_truncated_to_the_recorded_frames(tmp_path):
+    recorder = StreamRecorder(str(tmp_path / 'frames.npy'), 'npy', (2, 3), np.uint16, capacity=10)
+    recorder.start()
+    recorder.put(_frames(3))
+    recorder.close()
+    np.testing.assert_array_equal(np.load(tmp_path / 'frames.npy'), _frames(3))
+    np.testing.assert_array_equal(np.load(tmp_path / 'frames_frames.npy')['frame_index'], [0, 1, 2])
+    with open(tmp_path / 'frames.json') as f:
+        assert json.load(f)['recorded_frames'] == 3
+
+
+def test_npy_capacity(tmp_path):
+    recorder = StreamRecorder(str(tmp_path / 'frames.npy'), 'npy', (2, 3), np.uint16, capacity=2)
+    recorder.start()
+    recorder.put(_frames(3))
+    recorder.close()
+    assert recorder.written_frames == 2 and recorder.dropped_frames == 1
+    assert len(np.load(tmp_path / 'frames.npy')) == 2
+
+
+def test_dropped_frames(tmp_path):
+    recorder = StreamRecorder(str(tmp_path / 'frames.npy'), 'npy', (2, 3), np.uint16, capacity=10)
+    recorder.start()
+    assert not recorder.put(_frames(2, shape=(3, 3)))  # Not the recorded frame shape
+    recorder.close()
+    assert not recorder.put(_frames(1))  # Closed
+    assert recorder.dropped_frames == 3 and recorder.written_frames == 0
+
+
+def test_dropped_frames_counted_from_both_threads(tmp_path):
+    # Frames dropped by the full queue (acquisition thread) and by the full file (writer thread) at the same time
+    recorder = StreamRecorder(str(tmp_path / 'frames.npy'), 'npy', (2, 3), np.uint16, queue_size=1, policy='Drop',
+                              capacity=100)
+    recorder.start()
+    nput = 20000
+    for _ in range(nput):
+        recorder.put(_frames(1))
+    recorder.close()
+    assert recorder.written_frames == 100
+    assert recorder.written_frames + recorder.dropped_frames == nput
+
+
+def test_existing_files_are_not_overwritten(tmp_path):
+    paths = []
+    for _ in range(3):
+        recorder = StreamRecorder(str(tmp_path / 'frames.npy'), 'npy', (2, 3), np.uint16, capacity=10)
+        recorder.start()
+        recorder.put(_frames(1))
+        recorder.close()
+        paths.append(recorder.path)
+    assert paths == [str(tmp_path / name) for name in ['frames.npy', 'frames_001.npy', 'frames_002.npy']]
+    assert sorted(path.name for path in tmp_path.glob('frames_001*')) == \
+        ['frames_001.json', 'frames_001.npy', 'frames_001_frames.npy']
+
+
+def test_unknown_format(tmp_path):
+    with pytest.raises(RecorderError):
+        StreamRecorder(str(tmp_path / 'frames'), 'tiff').start()
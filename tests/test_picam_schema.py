@@ -0,0 +1,66 @@
+import json
+
+import pytest
+
+from pymodaq_plugins_princeton_instruments.hardware.picam_schema import SchemaCache, build_camera_schema, \
+    fill_schema_values
+from pymodaq_plugins_princeton_instruments.hardware.picam_simulator import SimulatedPicamCamera
+
+
+@pytest.fixture
+def simulated_camera():
+    camera = SimulatedPicamCamera('SIM-TEST', sensor_shape=(32, 64))
+    yield camera
+    camera.close()
+
+
+def test_build_schema(simulated_camera):
+    settable, read_only = build_camera_schema(simulated_camera)
+    assert settable[0]['title'] == 'Exposure Time'
+    assert all(not param['readonly'] for param in settable)
+    assert all(param['readonly'] for param in read_only)
+    # Hidden in simple settings
+    assert 'Readout Count' not in [param['title'] for param in settable]
+    assert 'Readout Count' in [param['title'] for param in build_camera_schema(simulated_camera, False)[0]]
+
+
+def test_cache_round_trip(simulated_camera, tmp_path):
+    cache = SchemaCache(str(tmp_path))
+    assert cache.load(simulated_camera, 'Simulated', 'SIM-TEST') is None
+    schema = build_camera_schema(simulated_camera)
+    cache.save(simulated_camera, 'Simulated', 'SIM-TEST', schema)
+    cached = cache.load(simulated_camera, 'Simulated', 'SIM-TEST')
+    assert [param['title'] for param in cached[0]] == [param['title'] for param in schema[0]]
+
+    simulated_camera.set_attribute_value('Exposure Time', 100.)
+    values = fill_schema_values(simulated_camera, cached)
+    assert values['Exposure Time'] == 100.
+    assert cached[0][0]['value'] == 100.
+    rois = next(param for param in cached[0] if param['title'] == 'ROIs')
+    assert [child['value'] for child in rois['children']] == list(values['ROIs'][0])
+
+
+def test_cache_invalidation(simulated_camera, tmp_path):
+    cache = SchemaCache(str(tmp_path))
+    cache.save(simulated_camera, 'Simulated', 'SIM-TEST', build_camera_schema(simulated_camera))
+    # Saved for other settings, or for another camera
+    assert cache.load(simulated_camera, 'Simulated', 'SIM-TEST', simple_settings=False) is None
+    assert cache.load(simulated_camera, 'Simulated', 'SIM-0002') is None
+    path = next(tmp_path.glob('*.json'))
+    content = json.loads(path.read_text())
+    content['version'] = 0
+    path.write_text(json.dumps(content))
+    assert cache.load(simulated_camera, 'Simulated', 'SIM-TEST') is None
+    path.write_text('{')
+    assert cache.load(simulated_camera, 'Simulated', 'SIM-TEST') is None
+
+
+def test_cache_clear(simulated_camera, tmp_path):
+    cache = SchemaCache(str(tmp_path))
+    cache.save(simulated_camera, 'Simulated', 'SIM-TEST', build_camera_schema(simulated_camera))
+    cache.save(simulated_camera, 'Simulated', 'SIM-OTHER', build_camera_schema(simulated_camera))
+    cache.clear('Simulated', 'SIM-TEST')
+    assert cache.load(simulated_camera, 'Simulated', 'SIM-TEST') is None
+    assert cache.load(simulated_camera, 'Simulated', 'SIM-OTHER') is not None
+    cache.clear()
+    assert cache.load(simulated_camera, 'Simulated', 'SIM-OTHER') is None
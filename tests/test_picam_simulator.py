@@ -0,0 +1,107 @@
+import time
+
+import numpy as np
+import pytest
+
+from pymodaq_plugins_princeton_instruments.hardware.picam_simulator import SimulatedPicamCamera
+
+
+@pytest.fixture
+def simulated_camera():
+    camera = SimulatedPicamCamera('SIM-TEST', sensor_shape=(32, 64), frame_rate=500)
+    yield camera
+    camera.close()
+
+
+def _acquire(camera, nframes, fmt='array'):
+    camera.set_frame_format(fmt)
+    camera.setup_acquisition(mode='sequence', nframes=100)
+    camera.start_acquisition()
+    camera.wait_for_frame(since='start', nframes=nframes, timeout=5.)
+
+
+def test_sequence(simulated_camera):
+    _acquire(simulated_camera, 5)
+    frames, rng = simulated_camera.read_multiple_images(return_rng=True)
+    assert frames.shape[1:] == (32, 64) and frames.dtype == np.uint16
+    assert rng[1] - rng[0] == len(frames) >= 5
+
+
+def test_empty_range_fails_as_the_hardware(simulated_camera):
+    """pylablib cannot read an empty range in 'array' frame format, the simulated camera behaves the same."""
+    _acquire(simulated_camera, 1)
+    simulated_camera.stop_acquisition()
+    simulated_camera.read_multiple_images()
+    assert simulated_camera.get_new_images_range() is None
+    with pytest.raises(ValueError):
+        simulated_camera.read_multiple_images()
+
+
+def test_frame_infos(simulated_camera):
+    _acquire(simulated_camera, 2)
+    frames, infos = simulated_camera.read_multiple_images(rng=(0, 2), return_info=True)
+    assert simulated_camera.get_frame_info_fields()[:2] == ['frame_index', 'timestamp_start']
+    np.testing.assert_array_equal(infos[:, 0], [0, 1])
+    assert np.all(infos[:, 1:] == -1)  # Metadata disabled
+    simulated_camera.clear_acquisition()
+    simulated_camera.enable_metadata(True)
+    _acquire(simulated_camera, 2)
+    frames, infos = simulated_camera.read_multiple_images(rng=(0, 2), return_info=True)
+    assert infos[1, 1] == pytest.approx(2000, abs=1)  # Time stamps in us at 500 frames/s
+    np.testing.assert_array_equal(infos[:, 3], [1, 2])
+
+
+def test_roi_and_binning(simulated_camera):
+    assert simulated_camera.set_roi(8, 40, 0, 16, hbin=2, vbin=4) == (8, 40, 0, 16, 2, 4)
+    _acquire(simulated_camera, 1)
+    frame = simulated_camera.read_multiple_images(rng=(0, 1))[0]
+    assert frame.shape == simulated_camera.get_data_dimensions() == (4, 16)
+
+
+def test_snap_stops_after_its_frames(simulated_camera):
+    simulated_camera.setup_acquisition(mode='snap', nframes=3)
+    simulated_camera.start_acquisition()
+    assert simulated_camera.get_attribute_value('Readout Count') == 3
+    simulated_camera.wait_for_frame(since='start', nframes=3, timeout=5.)
+    assert not simulated_camera.acquisition_in_progress()
+    assert len(simulated_camera.read_multiple_images()) == 3
+
+
+def test_sequence_with_readout_count(simulated_camera):
+    # As the armed scan: a ring buffer smaller than the number of frames
+    simulated_camera.setup_acquisition(mode='sequence', nframes=4)
+    simulated_camera.set_attribute_value('Readout Count', 6)
+    simulated_camera.start_acquisition()
+    simulated_camera.wait_for_frame(since='start', nframes=6, timeout=5.)
+    time.sleep(0.05)
+    assert not simulated_camera.acquisition_in_progress()
+    assert simulated_camera.get_frames_status().acquired == 6
+
+
+def test_skipped_frames(simulated_camera):
+    simulated_camera.set_frame_format('array')
+    simulated_camera.setup_acquisition(mode='sequence', nframes=4)
+    simulated_camera.start_acquisition()
+    time.sleep(0.05)  # About 25 frames in a 4 frames buffer
+    simulated_camera.read_multiple_images()
+    assert simulated_camera.get_frames_status().skipped > 0
+
+
+def test_wait_timeout(simulated_camera):
+    simulated_camera.frame_rate = 1
+    _acquire(simulated_camera, 0)
+    with pytest.raises(simulated_camera.TimeoutError):
+        simulated_camera.wait_for_frame(nframes=10, timeout=0.01)
+
+
+def test_multiple_rois(simulated_camera):
+    simulated_camera.set_rois([(0, 64, 1, 0, 8, 1), (0, 64, 2, 10, 4, 4)])
+    assert simulated_camera.get_roi() == (0, 64, 0, 14, 1, 1)
+    _acquire(simulated_camera, 1)
+    frame = simulated_camera.read_multiple_images(rng=(0, 1))[0]
+    assert frame.shape == (1, 8 * 64 + 32)
+
+
+def test_invalid_rois(simulated_camera):
+    with pytest.raises(simulated_camera.Error):
+        simulated_camera.set_rois([(0, 64, 1, 30, 8, 1)])
@@ -0,0 +1,72 @@
+import pytest
+
+from pymodaq_plugins_princeton_instruments.hardware.picam_simulator import SimulatedPicamCamera
+from pymodaq_plugins_princeton_instruments.hardware.picam_utils import AttributeSnapshot, get_parameter_limits, \
+    get_roi_shape, parse_rois, format_rois
+
+
+@pytest.fixture
+def simulated_camera():
+    camera = SimulatedPicamCamera('SIM-TEST', sensor_shape=(32, 64))
+    yield camera
+    camera.close()
+
+
+def _snapshot(camera, names):
+    return AttributeSnapshot(camera, {name: camera.get_attribute_value(name) for name in names})
+
+
+def test_parameter_limits(simulated_camera):
+    assert get_parameter_limits(simulated_camera.get_attribute('ADC Quality')) == \
+        list(simulated_camera.get_attribute('ADC Quality').labels)
+    assert get_parameter_limits(simulated_camera.get_attribute('Pixel Width')) is None
+
+
+def test_snapshot_dependents(simulated_camera):
+    snapshot = _snapshot(simulated_camera, ['Exposure Time', 'ADC Speed', 'ADC Bit Depth', 'Pixel Width',
+                                            'Frame Rate Calculation'])
+    assert snapshot.get_dependents('ADC Speed') == ['ADC Speed', 'ADC Bit Depth', 'Frame Rate Calculation']
+    assert snapshot.get_dependents('Exposure Time') == ['Exposure Time', 'Frame Rate Calculation']
+
+
+def test_snapshot_refresh_after_change(simulated_camera):
+    names = ['Exposure Time', 'ADC Speed', 'Pixel Width', 'Frame Rate Calculation']
+    snapshot = _snapshot(simulated_camera, names)
+    simulated_camera.set_attribute_value('Exposure Time', 100.)
+    values, limits = snapshot.refresh_after_change('Exposure Time')
+    assert values['Exposure Time'] == 100.
+    assert 'Frame Rate Calculation' in values
+    # Only the changed attribute and the calculated one were queried
+    assert snapshot.device_calls == 2
+    assert snapshot.refresh() == ({}, {})
+    assert snapshot.device_calls == 2 + len(names)
+
+
+def test_snapshot_refresh_after_changes(simulated_camera):
+    names = ['Exposure Time', 'ADC Speed', 'ADC Bit Depth', 'Pixel Width', 'Frame Rate Calculation']
+    snapshot = _snapshot(simulated_camera, names)
+    simulated_camera.set_attribute_value('Exposure Time', 100.)
+    snapshot.refresh_after_changes(['Exposure Time', 'ADC Speed'])
+    # The calculated attribute, depending on both, is queried once
+    assert snapshot.device_calls == 4
+
+
+def test_parse_rois():
+    text = '0, 100, 1, 0, 10, 1\n\n# comment\n10; 200; 2; 100; 4; 4  # fibre 2\n'
+    assert parse_rois(text) == [(0, 100, 1, 0, 10, 1), (10, 200, 2, 100, 4, 4)]
+    assert parse_rois('') == []
+
+
+def test_parse_rois_wrong_field_count():
+    with pytest.raises(ValueError):
+        parse_rois('0, 100, 1, 0, 10')
+
+
+def test_format_rois_round_trip():
+    rois = [(0, 100, 1, 0, 10, 1), (10, 200, 2, 100, 4, 4)]
+    assert format_rois(rois) == '0, 100, 1, 0, 10, 1\n10, 200, 2, 100, 4, 4'
+    assert parse_rois(format_rois(rois)) == rois
+
+
+def test_get_roi_shape():
+    assert get_roi_shape((10, 200, 2, 100, 4, 4)) == (1, 100)
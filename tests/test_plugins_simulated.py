@@ -0,0 +1,679 @@
+"""Smoke tests of the viewer plugins with the simulated camera backend."""
+import os
+import time
+import traceback
+
+import numpy as np
+import pytest
+
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+from qtpy import QtCore, QtWidgets  # noqa: E402
+
+from pymodaq_plugins_princeton_instruments.daq_viewer_plugins.plugins_0D.daq_0Dviewer_picam import \
+    DAQ_0DViewer_picam  # noqa: E402
+from pymodaq_plugins_princeton_instruments.daq_viewer_plugins.plugins_1D.daq_1Dviewer_picam import \
+    DAQ_1DViewer_picam  # noqa: E402
+from pymodaq_plugins_princeton_instruments.daq_viewer_plugins.plugins_2D.daq_2Dviewer_picam import \
+    DAQ_2DViewer_picam  # noqa: E402
+from pymodaq_plugins_princeton_instruments.daq_viewer_plugins.plugins_2D.daq_2Dviewer_picam_sync import \
+    DAQ_2DViewer_picam_sync  # noqa: E402
+from pymodaq_plugins_princeton_instruments.daq_viewer_plugins.plugins_ND.daq_NDviewer_picam import \
+    DAQ_NDViewer_picam  # noqa: E402
+from pymodaq_plugins_princeton_instruments.hardware import picam_backends  # noqa: E402
+from pymodaq_plugins_princeton_instruments.hardware.picam_simulator import SIMULATED_SERIAL_NUMBERS, \
+    list_simulated_cameras  # noqa: E402
+
+
+class StatusReceiver(QtCore.QObject):
+    """Stand-in for the DAQ_Viewer parent of the plugin, collecting the status messages."""
+    status_sig = QtCore.Signal(object)
+
+    def __init__(self):
+        super().__init__()
+        self.messages = []
+        self.status_sig.connect(self.messages.append)
+
+
+@pytest.fixture(scope='module')
+def qapp():
+    return QtWidgets.QApplication.instance() or QtWidgets.QApplication([])
+
+
+def _open(cls, **settings):
+    plugin = cls(StatusReceiver(), None)
+    plugin.settings.child('backend').setValue('Simulated')
+    plugin.settings.child('serial_number').setValue('SIM-0001')
+    plugin.settings.child('simulation', 'frame_rate').setValue(200)
+    for path, value in settings.items():
+        plugin.settings.child(*path.split('.')).setValue(value)
+    status = plugin.ini_detector()
+    assert status.initialized, status.info
+    return plugin
+
+
+def _set(plugin, path, value):
+    """Change a setting as the user would, committing it to the plugin."""
+    param = plugin.settings.child(*path.split('.'))
+    param.setValue(value)
+    plugin.commit_settings(param)
+
+
+def _grab(qapp, plugin, ngrabs=1, timeout=5., naverage=1):
+    """Grab `ngrabs` times, each grab waiting for the data signaling its end. Return the data of the last one, the
+    previous ones being released as a viewer would (their frame slots can then be reused)."""
+    received = []
+
+    def receive(data):
+        received[:] = [data]
+    plugin.data_grabed_signal.connect(receive)
+    try:
+        for _ in range(ngrabs):
+            received.clear()
+            plugin.grab_data(naverage)
+            t0 = time.perf_counter()
+            while not received:
+                assert time.perf_counter() - t0 < timeout, 'No data emitted'
+                qapp.processEvents()
+                time.sleep(1E-3)
+    finally:
+        plugin.data_grabed_signal.disconnect(receive)
+    return received[-1]
+
+
+def _close(plugin):
+    plugin.stop()
+    plugin.close()
+
+
+@pytest.mark.parametrize('readout_mode', ['Newest frame', 'Lossless burst'])
+def test_2D_grab(qapp, readout_mode):
+    plugin = _open(DAQ_2DViewer_picam, **{'simulation.sensor_width': 128, 'simulation.sensor_height': 64})
+    try:
+        _set(plugin, 'acquisition.readout_mode', readout_mode)
+        data = _grab(qapp, plugin, ngrabs=3)
+        frame = data[0]['data'][0]
+        assert frame.shape[-2:] == (64, 128)
+        assert np.all(frame > 0)
+    finally:
+        _close(plugin)
+
+
+def test_2D_backend_change(qapp, monkeypatch):
+    monkeypatch.setattr(picam_backends, 'list_cameras',
+                        lambda backend: [] if backend == 'Picam' else list_simulated_cameras())
+    plugin = _open(DAQ_2DViewer_picam)
+    try:
+        _set(plugin, 'backend', 'Picam')
+        assert plugin.settings.child('serial_number').opts['limits'] == []
+        assert plugin.settings.child('serial_number').value() == ''
+        _set(plugin, 'backend', 'Simulated')
+        assert plugin.settings.child('serial_number').opts['limits'] == list(SIMULATED_SERIAL_NUMBERS)
+        assert plugin.settings.child('serial_number').value() == SIMULATED_SERIAL_NUMBERS[0]
+    finally:
+        _close(plugin)
+
+
+def test_2D_read_without_new_frames(qapp):
+    plugin = _open(DAQ_2DViewer_picam)
+    try:
+        _grab(qapp, plugin)
+        plugin.stop()
+        plugin._read_batch()
+        # pylablib cannot read an empty range in 'array' frame format
+        assert plugin._read_batch() == []
+        assert plugin._read_newest() is None
+    finally:
+        _close(plugin)
+
+
+def test_2D_lossless_overruns(qapp):
+    plugin = _open(DAQ_2DViewer_picam, **{'simulation.frame_rate': 1000, 'acquisition.buffer_frames': 4})
+    try:
+        _set(plugin, 'acquisition.readout_mode', 'Lossless burst')
+        _grab(qapp, plugin)
+        time.sleep(0.05)  # About 50 frames in a 4 frames buffer
+        data = _grab(qapp, plugin)
+        assert data[0]['dim'] == 'DataND'
+        assert len(data[0]['data'][0]) <= 4
+        assert plugin.settings.child('acquisition', 'overruns').value() > 0
+    finally:
+        _close(plugin)
+
+
+def test_2D_averaging(qapp):
+    plugin = _open(DAQ_2DViewer_picam)
+    try:
+        frame = _grab(qapp, plugin, naverage=4)[0]['data'][0]
+        # The simulated frames differ by their index modulo 16: only an average is fractional
+        assert frame.dtype == np.float64
+        assert np.any(frame % 1)
+    finally:
+        _close(plugin)
+
+
+def test_2D_incremental_attribute_sync(qapp):
+    plugin = _open(DAQ_2DViewer_picam, **{'simple_settings': False})
+    try:
+        param = plugin.settings.child('settable_camera_parameters', 'exposure_time')
+        _set(plugin, 'settable_camera_parameters.exposure_time', 2 * param.value())
+        calls = plugin.settings.child('diagnostics', 'commit_device_calls').value()
+        assert 0 < calls < len(plugin.snapshot.values)
+        assert plugin.snapshot.values['Exposure Time'] == param.value()
+    finally:
+        _close(plugin)
+
+
+def test_2D_frame_slots(qapp):
+    plugin = _open(DAQ_2DViewer_picam, **{'simulation.sensor_width': 64, 'simulation.sensor_height': 32})
+    try:
+        frame = _grab(qapp, plugin, ngrabs=3)[0]['data'][0]
+        assert not frame.flags.writeable
+        assert np.shares_memory(frame, plugin.ring_buffer._buffer)
+        assert plugin.ring_buffer.allocations == 1
+        # A frame kept downstream is not overwritten by the next grabs
+        kept = frame.copy()
+        _grab(qapp, plugin, ngrabs=2 * plugin.ring_buffer.n_slots)
+        np.testing.assert_array_equal(frame, kept)
+    finally:
+        _close(plugin)
+
+
+def test_2D_display_throttling(qapp):
+    plugin = _open(DAQ_2DViewer_picam, **{'simulation.frame_rate': 1000})
+    try:
+        _set(plugin, 'acquisition.display_throttling', True)
+        _set(plugin, 'acquisition.max_display_rate', 20.)
+        t0 = time.perf_counter()
+        _grab(qapp, plugin, ngrabs=5)
+        # Displayed at 20 Hz at most, while the frames are drained at 1 kHz
+        assert time.perf_counter() - t0 >= 0.15
+        assert plugin.controller.get_frames_status().unread < 50
+    finally:
+        _close(plugin)
+
+
+def test_2D_display_after_a_pause(qapp):
+    plugin = _open(DAQ_2DViewer_picam, **{'simulation.frame_rate': 1000})
+    times = []
+    plugin.data_grabed_signal.connect(lambda data: times.append(time.perf_counter()))
+    try:
+        _set(plugin, 'acquisition.display_throttling', True)
+        _set(plugin, 'acquisition.max_display_rate', 20.)
+        _grab(qapp, plugin)
+        time.sleep(0.3)
+        _grab(qapp, plugin, ngrabs=3)
+        # Late by several periods: the displays restart from now rather than catching up back-to-back
+        assert min(t1 - t0 for t0, t1 in zip(times[1:], times[2:])) >= 0.04
+    finally:
+        _close(plugin)
+
+
+def test_2D_superseded_frames_are_not_logged(qapp):
+    plugin = _open(DAQ_2DViewer_picam, **{'simulation.frame_rate': 1000})
+    try:
+        _grab(qapp, plugin)
+        time.sleep(0.05)
+        _grab(qapp, plugin)
+        # Expected when only the newest frame is emitted: counted, not logged
+        assert plugin.settings.child('acquisition', 'overruns').value() > 0
+        messages = [str(message.attributes) for message in plugin.parent.messages]
+        assert messages and not any('lost' in message for message in messages)
+    finally:
+        _close(plugin)
+
+
+def test_2D_recording(qapp, tmp_path):
+    h5py = pytest.importorskip('h5py')
+    plugin = _open(DAQ_2DViewer_picam, **{'recording.path': str(tmp_path / 'frames.h5'), 'recording.record': True})
+    try:
+        _grab(qapp, plugin, ngrabs=3)
+        plugin.stop()
+        assert plugin.settings.child('recording', 'recorded_frames').value() >= 3
+    finally:
+        _close(plugin)
+    with h5py.File(tmp_path / 'frames.h5', 'r') as f:
+        # In newest frame mode, all the frames are recorded and not only the emitted ones
+        frame_index = f['frame_index'][:]
+        np.testing.assert_array_equal(frame_index, np.arange(len(frame_index)))
+        assert f['frames'].attrs['serial_number'] == 'SIM-0001'
+
+
+def test_2D_recording_does_not_overwrite(qapp, tmp_path):
+    pytest.importorskip('h5py')
+    plugin = _open(DAQ_2DViewer_picam, **{'recording.path': str(tmp_path / 'frames.h5')})
+    try:
+        for _ in range(2):
+            _set(plugin, 'recording.record', True)
+            _grab(qapp, plugin, ngrabs=2)
+            plugin.stop()
+            _set(plugin, 'recording.record', False)
+    finally:
+        _close(plugin)
+    assert sorted(os.listdir(tmp_path)) == ['frames.h5', 'frames_001.h5']
+
+
+def test_1D_spectrum(qapp):
+    plugin = _open(DAQ_1DViewer_picam, **{'simulation.sensor_width': 128, 'simulation.sensor_height': 64})
+    try:
+        assert plugin.settings.child('spectroscopy', 'binning').value() == 'Hardware'
+        # The ROIs are set by the tracks
+        assert 'multi_roi' not in plugin.settings.names
+        data = _grab(qapp, plugin, ngrabs=2)
+        assert data[0]['labels'] == ['Picam_Spectrum']
+        assert data[0]['data'][0].shape == (128,)
+    finally:
+        _close(plugin)
+
+
+@pytest.mark.parametrize('spacing, binning', [(10, 'Hardware'), (15, 'Software')])
+def test_1D_multi_track(qapp, spacing, binning):
+    plugin = _open(DAQ_1DViewer_picam, **{'simulation.sensor_width': 128, 'simulation.sensor_height': 64})
+    try:
+        for name, value in [('track_count', 3), ('track_height', 10), ('track_spacing', spacing),
+                            ('binning_mode', 'Multi-track')]:
+            _set(plugin, f'spectroscopy.{name}', value)
+        assert plugin.settings.child('spectroscopy', 'binning').value() == binning
+        data = _grab(qapp, plugin, ngrabs=2)
+        spectra = data[0]['data']
+        assert data[0]['labels'] == [f'Picam_Track{ind}' for ind in range(3)]
+        assert all(spectrum.shape == (128,) for spectrum in spectra)
+    finally:
+        _close(plugin)
+
+
+def test_1D_tracks_held_with_batch_changes(qapp):
+    plugin = _open(DAQ_1DViewer_picam, **{'simulation.sensor_width': 128, 'simulation.sensor_height': 64})
+    try:
+        rois = plugin._get_rois()
+        _set(plugin, 'batch.hold', True)
+        for name, value in [('track_count', 3), ('track_height', 10), ('track_spacing', 15),
+                            ('binning_mode', 'Multi-track')]:
+            _set(plugin, f'spectroscopy.{name}', value)
+        # Nothing set in the camera until applied
+        assert plugin.settings.child('batch', 'pending').value() == 'ROIs'
+        assert plugin._get_rois() == rois
+        assert plugin._software_tracks is None
+        _set(plugin, 'batch.apply', True)
+        assert plugin.settings.child('batch', 'pending').value() == ''
+        assert plugin.settings.child('spectroscopy', 'binning').value() == 'Software'
+        assert plugin._software_tracks == (3, 10, 15)
+        data = _grab(qapp, plugin)
+        assert data[0]['labels'] == [f'Picam_Track{ind}' for ind in range(3)]
+        _set(plugin, 'spectroscopy.track_count', 2)
+        _set(plugin, 'batch.discard', True)
+        assert plugin.settings.child('batch', 'pending').value() == ''
+        assert plugin._software_tracks == (3, 10, 15)
+    finally:
+        _close(plugin)
+
+
+def test_ND_kinetic_series(qapp):
+    plugin = _open(DAQ_NDViewer_picam, **{'simulation.sensor_width': 64, 'simulation.sensor_height': 32,
+                                          'kinetics.nframes': 5})
+    try:
+        assert 'scan' not in plugin.settings.names
+        for _ in range(2):
+            data = _grab(qapp, plugin)
+            assert data[0]['dim'] == 'DataND'
+            assert data[0]['data'][0].shape == (5, 32, 64)
+            assert plugin.controller.get_attribute_value('Readout Count') == 5
+            assert not plugin.controller.acquisition_in_progress()
+    finally:
+        _close(plugin)
+
+
+def test_2D_frame_tracking_off_by_default(qapp):
+    plugin = _open(DAQ_2DViewer_picam)
+    try:
+        assert not plugin.tracking
+        assert not plugin.controller.get_attribute_value('Track Frames')
+        data = _grab(qapp, plugin)
+        assert [channel['name'] for channel in data] == ['Picam']
+    finally:
+        _close(plugin)
+
+
+@pytest.mark.parametrize('readout_mode', ['Newest frame', 'Lossless burst'])
+def test_2D_frame_tracking(qapp, readout_mode):
+    plugin = _open(DAQ_2DViewer_picam, **{'frame_tracking.enabled': True, 'frame_tracking.emit_channels': True})
+    try:
+        _set(plugin, 'acquisition.readout_mode', readout_mode)
+        assert plugin.controller.get_attribute_value('Track Frames')
+        data = _grab(qapp, plugin, ngrabs=3)
+        assert [channel['name'] for channel in data] == ['Picam', 'Picam_tracking']
+        assert data[1]['data'][0][0] == 0  # No frame missed by the simulated camera
+        assert plugin.settings.child('frame_tracking', 'frame_interval').value() == pytest.approx(5., rel=1E-2)
+    finally:
+        _close(plugin)
+
+
+def test_2D_stage_timings(qapp, tmp_path):
+    plugin = _open(DAQ_2DViewer_picam, **{'diagnostics.timings.export_path': str(tmp_path / 'timings.json')})
+    try:
+        _grab(qapp, plugin, ngrabs=3)
+        summary = plugin.profiler.summary()
+        assert all(summary[stage]['count'] >= 3 for stage in ['wait', 'read', 'wrap', 'dispatch'])
+        assert summary['gui_return']['count'] >= 2
+        _set(plugin, 'diagnostics.timings.export', True)
+        assert (tmp_path / 'timings.json').exists()
+    finally:
+        _close(plugin)
+
+
+def test_2D_dark_correction(qapp):
+    plugin = _open(DAQ_2DViewer_picam, **{'corrections.calibration_frames': 16})
+    try:
+        _set(plugin, 'corrections.acquire_dark', True)
+        assert 'dark' in plugin.settings.child('corrections', 'status').value()
+        _set(plugin, 'corrections.dark_enabled', True)
+        frame = _grab(qapp, plugin, ngrabs=2)[0]['data'][0]
+        # The simulated frames only differ from their average by their index modulo 16
+        assert frame.dtype == np.float32
+        assert np.all(np.abs(frame) <= 8)
+    finally:
+        _set(plugin, 'corrections.clear_cache', True)
+        _close(plugin)
+
+
+def test_2D_cosmic_ray_filter(qapp, monkeypatch):
+    plugin = _open(DAQ_2DViewer_picam)
+    try:
+        read_batch = plugin._read_batch
+
+        def read_with_hit(rng=None):
+            frames = np.array(read_batch(rng=rng))
+            if len(frames):
+                frames[:, 5, 7] += 20000
+            return frames
+        monkeypatch.setattr(plugin, '_read_batch', read_with_hit)
+        _set(plugin, 'statistics.selected', dict(all_items=plugin.statistics.statistics, selected=['Max']))
+        _set(plugin, 'cosmic_rays.method', 'Laplacian')
+        data = _grab(qapp, plugin, ngrabs=2)
+        channels = {channel['name']: channel for channel in data}
+        frame = channels['Picam']['data'][0]
+        assert frame.dtype == np.float32 and not frame.flags.writeable
+        assert channels['Picam_cosmic_rays']['dim'] == 'Data0D'
+        assert channels['Picam_cosmic_rays']['data'][0][0] == plugin.settings.child('cosmic_rays', 'hits').value() >= 1
+        # Cleaned as read, the statistics being those of the cleaned frame
+        assert frame[5, 7] < 20000
+        assert channels['Picam_statistics']['data'][0][0] == frame.max()
+        # The emitted frame is not reused by the next cleanings
+        kept = frame.copy()
+        _grab(qapp, plugin, ngrabs=3)
+        np.testing.assert_array_equal(frame, kept)
+    finally:
+        _close(plugin)
+
+
+def test_2D_multiple_rois(qapp):
+    plugin = _open(DAQ_2DViewer_picam)
+    try:
+        _set(plugin, 'multi_roi.roi_list', '0, 64, 1, 0, 8, 1\n0, 64, 2, 10, 4, 4')
+        _set(plugin, 'multi_roi.enabled', True)
+        assert plugin.controller.get_rois() == [(0, 64, 1, 0, 8, 1), (0, 64, 2, 10, 4, 4)]
+        data = _grab(qapp, plugin)
+        channels = {channel['name']: channel for channel in data}
+        assert channels['Picam_ROI0']['data'][0].shape == (8, 64)
+        assert channels['Picam_ROI1']['dim'] == 'Data1D'
+        assert channels['Picam_ROI1']['data'][0].shape == (32,)
+    finally:
+        _close(plugin)
+
+
+def test_2D_batch_changes(qapp):
+    plugin = _open(DAQ_2DViewer_picam, **{'simple_settings': False})
+    try:
+        exposure = plugin.controller.get_attribute_value('Exposure Time')
+        _set(plugin, 'batch.hold', True)
+        _set(plugin, 'settable_camera_parameters.exposure_time', exposure * 2)
+        _set(plugin, 'settable_camera_parameters.rois.width', 256)
+        assert plugin.settings.child('batch', 'pending').value() == 'Exposure Time, ROIs'
+        # Nothing is sent to the camera until applied
+        assert plugin.controller.get_attribute_value('Exposure Time') == exposure
+        assert plugin.controller.get_data_dimensions() == (512, 512)
+        _set(plugin, 'batch.apply', True)
+        assert plugin.settings.child('batch', 'pending').value() == ''
+        assert plugin.controller.get_attribute_value('Exposure Time') == exposure * 2
+        assert plugin.controller.get_data_dimensions() == (512, 256)
+
+        _set(plugin, 'settable_camera_parameters.exposure_time', exposure)
+        _set(plugin, 'batch.discard', True)
+        assert plugin.settings.child('settable_camera_parameters', 'exposure_time').value() == exposure * 2
+        assert plugin.controller.get_attribute_value('Exposure Time') == exposure * 2
+    finally:
+        _close(plugin)
+
+
+def test_2D_presets(qapp, tmp_path, monkeypatch):
+    plugin = _open(DAQ_2DViewer_picam, **{'simple_settings': False})
+    monkeypatch.setattr(plugin, '_preset_dir', lambda: tmp_path)
+    try:
+        exposure = plugin.controller.get_attribute_value('Exposure Time')
+        _set(plugin, 'settable_camera_parameters.exposure_time', exposure * 2)
+        _set(plugin, 'settable_camera_parameters.rois.height', 16)
+        _set(plugin, 'batch.preset_name', 'narrow')
+        _set(plugin, 'batch.save_preset', True)
+        assert plugin.settings.child('batch', 'preset').opts['limits'] == ['narrow']
+
+        _set(plugin, 'settable_camera_parameters.exposure_time', exposure)
+        _set(plugin, 'settable_camera_parameters.rois.height', 512)
+        _set(plugin, 'batch.load_preset', True)
+        assert plugin.controller.get_attribute_value('Exposure Time') == exposure * 2
+        assert plugin.controller.get_data_dimensions() == (16, 512)
+        assert _grab(qapp, plugin)[0]['data'][0].shape == (16, 512)
+    finally:
+        _close(plugin)
+
+
+def test_2D_saved_parameter_layout(qapp, tmp_path, monkeypatch):
+    monkeypatch.setattr('pymodaq_plugins_princeton_instruments.daq_viewer_plugins.plugins_2D.daq_2Dviewer_picam.'
+                        'get_set_local_dir', lambda: tmp_path)
+    titles = []
+    for source in ['built', 'saved layout', 'built']:
+        plugin = _open(DAQ_2DViewer_picam)
+        try:
+            assert plugin.settings.child('diagnostics', 'init_time').value().endswith(f'({source})')
+            titles.append([param.title() for param in plugin.settings.child('settable_camera_parameters').children()])
+            assert _grab(qapp, plugin)[0]['data'][0].shape == (512, 512)
+            if source == 'saved layout':
+                # The layout is rebuilt after a resync
+                _set(plugin, 'diagnostics.resync', True)
+        finally:
+            _close(plugin)
+    assert titles[0] == titles[1] == titles[2]
+
+
+def test_2D_status_polling(qapp, monkeypatch):
+    plugin = _open(DAQ_2DViewer_picam, **{'polling.period': 0.2})
+    try:
+        assert plugin.settings.child('polling', 'cooling').value() == '-70.0 °C, Locked'
+        assert plugin.status_timer.isActive() and plugin.status_timer.interval() == 200
+        _set(plugin, 'polling.enabled', False)
+        assert not plugin.status_timer.isActive()
+
+        # While acquiring, the device is not queried by the timer
+        with monkeypatch.context() as m:
+            m.setattr(plugin.controller, 'acquisition_in_progress', lambda: True)
+            plugin.snapshot.device_calls = 0
+            plugin._poll_status()
+            plugin._poll_status()
+            assert plugin._status_poll_pending and plugin.snapshot.device_calls == 0
+            _set(plugin, 'polling.during_acquisition', 'Skip')
+            plugin._status_poll_pending = False
+            plugin._poll_status()
+            assert not plugin._status_poll_pending
+        # The pending poll is done after the next frame
+        plugin._status_poll_pending = True
+        _grab(qapp, plugin)
+        assert not plugin._status_poll_pending and plugin.snapshot.device_calls > 0
+    finally:
+        _close(plugin)
+
+
+def test_2D_stop_latency(qapp):
+    # A frame every 2 s
+    plugin = _open(DAQ_2DViewer_picam, **{'simulation.frame_rate': 0., 'acquisition.wait_slice': 0.05})
+    try:
+        _set(plugin, 'settable_camera_parameters.exposure_time', 2000.)
+        plugin.grab_data()
+        time.sleep(0.2)
+        qapp.processEvents()
+        assert not plugin.callback_thread.callback.idle.is_set()
+        plugin.stop()
+        assert plugin.callback_thread.callback.idle.is_set()
+        assert plugin.settings.child('diagnostics', 'stop_latency').value() < 500
+    finally:
+        _close(plugin)
+    assert plugin.callback_thread is None
+
+
+def test_2D_armed_scan(qapp, monkeypatch):
+    plugin = _open(DAQ_2DViewer_picam, **{'scan.frames': 4})
+    setups = []
+    setup_acquisition = plugin.controller.setup_acquisition
+    monkeypatch.setattr(plugin.controller, 'setup_acquisition',
+                        lambda *args, **kwargs: setups.append(kwargs) or setup_acquisition(*args, **kwargs))
+    try:
+        # The simulated camera ignores the trigger, frames being acquired as if the scan triggered them
+        _set(plugin, 'scan.trigger', 'External, readout per trigger')
+        _set(plugin, 'scan.enabled', True)
+        for step in range(4):
+            _grab(qapp, plugin)
+            assert plugin._scan_index == step + 1
+        # A single acquisition for the 4 steps, the camera not being set up again between them
+        assert len(setups) == 1
+        assert plugin.controller.get_attribute_value('Readout Count') == 4
+        # All the armed frames consumed: the next grab arms a new scan
+        _grab(qapp, plugin, naverage=2)
+        assert len(setups) == 2 and plugin._scan_index == 2
+        _set(plugin, 'scan.enabled', False)
+        assert not plugin._scan_armed
+    finally:
+        _close(plugin)
+
+
+def test_2D_armed_scan_internal_trigger(qapp):
+    plugin = _open(DAQ_2DViewer_picam, **{'scan.frames': 1000})
+    try:
+        _set(plugin, 'scan.enabled', True)
+        _grab(qapp, plugin)
+        time.sleep(0.1)
+        # The frames acquired before the grab are skipped, not lost
+        acquired = plugin.controller.get_frames_status().acquired
+        _grab(qapp, plugin)
+        assert plugin._scan_index > acquired > 1
+        assert plugin.settings.child('acquisition', 'overruns').value() == 0
+    finally:
+        _close(plugin)
+
+
+def test_2D_armed_scan_overwritten_frames(qapp):
+    plugin = _open(DAQ_2DViewer_picam, **{'scan.frames': 1000, 'scan.trigger': 'External, readout per trigger',
+                                          'acquisition.buffer_frames': 4})
+    try:
+        _set(plugin, 'scan.enabled', True)
+        _grab(qapp, plugin)
+        time.sleep(0.1)
+        # The frames of the step were overwritten: counted as lost, the step taking the oldest frame left
+        _grab(qapp, plugin)
+        assert plugin._scan_index > 4
+        assert plugin.settings.child('acquisition', 'overruns').value() == plugin._scan_index - 2
+    finally:
+        _close(plugin)
+
+
+def test_2D_sync(qapp):
+    plugin = DAQ_2DViewer_picam_sync(StatusReceiver(), None)
+    plugin.settings.child('backend').setValue('Simulated')
+    plugin.settings.child('serial_numbers').setValue(dict(all_items=['SIM-0001', 'SIM-0002'],
+                                                          selected=['SIM-0001', 'SIM-0002']))
+    plugin.settings.child('exposure').setValue(5.)
+    status = plugin.ini_detector()
+    assert status.initialized, status.info
+    try:
+        data = _grab(qapp, plugin, ngrabs=3)
+        assert [channel['name'] for channel in data] == ['SIM-0001', 'SIM-0002', 'Skew']
+        assert data[0]['data'][0].shape == data[1]['data'][0].shape == (512, 512)
+        # Changed while acquiring: the acquisition starts again, grabs still getting their data
+        for path, value in [('exposure', 10.), ('match_mode', 'Timestamp')]:
+            plugin.grab_data()
+            _set(plugin, path, value)
+            assert plugin.acquisition.running
+            data = _grab(qapp, plugin)
+            assert len(data) == 3
+        assert plugin.acquisition.matcher.mode == 'Timestamp'
+        plugin.stop()
+        assert plugin.settings.child('sync', 'sets_per_s').value() > 0
+    finally:
+        _close(plugin)
+    assert plugin.cameras == [] and plugin.callback_thread is None
+
+
+def test_2D_separate_process(qapp):
+    plugin = _open(DAQ_2DViewer_picam, **{'separate_process': True, 'simulation.sensor_width': 64,
+                                          'simulation.sensor_height': 32})
+    try:
+        assert plugin.controller.transient_frames
+        data = _grab(qapp, plugin, ngrabs=3)
+        assert data[0]['data'][0].shape == (32, 64)
+    finally:
+        _close(plugin)
+
+
+def test_2D_frame_statistics(qapp):
+    plugin = _open(DAQ_2DViewer_picam, **{'simulation.sensor_width': 64, 'simulation.sensor_height': 32})
+    try:
+        _set(plugin, 'statistics.selected', dict(all_items=plugin.statistics.statistics, selected=['Sum', 'Max']))
+        data = _grab(qapp, plugin)
+        channels = {channel['name']: channel for channel in data}
+        frame = channels['Picam']['data'][0]
+        assert channels['Picam_statistics']['labels'] == ['Sum', 'Max']
+        assert channels['Picam_statistics']['data'][0][0] == frame.sum()
+        assert channels['Picam_statistics']['data'][1][0] == frame.max()
+    finally:
+        _close(plugin)
+
+
+def test_0D_viewer(qapp):
+    plugin = _open(DAQ_0DViewer_picam)
+    try:
+        data = _grab(qapp, plugin, ngrabs=2)
+        # No frames, only 0D data
+        assert all(channel['dim'] == 'Data0D' for channel in data)
+        assert data[0]['name'] == 'Picam_statistics'
+        assert data[0]['labels'] == ['Sum', 'Max', 'Saturated pixels', 'Centroid x', 'Centroid y']
+        assert data[0]['data'][2][0] == 0
+    finally:
+        _close(plugin)
+
+
+@pytest.mark.parametrize('can_set_online', [True, False])
+def test_2D_auto_exposure(qapp, can_set_online):
+    plugin = _open(DAQ_2DViewer_picam, **{'simulation.sensor_width': 64, 'simulation.sensor_height': 32,
+                                          'auto_exposure.settling': 1, 'auto_exposure.subsampling': 1})
+    try:
+        # Otherwise the acquisition is stopped to change the exposure time and restarted by the next grab
+        plugin.controller.get_attribute('Exposure Time').can_set_online = can_set_online
+        _set(plugin, 'settable_camera_parameters.exposure_time', 1.)
+        _set(plugin, 'auto_exposure.mode', 'Once')
+        # The exposure time is only changed by the grabs, never while the data are emitted
+        stop, apply_changes = plugin.stop, plugin.apply_changes
+        calls = []
+
+        def caller():
+            return 'grab_data' if any(frame.name == 'grab_data' for frame in traceback.extract_stack()) else 'other'
+        plugin.stop = lambda: calls.append(('stop', caller())) or stop()
+        plugin.apply_changes = lambda changes: calls.append(('apply', caller())) or apply_changes(changes)
+        for _ in range(30):
+            _grab(qapp, plugin)
+            if plugin.settings.child('auto_exposure', 'mode').value() == 'Off':
+                break
+        assert set(calls) == ({('apply', 'grab_data'), ('stop', 'grab_data')} if not can_set_online else
+                              {('apply', 'grab_data')})
+        assert plugin.settings.child('auto_exposure', 'state').value() == 'Converged'
+        assert plugin.settings.child('auto_exposure', 'fill').value() == pytest.approx(70., abs=5.)
+        assert plugin.controller.get_attribute_value('Exposure Time') > 1.
+        assert plugin.settings.child('settable_camera_parameters', 'exposure_time').value() == \
+            plugin.controller.get_attribute_value('Exposure Time')
+    finally:
+        _close(plugin)